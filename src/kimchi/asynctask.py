@@ -19,14 +19,186 @@
 
 import cherrypy
 import threading
+import time
 import traceback
 
 
+from collections import defaultdict
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+
+from kimchi.config import config
 from kimchi.exception import OperationFailed
+from kimchi.notifier import notifier
+
+
+class TaskScheduler(object):
+    """
+    Run the tasks in background threads, at most "workers" tasks at once and
+    at most limits[category] tasks of each category listed in "limits". The
+    other tasks wait in a FIFO queue, in the 'queued' state, and can still be
+    cancelled there.
+
+    A task started by a running task does not count against "workers", only
+    against the limit of its category: its parent task usually waits for it,
+    so queuing it behind other parents could leave all the workers waiting.
+    """
+    def __init__(self, workers, limits=None):
+        self.workers = workers
+        self.limits = limits or {}
+        self._lock = threading.Lock()
+        self._queue = []
+        self._running = 0
+        self._running_by_category = defaultdict(int)
+        self._local = threading.local()
+
+    def submit(self, task):
+        task.nested = getattr(self._local, 'task', None) is not None
+        with self._lock:
+            self._queue.append(task)
+            tasks = self._dispatch()
+        self._start(tasks)
+
+    def cancel(self, task_id):
+        """
+        Remove the task from the queue. Return False if it is not queued.
+        """
+        with self._lock:
+            for task in self._queue:
+                if task.id == task_id:
+                    self._queue.remove(task)
+                    break
+            else:
+                return False
+
+        task._status_cb('Cancelled', False)
+        return True
+
+    def _can_run(self, task):
+        if not task.nested and self._running >= self.workers:
+            return False
+        limit = self.limits.get(task.category)
+        running = self._running_by_category[task.category]
+        return limit is None or running < limit
+
+    def _dispatch(self):
+        """
+        Dequeue the tasks which can run now and return them, to be started
+        by _start() once self._lock is released.
+        Must be called with self._lock held.
+        """
+        tasks = []
+        for task in list(self._queue):
+            if not self._can_run(task):
+                continue
+
+            self._queue.remove(task)
+            if not task.nested:
+                self._running += 1
+            self._running_by_category[task.category] += 1
+            task.status = 'running'
+            tasks.append(task)
+        return tasks
+
+    def _release(self, task):
+        # must be called with self._lock held
+        if not task.nested:
+            self._running -= 1
+        self._running_by_category[task.category] -= 1
+
+    def _start(self, tasks):
+        tasks = list(tasks)
+        while tasks:
+            task = tasks.pop(0)
+            try:
+                task._save_helper()
+                thread = threading.Thread(target=self._run, args=(task,))
+                thread.setDaemon(True)
+                thread.start()
+            except Exception as e:
+                cherrypy.log.error_log.error("Unable to start async_task "
+                                             "%s: %s" % (task.id, e))
+                with self._lock:
+                    self._release(task)
+                    tasks.extend(self._dispatch())
+                try:
+                    task._status_cb("Unable to start the task: %s" % e,
+                                    False)
+                except Exception:
+                    # the task is failed and woken up anyway
+                    pass
+            else:
+                notifier.notify('tasks')
+
+    def _run(self, task):
+        self._local.task = task
+        try:
+            task._run_helper(task.opaque, task._status_cb)
+        finally:
+            self._local.task = None
+            with self._lock:
+                self._release(task)
+                tasks = self._dispatch()
+            self._start(tasks)
+
+
+# minimum time, in seconds, between two writes of the progress messages of a
+# task to the object store
+PROGRESS_SAVE_INTERVAL = 1
+
+# the tasks not finished yet, by id: their progress is read from here, as the
+# object store may not have the last message
+live_tasks = {}
+
+
+class FinishedTasks(object):
+    """
+    The ids of the finished tasks, in the order they ended, so the oldest
+    ones can be removed from the object store (see TasksModel).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = OrderedDict()
+
+    def add(self, task):
+        with self._lock:
+            self._tasks[task.id] = (time.time(), task.objstore)
+
+    def pop_expired(self, objstore, ttl, max_count):
+        """
+        Forget and return the ids of the tasks of objstore which ended more
+        than ttl seconds ago, or which are not among the max_count last ones.
+        """
+        with self._lock:
+            ids = [ident for ident, (_, store) in self._tasks.iteritems()
+                   if store is objstore]
+            expired = ids[:max(len(ids) - max_count, 0)]
+            limit = time.time() - ttl
+            for ident in ids[len(expired):]:
+                if self._tasks[ident][0] >= limit:
+                    break
+                expired.append(ident)
+
+            for ident in expired:
+                del self._tasks[ident]
+            return expired
+
+
+finished_tasks = FinishedTasks()
+
+
+scheduler = TaskScheduler(
+    config.getint('tasks', 'workers'),
+    {'disk_copy': config.getint('tasks', 'max_disk_copies'),
+     'transfer': config.getint('tasks', 'max_transfers')})
 
 
 class AsyncTask(object):
-    def __init__(self, id, target_uri, fn, objstore, opaque=None):
+    def __init__(self, id, target_uri, fn, objstore, opaque=None,
+                 category=None):
         if objstore is None:
             raise OperationFailed("KCHASYNC0001E")
 
@@ -34,35 +206,90 @@ class AsyncTask(object):
         self.target_uri = target_uri
         self.fn = fn
         self.objstore = objstore
-        self.status = 'running'
+        self.opaque = opaque
+        self.category = category
+        self.status = 'queued'
         self.message = 'OK'
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._flush_timer = None
         self._save_helper()
+        live_tasks[self.id] = self
         self._cp_request = cherrypy.serving.request
-        self.thread = threading.Thread(target=self._run_helper,
-                                       args=(opaque, self._status_cb))
-        self.thread.setDaemon(True)
-        self.thread.start()
+        scheduler.submit(self)
 
     def _status_cb(self, message, success=None):
+        self.message = message
         if success is None:
-            self.message = message
-            self._save_helper()
+            # the progress messages are only written to the object store,
+            # and notified to the long-polling requests, every
+            # PROGRESS_SAVE_INTERVAL seconds: the last one of a burst is
+            # written by a timer at the end of the interval
+            with self._lock:
+                if self._flush_timer is not None:
+                    return
+                delay = self._saved + PROGRESS_SAVE_INTERVAL - time.time()
+                if delay > 0:
+                    self._flush_timer = threading.Timer(delay,
+                                                        self._flush_progress)
+                    self._flush_timer.setDaemon(True)
+                    self._flush_timer.start()
+                    return
+                self._save_helper()
+            notifier.notify('tasks')
             return
 
-        if success is not None:
-            self.status = 'finished' if success else 'failed'
-        self.message = message
-        self._save_helper()
+        try:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                self.status = 'finished' if success else 'failed'
+                self._save_helper()
+        finally:
+            live_tasks.pop(self.id, None)
+            finished_tasks.add(self)
+            self._done.set()
+            notifier.notify('tasks')
 
-    def _save_helper(self):
-        obj = {}
+    def _flush_progress(self):
+        with self._lock:
+            self._flush_timer = None
+            # the end of the task is saved and notified by _status_cb()
+            if self.status != 'running':
+                return
+            try:
+                self._save_helper()
+            except OperationFailed as e:
+                cherrypy.log.error_log.error("Unable to save the progress of "
+                                             "async_task %s: %s" %
+                                             (self.id, e.message))
+                return
+        notifier.notify('tasks')
+
+    def wait(self, timeout=None):
+        """
+        Wait for the end of the task, at most "timeout" seconds. Return False
+        if it is still queued or running.
+        """
+        # Event.wait() only returns the flag since python 2.7
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def get_info(self):
+        info = {}
         for attr in ('id', 'target_uri', 'message', 'status'):
-            obj[attr] = getattr(self, attr)
+            info[attr] = getattr(self, attr)
+        return info
+
+    def _save_helper(self):
+        obj = self.get_info()
         try:
             with self.objstore as session:
                 session.store('task', self.id, obj)
         except Exception as e:
             raise OperationFailed('KCHASYNC0002E', {'err': e.message})
+        self._saved = time.time()
 
     def _run_helper(self, opaque, cb):
         cherrypy.serving.request = self._cp_request
@@ -18,18 +18,98 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 import cherrypy
-import re
+import hashlib
+import itertools
+import time
 import urllib2
+import uuid
 
 
 import kimchi.template
 from kimchi.auth import USER_GROUPS, USER_NAME, USER_ROLES
 from kimchi.control.utils import get_class_name, internal_redirect, model_fn
-from kimchi.control.utils import parse_request, validate_method
-from kimchi.control.utils import validate_params
+from kimchi.control.utils import parse_fields, parse_request, parse_wait
+from kimchi.control.utils import validate_method, validate_params
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import KimchiException, MissingParameter, NotFoundError
 from kimchi.exception import OperationFailed, UnauthorizedError
+from kimchi.notifier import notifier
+from kimchi.utils import compile_filter
+
+
+# attributes required by Resource.is_authorized()
+AUTH_FIELDS = set(['users', 'groups'])
+
+# parameters of a GET request on any collection, handled by Collection.get()
+# and not validated against the schema of the collection
+LIST_PARAMS = set(['_fields', '_sort', '_offset', '_limit'])
+
+
+# the generations of the notifier start again from 0 with the server, so the
+# tags derived from them also identify the server run
+_RUN_ID = uuid.uuid4().hex
+
+
+def validate_change(topic):
+    """
+    Tag the response of a JSON GET request with the generation of "topic",
+    before it is computed, and answer "304 Not Modified" when the client
+    already holds it (If-None-Match). Only done for the tracked topics, whose
+    every change is notified (see ChangeNotifier.track()); the other
+    responses are tagged with a hash of their body when rendered.
+    The tag also depends on the request URI and on the user, as the response
+    only lists the Resources the user is authorized to.
+    """
+    if (topic is None or not notifier.is_tracked(topic) or
+            not kimchi.template.can_accept('application/json')):
+        return
+
+    request = cherrypy.request
+    session = cherrypy.session
+    key = [_RUN_ID, topic, notifier.get_generation(topic),
+           request.path_info, request.query_string,
+           session.get(USER_NAME, ''), sorted(session.get(USER_GROUPS, [])),
+           sorted(session.get(USER_ROLES, {}).items())]
+    kimchi.template.set_etag(hashlib.md5(repr(key)).hexdigest())
+
+
+def wait_for_change(get, wait, topic=None):
+    """
+    Render the response of a GET request with get(). While the client already
+    holds it (see template.validate_etag()), wait for a change notified for
+    "topic" (any change if None) and render it again, for at most "wait"
+    seconds: this lets the clients track the changes with long-polling
+    requests instead of polling periodically.
+    """
+    deadline = time.time() + wait
+    while True:
+        generation = notifier.get_generation(topic)
+        try:
+            return get()
+        except cherrypy.HTTPRedirect, e:
+            if e.status != 304 or time.time() >= deadline:
+                raise
+        # cherrypy only validates the ETag once per response
+        del cherrypy.serving.response.ETag
+        notifier.wait(generation, deadline - time.time(), topic)
+
+
+def auth_fields(role_key):
+    """
+    Return the attributes Resource.is_authorized() needs to authorize the
+    user of the session on the Resources of "role_key": none for an admin,
+    who is always authorized, so they are only computed when requested.
+    """
+    user_role = cherrypy.session.get(USER_ROLES, {}).get(role_key)
+    if user_role == 'admin':
+        return set()
+    return AUTH_FIELDS
+
+
+def filter_fields(data, fields):
+    if fields is None:
+        return data
+    return dict((key, val) for key, val in data.iteritems() if key in fields)
 
 
 class Resource(object):
@@ -49,6 +129,10 @@ class Resource(object):
 
     - Set the 'data' property to a JSON-serializable representation of the
       Resource.
+
+    - Set self.sparse_fields to True if the 'lookup' model method accepts the
+      '_fields' parameter: the set of attributes requested by the client, so
+      the expensive ones can be skipped when they are not needed.
     """
     def __init__(self, model, ident=None):
         self.model = model
@@ -56,6 +140,10 @@ class Resource(object):
         self.model_args = (ident,)
         self.role_key = None
         self.admin_methods = []
+        # topic of the changes which wake up the long-polling GET requests
+        self.change_topic = None
+        self.sparse_fields = False
+        self.fields = None
 
     def _redirect(self, action_result, code=303):
         if isinstance(action_result, list):
@@ -137,7 +225,11 @@ class Resource(object):
     def lookup(self):
         try:
             lookup = getattr(self.model, model_fn(self, 'lookup'))
-            self.info = lookup(*self.model_args)
+            if self.sparse_fields and self.fields is not None:
+                fields = self.fields | auth_fields(self.role_key)
+                self.info = lookup(*self.model_args, _fields=fields)
+            else:
+                self.info = lookup(*self.model_args)
         except AttributeError:
             self.info = {}
 
@@ -156,17 +248,22 @@ class Resource(object):
             raise cherrypy.HTTPError(400, e.message)
 
     @cherrypy.expose
-    def index(self):
+    def index(self, **kwargs):
         method = validate_method(('GET', 'DELETE', 'PUT'),
                                  self.role_key, self.admin_methods)
 
         try:
+            if method == 'GET':
+                self.fields = parse_fields(kwargs.get('_fields'))
+                wait = parse_wait(kwargs.get('_wait'))
+                return wait_for_change(self._get_authorized, wait,
+                                       self.change_topic)
+
             self.lookup()
             if not self.is_authorized():
                 raise UnauthorizedError('KCHAPI0009E')
 
-            return {'GET': self.get,
-                    'DELETE': self.delete,
+            return {'DELETE': self.delete,
                     'PUT': self.update}[method]()
         except InvalidOperation, e:
             raise cherrypy.HTTPError(400, e.message)
@@ -181,6 +278,14 @@ class Resource(object):
         except KimchiException, e:
             raise cherrypy.HTTPError(500, e.message)
 
+    def _get_authorized(self):
+        # the Resource is not even looked up when the client holds it
+        validate_change(self.change_topic)
+        self.lookup()
+        if not self.is_authorized():
+            raise UnauthorizedError('KCHAPI0009E')
+        return self.get()
+
     def is_authorized(self):
         user_name = cherrypy.session.get(USER_NAME, '')
         user_groups = cherrypy.session.get(USER_GROUPS, [])
@@ -213,7 +318,8 @@ class Resource(object):
 
     def get(self):
         self.lookup()
-        return kimchi.template.render(get_class_name(self), self.data)
+        return kimchi.template.render(get_class_name(self),
+                                      filter_fields(self.data, self.fields))
 
     @property
     def data(self):
@@ -240,14 +346,29 @@ class Collection(object):
       needs additional information to identify this Collection.
 
     - Implement the base operations of 'create' and 'get_list' in the model.
+
+    - Optionally implement 'get_list_detailed' in the model to return the
+      (ident, info) tuples of all the Resources at once.  It is used instead
+      of 'get_list' plus one 'lookup' per Resource when listing.  Besides the
+      flag filters, it receives the '_fields' parameter (see Resource).  It
+      may return a generator so only the Resources of the requested page are
+      looked up.
+
+    - Optionally set self.model_filters to the Resource properties which the
+      model is able to filter on cheaply.  When the request filters on them,
+      the filter values are also passed to the model as '_<property>' flag
+      parameters, so it can skip the Resources which do not match.
     """
     def __init__(self, model):
         self.model = model
         self.resource = Resource
         self.resource_args = []
         self.model_args = []
+        self.model_filters = []
         self.role_key = None
         self.admin_methods = []
+        # topic of the changes which wake up the long-polling GET requests
+        self.change_topic = None
 
     def create(self, params, *args):
         try:
@@ -267,7 +388,21 @@ class Collection(object):
         return res.get()
 
     def _get_resources(self, flag_filter):
+        fields = flag_filter.pop('_fields', None)
         try:
+            # The model may provide the information of all resources at once
+            # through <collection>_get_list_detailed(), which returns a list
+            # of (ident, info) tuples, instead of one lookup per resource
+            get_list_detailed = getattr(self.model,
+                                        model_fn(self, 'get_list_detailed'),
+                                        None)
+            if get_list_detailed is not None:
+                if fields is not None:
+                    fields = fields | auth_fields(self.role_key)
+                    flag_filter['_fields'] = fields
+                items = get_list_detailed(*self.model_args, **flag_filter)
+                return self._get_detailed_resources(items)
+
             get_list = getattr(self.model, model_fn(self, 'get_list'))
             idents = get_list(*self.model_args, **flag_filter)
             res_list = []
@@ -275,12 +410,21 @@ class Collection(object):
                 # internal text, get_list changes ident to unicode for sorted
                 args = self.resource_args + [ident]
                 res = self.resource(self.model, *args)
+                res.fields = fields
                 res.lookup()
                 res_list.append(res)
             return res_list
         except AttributeError:
             return []
 
+    def _get_detailed_resources(self, items):
+        # the Resources are built as they are consumed
+        for ident, info in items:
+            args = self.resource_args + [ident]
+            res = self.resource(self.model, *args)
+            res.info = info
+            yield res
+
     def _cp_dispatch(self, vpath):
         if vpath:
             ident = vpath.pop(0)
@@ -290,19 +434,47 @@ class Collection(object):
             return self.resource(self.model, *args)
 
     def filter_data(self, resources, fields_filter):
-        data = []
+        filters = [(key, compile_filter(val))
+                   for key, val in fields_filter.iteritems()]
         for res in resources:
             if not res.is_authorized():
                 continue
 
-            if all(key in res.data and
-                   (res.data[key] == val or res.data[key] in val or
-                    re.match(str(val), res.data[key]))
-                   for key, val in fields_filter.iteritems()):
-                data.append(res.data)
-        return data
+            data = res.data
+            if all(key in data and match(data[key]) for key, match in filters):
+                yield data
+
+    def _get_paging(self, flag_filter):
+        def _get_int(param):
+            value = flag_filter.pop(param, None)
+            if value is None:
+                return None
+            try:
+                val = int(value)
+            except ValueError:
+                val = -1
+            if val < 0:
+                raise InvalidParameter('KCHAPI0010E', {'param': param,
+                                                       'value': value})
+            return val
+
+        offset = _get_int('_offset') or 0
+        limit = _get_int('_limit')
+        end = offset + limit if limit is not None else None
+
+        # "_sort=<property>" sorts in ascending order and
+        # "_sort=-<property>" in descending order
+        sort_key = flag_filter.pop('_sort', None)
+        reverse = False
+        if sort_key is not None and sort_key.startswith('-'):
+            sort_key = sort_key[1:]
+            reverse = True
+        return sort_key, reverse, offset, end
 
     def get(self, filter_params):
+        # the Resources are not even listed when the client holds them
+        validate_change(self.change_topic)
+
         def _split_filter(params):
             flag_filter = dict()
             fields_filter = params
@@ -312,8 +484,28 @@ class Collection(object):
             return flag_filter, fields_filter
 
         flag_filter, fields_filter = _split_filter(filter_params)
+        sort_key, reverse, offset, end = self._get_paging(flag_filter)
+        fields = parse_fields(flag_filter.pop('_fields', None))
+        if fields is not None:
+            # the filtered and sorted attributes must be retrieved as well
+            needed = fields | set(fields_filter.keys())
+            if sort_key is not None:
+                needed.add(sort_key)
+            flag_filter['_fields'] = needed
+
+        for key in self.model_filters:
+            if key in fields_filter:
+                flag_filter['_' + key] = fields_filter[key]
+
         resources = self._get_resources(flag_filter)
         data = self.filter_data(resources, fields_filter)
+        if sort_key is not None:
+            data = sorted(data, key=lambda item: item.get(sort_key),
+                          reverse=reverse)
+        # without sorting, the Resources after the requested page are not even
+        # looked up when the model returns a generator
+        data = itertools.islice(data, offset, end)
+        data = [filter_fields(item, fields) for item in data]
         return kimchi.template.render(get_class_name(self), data)
 
     @cherrypy.expose
@@ -324,8 +516,14 @@ class Collection(object):
         try:
             if method == 'GET':
                 filter_params = cherrypy.request.params
-                validate_params(filter_params, self, 'get_list')
-                return self.get(filter_params)
+                wait = parse_wait(filter_params.pop('_wait', None))
+                validate_params(dict((key, val) for key, val
+                                     in filter_params.iteritems()
+                                     if key not in LIST_PARAMS),
+                                self, 'get_list')
+                # get() consumes the parameters, so each call gets a copy
+                return wait_for_change(lambda: self.get(dict(filter_params)),
+                                       wait, self.change_topic)
             elif method == 'POST':
                 return self.create(parse_request(), *args)
         except InvalidOperation, e:
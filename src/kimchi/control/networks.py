@@ -36,6 +36,7 @@ class Network(Resource):
         self.role_key = 'network'
         self.admin_methods = ['PUT', 'POST', 'DELETE']
         self.uri_fmt = "/networks/%s"
+        self.sparse_fields = True
         self.activate = self.generate_action_handler('activate')
         self.deactivate = self.generate_action_handler('deactivate',
                                                        destructive=True)
@@ -43,8 +44,8 @@ class Network(Resource):
     @property
     def data(self):
         return {'name': self.ident,
-                'vms': self.info['vms'],
-                'in_use': self.info['in_use'],
+                'vms': self.info.get('vms'),
+                'in_use': self.info.get('in_use'),
                 'autostart': self.info['autostart'],
                 'connection': self.info['connection'],
                 'interface': self.info['interface'],
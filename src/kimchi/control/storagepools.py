@@ -32,8 +32,10 @@ class StoragePools(Collection):
     def __init__(self, model):
         super(StoragePools, self).__init__(model)
         self.role_key = 'storage'
+        self.change_topic = 'storagepools'
         self.admin_methods = ['POST']
         self.resource = StoragePool
+        self.model_filters = ['type']
         isos = IsoPool(model)
         setattr(self, ISO_POOL_NAME, isos)
 
@@ -61,6 +63,7 @@ class StoragePools(Collection):
     def _get_resources(self, filter_params):
         try:
             res_list = super(StoragePools, self)._get_resources(filter_params)
+            res_list = list(res_list)
             # Append reserved pools
             isos = getattr(self, ISO_POOL_NAME)
             isos.lookup()
@@ -75,11 +78,14 @@ class StoragePool(Resource):
     def __init__(self, model, ident):
         super(StoragePool, self).__init__(model, ident)
         self.role_key = 'storage'
+        self.change_topic = 'storagepools'
         self.admin_methods = ['PUT', 'POST', 'DELETE']
         self.uri_fmt = "/storagepools/%s"
+        self.sparse_fields = True
         self.activate = self.generate_action_handler('activate')
         self.deactivate = self.generate_action_handler('deactivate',
                                                        destructive=True)
+        self.refresh = self.generate_action_handler('refresh')
         self.storagevolumes = StorageVolumes(self.model, ident)
 
     @property
@@ -92,7 +98,7 @@ class StoragePool(Resource):
                'path': self.info['path'],
                'source': self.info['source'],
                'type': self.info['type'],
-               'nr_volumes': self.info['nr_volumes'],
+               'nr_volumes': self.info.get('nr_volumes'),
                'autostart': self.info['autostart'],
                'persistent': self.info['persistent']}
 
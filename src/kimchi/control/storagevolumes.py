@@ -45,6 +45,7 @@ class StorageVolume(Resource):
         self.info = {}
         self.model_args = [self.pool, self.ident]
         self.uri_fmt = '/storagepools/%s/storagevolumes/%s'
+        self.sparse_fields = True
         self.resize = self.generate_action_handler('resize', ['size'])
         self.wipe = self.generate_action_handler('wipe')
         self.clone = self.generate_action_handler_task('clone')
@@ -56,7 +57,7 @@ class StorageVolume(Resource):
                'capacity': self.info['capacity'],
                'allocation': self.info['allocation'],
                'path': self.info['path'],
-               'ref_cnt': self.info['ref_cnt'],
+               'ref_cnt': self.info.get('ref_cnt'),
                'format': self.info['format']}
 
         for key in ('os_version', 'os_distro', 'bootable', 'base'):
@@ -26,11 +26,14 @@ class Tasks(Collection):
     def __init__(self, model):
         super(Tasks, self).__init__(model)
         self.resource = Task
+        self.change_topic = 'tasks'
 
 
 class Task(Resource):
     def __init__(self, model, id):
         super(Task, self).__init__(model, id)
+        self.change_topic = 'tasks'
+        self.cancel = self.generate_action_handler('cancel')
 
     @property
     def data(self):
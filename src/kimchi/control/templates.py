@@ -43,7 +43,7 @@ class Template(Resource):
         return {
             'name': self.ident,
             'icon': self.info['icon'],
-            'invalid': self.info['invalid'],
+            'invalid': self.info.get('invalid'),
             'os_distro': self.info['os_distro'],
             'os_version': self.info['os_version'],
             'cpus': self.info['cpus'],
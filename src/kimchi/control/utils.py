@@ -30,6 +30,10 @@ from kimchi.exception import InvalidParameter, OperationFailed
 from kimchi.utils import import_module, listPathModules
 
 
+# longest wait, in seconds, of a GET request with the '_wait' parameter
+MAX_WAIT = 30
+
+
 def get_class_name(cls):
     try:
         sub_class = cls.__subclasses__()[0]
@@ -90,6 +94,29 @@ def parse_request():
         raise cherrypy.HTTPError(415, e.message)
 
 
+def parse_fields(fields):
+    """Return the set of attributes requested by the '_fields' parameter, a
+    comma separated list, or None if all of them are requested."""
+    if fields is None:
+        return None
+    return set(field.strip() for field in fields.split(',') if field.strip())
+
+
+def parse_wait(value):
+    """Return the number of seconds requested by the '_wait' parameter, at
+    most MAX_WAIT, or 0 if it is not given."""
+    if value is None:
+        return 0
+    try:
+        wait = int(value)
+        if wait < 0:
+            raise ValueError
+    except ValueError:
+        raise InvalidParameter('KCHAPI0010E', {'param': '_wait',
+                                               'value': value})
+    return min(wait, MAX_WAIT)
+
+
 def internal_redirect(url):
     raise cherrypy.InternalRedirect(url.encode("utf-8"))
 
@@ -0,0 +1,34 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2015
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+
+from kimchi.control.base import Resource
+from kimchi.control.utils import UrlSubNode
+
+
+@UrlSubNode("statshistory")
+class VMStatsHistory(Resource):
+    def __init__(self, model, vm):
+        super(VMStatsHistory, self).__init__(model, vm)
+        self.role_key = 'guests'
+        self.uri_fmt = '/vms/%s/statshistory'
+
+    @property
+    def data(self):
+        return self.info
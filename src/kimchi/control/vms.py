@@ -28,17 +28,19 @@ class VMs(Collection):
         super(VMs, self).__init__(model)
         self.resource = VM
         self.role_key = 'guests'
+        self.change_topic = 'vms'
         self.admin_methods = ['POST']
+        self.model_filters = ['state']
 
 
 class VM(Resource):
     def __init__(self, model, ident):
         super(VM, self).__init__(model, ident)
         self.role_key = 'guests'
+        self.change_topic = 'vms'
         self.screenshot = VMScreenShot(model, ident)
         self.uri_fmt = '/vms/%s'
-        for ident, node in sub_nodes.items():
-            setattr(self, ident, node(model, self.ident))
+        self.sparse_fields = True
         self.start = self.generate_action_handler('start')
         self.poweroff = self.generate_action_handler('poweroff',
                                                      destructive=True)
@@ -49,6 +51,16 @@ class VM(Resource):
         self.connect = self.generate_action_handler('connect')
         self.clone = self.generate_action_handler_task('clone')
 
+    def __getattr__(self, name):
+        # The sub-collections are only built when a request is dispatched to
+        # them, so listing the VMs does not need to build them for every VM
+        if name not in sub_nodes:
+            raise AttributeError(name)
+
+        node = sub_nodes[name](self.model, self.ident)
+        setattr(self, name, node)
+        return node
+
     @property
     def data(self):
         return self.info
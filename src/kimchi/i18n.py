@@ -31,10 +31,12 @@ messages = {
     "KCHAPI0007E": _("This API only supports JSON"),
     "KCHAPI0008E": _("Parameters does not match requirement in schema: %(err)s"),
     "KCHAPI0009E": _("You don't have permission to perform this operation."),
+    "KCHAPI0010E": _("Invalid value %(value)s for parameter %(param)s. It must be a non-negative integer."),
 
     "KCHASYNC0001E": _("Datastore is not initiated in the model object."),
     "KCHASYNC0002E": _("Unable to start task due error: %(err)s"),
     "KCHASYNC0003E": _("Timeout of %(seconds)s seconds expired while running task '%(task)s."),
+    "KCHASYNC0004E": _("Unable to cancel task %(id)s. Only the queued tasks can be cancelled."),
 
     "KCHAUTH0001E": _("Authentication failed for user '%(username)s'. [Error code: %(code)s]"),
     "KCHAUTH0002E": _("You are not authorized to access Kimchi"),
@@ -188,6 +190,8 @@ messages = {
     "KCHPOOL0035E": _("Unable to delete pool %(name)s as it is associated with some templates"),
     "KCHPOOL0036E": _("A volume group named '%(name)s' already exists. Please, choose another name to create the logical pool."),
     "KCHPOOL0037E": _("Unable to update database with deep scan information due error: %(err)s"),
+    "KCHPOOL0038E": _("Unable to refresh inactive storage pool %(name)s"),
+    "KCHPOOL0039E": _("Unable to refresh storage pool %(name)s. Details: %(err)s"),
 
     "KCHVOL0001E": _("Storage volume %(name)s already exists"),
     "KCHVOL0002E": _("Storage volume %(name)s does not exist in storage pool %(pool)s"),
@@ -263,6 +267,7 @@ messages = {
     "KCHPKGUPD0004E": _("There is no compatible package manager for this system."),
 
     "KCHOBJST0001E": _("Unable to find %(item)s in datastore"),
+    "KCHOBJST0002E": _("Timed out waiting %(seconds)s seconds for a datastore connection"),
 
     "KCHUTILS0001E": _("Invalid URI %(uri)s"),
     "KCHUTILS0002E": _("Timeout while running command '%(cmd)s' after %(seconds)s seconds"),
@@ -27,7 +27,7 @@ import sys
 import urllib2
 
 
-from kimchi.exception import IsoFormatError
+from kimchi.exception import IsoFormatError, NotFoundError
 from kimchi.utils import check_url_path, kimchi_log
 
 
@@ -147,6 +147,7 @@ class IsoImage(object):
         self.remote = self._is_iso_remote()
         self.volume_id = None
         self.bootable = False
+        self._fd = None
         self._scan()
 
     def _is_iso_remote(self):
@@ -162,16 +163,9 @@ class IsoImage(object):
         if not self.bootable:
             raise IsoFormatError("KCHISO0002E", {'filename': self.path})
 
-        matcher = Matcher(self.volume_id)
-
-        for d, v, regex in iso_dir:
-            if matcher.search(regex):
-                distro = d
-                if hasattr(v, '__call__'):
-                    version = v(matcher)
-                else:
-                    version = v
-                return (distro, version)
+        res = iso_matcher.match(self.volume_id)
+        if res is not None:
+            return res
 
         msg = "probe_iso: Unable to identify ISO %s with Volume ID: %s"
         kimchi_log.debug(msg, self.path, self.volume_id)
@@ -320,10 +314,11 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
 
         # We need to find the sector size of this dir entry. The
         # size of the File Section is located 10 bytes after
-        # the dir location.
+        # the dir location, in the first sector of the dir, which
+        # is read along.
         DIR_SIZE_FMT = struct.Struct("<10sI")
-        data = self._get_iso_data(ppc_dir_offset, DIR_SIZE_FMT.size)
-        unused, dir_size = self._unpack(DIR_SIZE_FMT, data)
+        dir_data = self._get_iso_data(ppc_dir_offset, IsoImage.SECTOR_SIZE)
+        unused, dir_size = self._unpack(DIR_SIZE_FMT, dir_data)
         # If the dir is in the middle of a sector, the sector is
         # padded zero and won't be utilized. We need to round up
         # the result
@@ -331,6 +326,12 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
         if dir_size % IsoImage.SECTOR_SIZE:
             dir_sectorsize += 1
 
+        # Read all the sectors of the dir at once and parse its records
+        # from the buffer
+        if dir_sectorsize > 1:
+            dir_data = self._get_iso_data(
+                ppc_dir_offset, dir_sectorsize * IsoImage.SECTOR_SIZE)
+
         # Fixed-size directory record fields:
         # - length of directory record (1 byte)
         # - extended attr. record length (1 byte)
@@ -348,8 +349,6 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
         STATIC_DIR_RECORD_FMT = struct.Struct("<B 24s B 6s B")
         static_rec_size = STATIC_DIR_RECORD_FMT.size
 
-        # Maximum offset possible of all the records of this directory
-        DIR_REC_MAX = ppc_dir_offset + dir_sectorsize*IsoImage.SECTOR_SIZE
         # Max size of a given directory record
         MAX_DIR_SIZE = 255
         # Name of the boot file
@@ -358,15 +357,18 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
         # Loop until one of the following happens:
         # - boot file is found
         # - end of directory record listing for the 'ppc' dir
-        while ppc_dir_offset < DIR_REC_MAX:
-            record_data = self._get_iso_data(ppc_dir_offset, MAX_DIR_SIZE)
+        offset = 0
+        while offset + static_rec_size <= len(dir_data):
+            record_data = dir_data[offset:offset + MAX_DIR_SIZE]
             dir_rec_len, unused, file_flags, unused2, file_name_len = \
                 self._unpack(STATIC_DIR_RECORD_FMT, record_data)
 
-            # if dir_rec_len = 0, increment offset (skip the
-            # dir_rec_len byte) and continue the loop
+            # if dir_rec_len = 0, the rest of the sector is padding as
+            # the records do not cross sector boundaries: continue the
+            # loop in the next sector
             if dir_rec_len == 0:
-                ppc_dir_offset += 1
+                offset += IsoImage.SECTOR_SIZE - \
+                    offset % IsoImage.SECTOR_SIZE
                 continue
 
             # Get filename of the file/dir we're at.
@@ -383,7 +385,7 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
             padding = 0
             if not file_name_len % 2:
                 padding = 1
-            ppc_dir_offset += dir_rec_len + padding
+            offset += dir_rec_len + padding
         # If reached this point the file wasn't found = not bootable
         self.bootable = False
 
@@ -418,45 +420,131 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
             with contextlib.closing(urllib2.urlopen(request)) as response:
                 data = response.read()
         else:
-            with open(self.path) as fd:
-                fd.seek(offset)
-                data = fd.read(size)
+            self._fd.seek(offset)
+            data = self._fd.read(size)
 
         return data
 
     def _scan(self):
-        offset = 16 * IsoImage.SECTOR_SIZE
-        size = 4 * IsoImage.SECTOR_SIZE
-        data = self._get_iso_data(offset, size)
-        if len(data) < 2 * IsoImage.SECTOR_SIZE:
-            return
+        # a local image is read through the same file for the whole scan
+        if not self.remote:
+            self._fd = open(self.path, 'rb')
+        try:
+            offset = 16 * IsoImage.SECTOR_SIZE
+            size = 4 * IsoImage.SECTOR_SIZE
+            data = self._get_iso_data(offset, size)
+            if len(data) < 2 * IsoImage.SECTOR_SIZE:
+                return
 
-        self._scan_primary_vol(data)
-        if platform.machine().startswith('ppc'):
-            self._scan_ppc()
-        else:
-            self._scan_el_torito(data)
+            self._scan_primary_vol(data)
+            if platform.machine().startswith('ppc'):
+                self._scan_ppc()
+            else:
+                self._scan_el_torito(data)
+        finally:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
 
 
 class Matcher(object):
     """
-    Simple utility class to assist with matching a given string against a
-    series of regular expressions.
+    Identify the distro and version of a volume id with a table of
+    (distro, version, regex) entries like iso_dir.
+
+    The regular expressions are compiled once and searched in the table
+    order, so the first entry matching anywhere in the volume id wins.
     """
-    def __init__(self, matchstring):
-        self.matchstring = matchstring
+    def __init__(self, table):
+        self._entries = [(distro, version, re.compile(regex))
+                         for distro, version, regex in table]
+
+    def match(self, volume_id):
+        """
+        Return the (distro, version) of the first entry matching volume_id
+        or None.
+        """
+        for distro, version, regex in self._entries:
+            m = regex.search(volume_id)
+            if m is None:
+                continue
+
+            if hasattr(version, '__call__'):
+                version = version(m)
+            return (distro, version)
+        return None
 
-    def search(self, regex):
-        self.lastmatch = re.search(regex, self.matchstring)
-        return bool(self.lastmatch)
 
-    def group(self, num):
-        return self.lastmatch.group(num)
+iso_matcher = Matcher(iso_dir)
+
+
+def probe_iso_cached(objstore, path):
+    """
+    Return the (distro, version) of the ISO in path as IsoImage.probe() does,
+    reusing the result stored in objstore while the file keeps the same inode,
+    size and modification time. The remote ISOs are always probed.
+    The stored result of a local ISO which does not exist anymore is deleted.
+    """
+    try:
+        st = os.stat(path)
+        identity = {'inode': st.st_ino, 'size': st.st_size,
+                    'mtime': st.st_mtime}
+    except OSError:
+        identity = None
+        # the remote ISOs (URLs) are never stored
+        if objstore is not None and os.path.isabs(path):
+            try:
+                with objstore as session:
+                    session.delete('isoinfo', path, ignore_missing=True)
+            except Exception as e:
+                kimchi_log.warning('Unable to delete the ISO %s info from '
+                                   'objectstore due error: %s', path,
+                                   e.message)
+
+    info = None
+    if objstore is not None and identity is not None:
+        try:
+            with objstore as session:
+                info = session.get('isoinfo', path)
+        except NotFoundError:
+            pass
+
+    if info is None or any(info.get(key) != value
+                           for key, value in identity.iteritems()):
+        info = _probe_iso_info(path)
+        if objstore is not None and identity is not None:
+            info.update(identity)
+            try:
+                with objstore as session:
+                    session.store('isoinfo', path, info)
+            except Exception as e:
+                kimchi_log.warning('Unable to store the ISO %s info in '
+                                   'objectstore due error: %s', path,
+                                   e.message)
+
+    if info['error'] is not None:
+        raise IsoFormatError(info['error'], {'filename': path})
+    return info['distro'], info['version']
+
+
+def _probe_iso_info(path):
+    info = {'volume_id': None, 'bootable': False, 'distro': None,
+            'version': None, 'error': None}
+    try:
+        iso_img = IsoImage(path)
+        if iso_img.volume_id is not None:
+            info['volume_id'] = iso_img.volume_id.decode('utf-8', 'replace')
+        info['bootable'] = iso_img.bootable
+        info['distro'], info['version'] = iso_img.probe()
+    except IsoFormatError as e:
+        info['error'] = e.code
+    return info
 
 
 def probe_iso(status_helper, params):
     loc = params['path'].encode("utf-8")
     updater = params['updater']
+    objstore = params.get('objstore')
     ignore = False
     ignore_list = params.get('ignore_list', [])
 
@@ -478,14 +566,12 @@ def probe_iso(status_helper, params):
                     continue
                 iso = os.path.join(root, name)
                 try:
-                    iso_img = IsoImage(iso)
-                    ret = iso_img.probe()
+                    ret = probe_iso_cached(objstore, iso)
                     update_result(iso, ret)
                 except:
                     continue
     else:
-        iso_img = IsoImage(loc)
-        ret = iso_img.probe()
+        ret = probe_iso_cached(objstore, loc)
         update_result(loc, ret)
 
     if status_helper is not None:
@@ -41,7 +41,6 @@ from kimchi.model.storagevolumes import StorageVolumesModel
 from kimchi.model.templates import LibvirtVMTemplate
 from kimchi.model.users import PAMUsersModel
 from kimchi.model.groups import PAMGroupsModel
-from kimchi.objectstore import ObjectStore
 from kimchi.utils import add_task, get_next_clone_name
 from kimchi.vmtemplate import VMTemplate
 from kimchi.xmlutils.utils import xml_item_update
@@ -89,9 +88,8 @@ class MockModel(Model):
         PAMUsersModel.auth_type = 'fake'
         PAMGroupsModel.auth_type = 'fake'
 
+        # the models share the object store opened by Model, and its cache
         super(MockModel, self).__init__('test:///default', objstore_loc)
-        self.objstore_loc = objstore_loc
-        self.objstore = ObjectStore(objstore_loc)
 
         # The MockModel methods are instantiated on runtime according to Model
         # and BaseModel
@@ -122,9 +120,6 @@ class MockModel(Model):
         self._mock_swupdate = MockSoftwareUpdate()
         self._mock_repositories = MockRepositories()
 
-        if hasattr(self, 'objstore'):
-            self.objstore = ObjectStore(self.objstore_loc)
-
         params = {'vms': [u'test'], 'templates': [],
                   'networks': [u'default'], 'storagepools': [u'default-pool']}
 
@@ -299,12 +294,19 @@ class MockModel(Model):
 
         return self._model_storagevolumes_get_list(pool)
 
-    def _mock_storagevolume_lookup(self, pool, vol):
+    def _mock_storagevolumes_get_list_detailed(self, pool, _fields=None):
+        pool_info = self.storagepool_lookup(pool)
+        if pool_info['type'] == 'scsi':
+            return self._mock_storagevolumes.scsi_volumes.items()
+
+        return self._model_storagevolumes_get_list_detailed(pool, _fields)
+
+    def _mock_storagevolume_lookup(self, pool, vol, _fields=None):
         pool_info = self.storagepool_lookup(pool)
         if pool_info['type'] == 'scsi':
             return self._mock_storagevolumes.scsi_volumes[vol]
 
-        return self._model_storagevolume_lookup(pool, vol)
+        return self._model_storagevolume_lookup(pool, vol, _fields)
 
     def _mock_partitions_get_list(self):
         return self._mock_partitions.partitions.keys()
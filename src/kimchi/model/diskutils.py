@@ -18,7 +18,8 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 
-from kimchi.exception import OperationFailed, NotFoundError
+from kimchi.exception import OperationFailed
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.vms import VMModel, VMsModel
 from kimchi.utils import kimchi_log
 from kimchi.xmlutils.disk import get_vm_disk_info, get_vm_disks
@@ -30,25 +31,29 @@ from kimchi.xmlutils.disk import get_vm_disk_info, get_vm_disks
 
 
 def get_disk_ref_cnt(objstore, conn, path):
+    return get_disk_ref_cnts(objstore, conn, [path])[path]
+
+
+def get_disk_ref_cnts(objstore, conn, paths):
+    """
+    Return a dict with the reference count of each path in paths, read from
+    the object store at once.
+    """
     try:
         with objstore as session:
-            try:
-                ref_cnt = session.get('storagevolume', path)['ref_cnt']
-            except NotFoundError:
+            volumes = session.get_many('storagevolume', paths)
+            ref_cnts = dict((path, volume['ref_cnt'])
+                            for path, volume in volumes.iteritems())
+            missing = [path for path in set(paths) if path not in ref_cnts]
+            for path in missing:
                 kimchi_log.info('Volume %s not found in obj store.' % path)
-                ref_cnt = 0
-                # try to find this volume in existing vm
-                vms_list = VMsModel.get_vms(conn)
-                for vm in vms_list:
-                    dom = VMModel.get_vm(vm, conn)
-                    storages = get_vm_disks(dom)
-                    for disk in storages.keys():
-                        d_info = get_vm_disk_info(dom, disk)
-                        if path == d_info['path']:
-                            ref_cnt = ref_cnt + 1
+                ref_cnts[path] = _count_disk_users(conn, path)
+
+            if missing:
                 try:
-                    session.store('storagevolume', path,
-                                  {'ref_cnt': ref_cnt})
+                    session.store_many('storagevolume',
+                                       [(path, {'ref_cnt': ref_cnts[path]})
+                                        for path in missing])
                 except Exception as e:
                     # Let the exception be raised. If we allow disks'
                     #   ref_cnts to be out of sync, data corruption could
@@ -61,9 +66,27 @@ def get_disk_ref_cnt(objstore, conn, path):
                                           {'err': e.message})
     except Exception as e:
         # This exception is going to catch errors returned by 'with',
-        # specially ones generated by 'session.store'. It is outside
+        # specially ones generated by 'session.store_many'. It is outside
         # to avoid conflict with the __exit__ function of 'with'
         raise OperationFailed('KCHVOL0017E', {'err': e.message})
+    return ref_cnts
+
+
+def _count_disk_users(conn, path):
+    inventory = DomainInventory.get_inventory(conn)
+    if inventory is not None:
+        return len(inventory.get_disk_users(path))
+
+    # try to find this volume in existing vm
+    ref_cnt = 0
+    vms_list = VMsModel.get_vms(conn)
+    for vm in vms_list:
+        dom = VMModel.get_vm(vm, conn)
+        storages = get_vm_disks(dom)
+        for disk in storages.keys():
+            d_info = get_vm_disk_info(dom, disk)
+            if path == d_info['path']:
+                ref_cnt = ref_cnt + 1
     return ref_cnt
 
 
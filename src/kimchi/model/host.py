@@ -33,6 +33,7 @@ from kimchi.model import hostdev
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import NotFoundError, OperationFailed
 from kimchi.model.config import CapabilitiesModel
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.tasks import TaskModel
 from kimchi.model.vms import DOM_STATE_MAP
 from kimchi.repositories import Repositories
@@ -138,6 +139,11 @@ class HostModel(object):
         os.system('reboot')
 
     def _get_vms_list_by_state(self, state):
+        inventory = DomainInventory.get_inventory(self.conn)
+        if inventory is not None:
+            return [name for name in inventory.get_names()
+                    if DOM_STATE_MAP.get(inventory.get_state(name)) == state]
+
         conn = self.conn.get()
         return [dom.name().decode('utf-8')
                 for dom in conn.listAllDomains(0)
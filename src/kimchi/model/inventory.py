@@ -0,0 +1,333 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2015
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+
+import libvirt
+from lxml import objectify
+
+from kimchi.notifier import notifier
+from kimchi.utils import kimchi_log
+from kimchi.xmlutils.disk import get_disk_path
+
+
+# libvirt lifecycle events which tell the new state of the domain. The other
+# events (defined, undefined, stopped and shutdown) require the state to be
+# checked again as the domain may even have disappeared.
+EVENT_STATE_MAP = {
+    libvirt.VIR_DOMAIN_EVENT_STARTED: libvirt.VIR_DOMAIN_RUNNING,
+    libvirt.VIR_DOMAIN_EVENT_SUSPENDED: libvirt.VIR_DOMAIN_PAUSED,
+    libvirt.VIR_DOMAIN_EVENT_RESUMED: libvirt.VIR_DOMAIN_RUNNING,
+    libvirt.VIR_DOMAIN_EVENT_PMSUSPENDED: libvirt.VIR_DOMAIN_PMSUSPENDED,
+    libvirt.VIR_DOMAIN_EVENT_CRASHED: libvirt.VIR_DOMAIN_CRASHED}
+
+# device events are only available on newer libvirt versions
+DEVICE_EVENTS = ['VIR_DOMAIN_EVENT_ID_DEVICE_ADDED',
+                 'VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED',
+                 'VIR_DOMAIN_EVENT_ID_METADATA_CHANGE']
+
+
+class DomainInventory(object):
+    """
+    In-memory view of the domains of a libvirt connection.
+
+    The inventory is loaded with a single listAllDomains() call and then kept
+    up to date by the libvirt lifecycle and device events, so the read paths
+    (domain names, handles, states and parsed descriptors) do not need any
+    round trip to libvirtd. It is loaded again whenever the connection to
+    libvirt is recycled.
+
+    Kimchi's own changes to a domain must be reported through
+    domain_defined(), domain_removed() and invalidate_domain() because libvirt
+    does not emit events for all of them (e.g. metadata changes) and the
+    following requests must not see stale data while the event is in flight.
+    """
+    _inventories = {}
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.generation = 0
+        self._lock = threading.RLock()
+        self._domains = {}
+        # index from the disk paths to the domains using them, once per
+        # device, and the paths indexed for each domain. The domains which
+        # are not indexed yet are indexed on the next get_disk_users() call
+        self._disks = {}
+        self._domain_disks = {}
+        self._unindexed = set()
+        self._vir_conn = None
+        self.enabled = True
+        DomainInventory._inventories[conn.uri] = self
+
+    @staticmethod
+    def get_inventory(conn):
+        inventory = DomainInventory._inventories.get(conn.uri)
+        if inventory is None or not inventory._sync():
+            return None
+        return inventory
+
+    @staticmethod
+    def domain_defined(conn, dom):
+        inventory = DomainInventory.get_inventory(conn)
+        if inventory is not None:
+            inventory.update_domain(dom)
+
+    @staticmethod
+    def domain_removed(conn, name):
+        inventory = DomainInventory.get_inventory(conn)
+        if inventory is not None:
+            inventory.remove_domain(name)
+
+    @staticmethod
+    def invalidate_domain(conn, name):
+        inventory = DomainInventory.get_inventory(conn)
+        if inventory is not None:
+            inventory.invalidate(name)
+
+    def _sync(self):
+        if not self.enabled:
+            return False
+
+        vir_conn = self.conn.get()
+        if vir_conn is self._vir_conn:
+            return True
+
+        with self._lock:
+            if vir_conn is self._vir_conn:
+                return True
+
+            try:
+                self._register_events(vir_conn)
+                domains = {}
+                for dom in vir_conn.listAllDomains(0):
+                    domains[dom.name().decode('utf-8')] = self._new_entry(dom)
+                self._load_states(vir_conn, domains)
+            except libvirt.libvirtError, e:
+                # without events the inventory would go stale, so give up and
+                # let the models talk to libvirt directly
+                kimchi_log.error('Unable to load domain inventory, disabling '
+                                 'it: %s', e.get_error_message())
+                self.enabled = False
+                notifier.track('vms', False)
+                return False
+
+            self._domains = domains
+            self._disks = {}
+            self._domain_disks = {}
+            self._unindexed = set(domains)
+            self._vir_conn = vir_conn
+            self.generation += 1
+            # the changes of the domains are notified from now on
+            notifier.track('vms')
+            return True
+
+    def _register_events(self, vir_conn):
+        vir_conn.domainEventRegisterAny(None,
+                                        libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                        self._lifecycle_cb, None)
+        for event in DEVICE_EVENTS:
+            event_id = getattr(libvirt, event, None)
+            if event_id is None:
+                continue
+
+            try:
+                vir_conn.domainEventRegisterAny(None, event_id,
+                                                self._device_cb, None)
+            except libvirt.libvirtError:
+                kimchi_log.debug('libvirt does not support %s', event)
+
+    def _load_states(self, vir_conn, domains):
+        # one single RPC for the whole domain list when possible; otherwise
+        # the states are loaded on demand by get_state()
+        try:
+            records = vir_conn.getAllDomainStats(
+                libvirt.VIR_DOMAIN_STATS_STATE)
+        except (AttributeError, libvirt.libvirtError):
+            return
+
+        for dom, record in records:
+            entry = domains.get(dom.name().decode('utf-8'))
+            if entry is not None:
+                entry['state'] = record.get('state.state')
+
+    @staticmethod
+    def _new_entry(dom):
+        return {'dom': dom, 'uuid': dom.UUIDString(), 'state': None,
+                'verify': False, 'root': None, 'version': 0}
+
+    def _drop_disks(self, name):
+        # must be called with the lock held
+        for path in self._domain_disks.pop(name, []):
+            users = self._disks[path]
+            users.remove(name)
+            if not users:
+                del self._disks[path]
+
+    def _lifecycle_cb(self, vir_conn, dom, event, detail, opaque):
+        name = dom.name().decode('utf-8')
+        with self._lock:
+            # the handle is replaced as well: a domain may be undefined and
+            # defined again with the same name and a new UUID
+            entry = self._domains[name] = self._new_entry(dom)
+            entry['state'] = EVENT_STATE_MAP.get(event)
+            # the domain may be gone after being stopped (transient) or
+            # undefined (inactive), so check it on next read
+            entry['verify'] = event in (libvirt.VIR_DOMAIN_EVENT_UNDEFINED,
+                                        libvirt.VIR_DOMAIN_EVENT_STOPPED)
+            self._drop_disks(name)
+            self._unindexed.add(name)
+            self.generation += 1
+        notifier.notify('vms')
+
+    def _device_cb(self, vir_conn, dom, *args):
+        self.invalidate(dom.name().decode('utf-8'))
+
+    def _refresh_entry(self, name, entry):
+        try:
+            state = entry['dom'].info()[0]
+        except libvirt.libvirtError, e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+            self.remove_domain(name)
+            return None
+
+        with self._lock:
+            entry['state'] = state
+            entry['verify'] = False
+        return entry
+
+    def _get_entry(self, name):
+        self._sync()
+        entry = self._domains.get(name)
+        if entry is not None and entry['verify']:
+            entry = self._refresh_entry(name, entry)
+        return entry
+
+    def get_names(self):
+        self._sync()
+        for name, entry in self._domains.items():
+            if entry['verify']:
+                self._refresh_entry(name, entry)
+        return self._domains.keys()
+
+    def get_domain(self, name):
+        entry = self._get_entry(name)
+        return entry['dom'] if entry is not None else None
+
+    def get_state(self, name):
+        """Return the libvirt state code of domain <name> or None if it does
+        not exist."""
+        entry = self._get_entry(name)
+        if entry is None:
+            return None
+
+        if entry['state'] is None:
+            entry = self._refresh_entry(name, entry)
+        return entry['state'] if entry is not None else None
+
+    def get_root(self, name):
+        """Return the parsed (objectified) secure XML descriptor of domain
+        <name> or None if it does not exist. The tree is shared by all the
+        callers and must not be modified."""
+        entry = self._get_entry(name)
+        if entry is None:
+            return None
+
+        root = entry['root']
+        if root is None:
+            version = entry['version']
+            xml = entry['dom'].XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
+            root = objectify.fromstring(xml)
+            with self._lock:
+                # do not cache a descriptor which may have been changed in
+                # the meantime
+                if self._is_current(name, entry, version):
+                    entry['root'] = root
+        return root
+
+    def _is_current(self, name, entry, version):
+        # must be called with the lock held
+        return self._domains.get(name) is entry and entry['version'] == version
+
+    def get_disk_users(self, path):
+        """Return the names of the domains using the disk or CD-ROM <path>,
+        once per device. The disk paths of a domain are indexed from its
+        parsed descriptor and indexed again after the domain changes (e.g.
+        defined again, or a device attached or detached), so only the
+        changed domains are parsed again."""
+        self._sync()
+        users = []
+        with self._lock:
+            pending = list(self._unindexed)
+
+        for name in pending:
+            entry = self._domains.get(name)
+            if entry is None:
+                continue
+            version = entry['version']
+            root = self.get_root(name)
+            if root is None:
+                continue
+
+            paths = [get_disk_path(disk)
+                     for disk in root.xpath("./devices/disk[@device='disk' "
+                                            "or @device='cdrom']")]
+            with self._lock:
+                # do not index a descriptor which may have been changed in
+                # the meantime, only count its disks for this call
+                if (name in self._unindexed and
+                        self._is_current(name, entry, version)):
+                    self._unindexed.discard(name)
+                    self._domain_disks[name] = paths
+                    for disk_path in paths:
+                        self._disks.setdefault(disk_path, []).append(name)
+                    continue
+            users.extend(name for disk_path in paths if disk_path == path)
+
+        with self._lock:
+            return self._disks.get(path, []) + users
+
+    def update_domain(self, dom):
+        name = dom.name().decode('utf-8')
+        with self._lock:
+            self._domains[name] = self._new_entry(dom)
+            self._drop_disks(name)
+            self._unindexed.add(name)
+            self.generation += 1
+        notifier.notify('vms')
+
+    def remove_domain(self, name):
+        with self._lock:
+            self._domains.pop(name, None)
+            self._drop_disks(name)
+            self._unindexed.discard(name)
+            self.generation += 1
+        notifier.notify('vms')
+
+    def invalidate(self, name):
+        with self._lock:
+            entry = self._domains.get(name)
+            if entry is not None:
+                entry['root'] = None
+                entry['state'] = None
+                entry['version'] += 1
+                self._drop_disks(name)
+                self._unindexed.add(name)
+            self.generation += 1
+        notifier.notify('vms')
@@ -0,0 +1,66 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2015
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+import time
+
+import libvirt
+
+from kimchi.basemodel import Singleton
+from kimchi.utils import kimchi_log
+
+
+class LibvirtEvents(object):
+    """
+    Run the libvirt default event loop in a background thread.
+
+    libvirt only dispatches events for connections opened after the default
+    event implementation is registered, so this object must be created before
+    the first connection to libvirt is opened.
+    """
+    __metaclass__ = Singleton
+
+    def __init__(self):
+        self.registered = False
+        try:
+            if libvirt.virEventRegisterDefaultImpl() == 0:
+                self.registered = True
+        except libvirt.libvirtError, e:
+            kimchi_log.error('Unable to register libvirt event loop: %s',
+                             e.message)
+
+        if not self.registered:
+            return
+
+        self.event_loop_thread = threading.Thread(target=self._event_loop_run,
+                                                  name='LibvirtEventLoop')
+        self.event_loop_thread.setDaemon(True)
+        self.event_loop_thread.start()
+
+    def _event_loop_run(self):
+        while True:
+            try:
+                if libvirt.virEventRunDefaultImpl() < 0:
+                    kimchi_log.error('Failure running libvirt event loop')
+                    time.sleep(1)
+            except Exception, e:
+                # never let the event loop die: the domain inventory depends
+                # on it to stay up to date
+                kimchi_log.error('Error in libvirt event loop: %s', e)
+                time.sleep(1)
@@ -28,7 +28,9 @@ import lxml.etree as ET
 from lxml.builder import E
 
 from kimchi.basemodel import BaseModel
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.libvirtconnection import LibvirtConnection
+from kimchi.model.libvirtevents import LibvirtEvents
 from kimchi.objectstore import ObjectStore
 from kimchi.utils import import_module, listPathModules
 
@@ -41,10 +43,16 @@ class Model(BaseModel):
     def __init__(self, libvirt_uri=None, objstore_loc=None):
 
         self.objstore = ObjectStore(objstore_loc)
+        # the event loop must be running before the first connection to
+        # libvirt is opened, otherwise no event is delivered on it
+        self.events = LibvirtEvents()
         self.conn = LibvirtConnection(libvirt_uri)
         kargs = {'objstore': self.objstore, 'conn': self.conn}
 
         if self.conn.isQemuURI():
+            if self.events.registered:
+                self.inventory = DomainInventory(self.conn)
+
             for pool_name, pool_arg in DEFAULT_POOLS.iteritems():
                 self._default_pool_check(pool_name, pool_arg)
 
@@ -29,6 +29,7 @@ from kimchi import netinfo
 from kimchi import network as knetwork
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import MissingParameter, NotFoundError, OperationFailed
+from kimchi.model.inventory import DomainInventory
 from kimchi.rollbackcontext import RollbackContext
 from kimchi.utils import kimchi_log, run_command
 from kimchi.xmlutils.network import create_vlan_tagged_bridge_xml
@@ -42,6 +43,7 @@ KIMCHI_BRIDGE_PREFIX = 'kb'
 class NetworksModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
+        self.network = NetworkModel(**kargs)
         if self.conn.isQemuURI():
             self._default_network_check()
 
@@ -117,6 +119,31 @@ class NetworksModel(object):
         names = conn.listNetworks() + conn.listDefinedNetworks()
         return sorted(map(lambda x: x.decode('utf-8'), names))
 
+    def get_list_detailed(self, _fields=None):
+        conn = self.conn.get()
+        networks = sorted((net.name().decode('utf-8'), net)
+                          for net in conn.listAllNetworks(0))
+
+        # the VMs and templates are walked through only once for all the
+        # networks and only if requested
+        vms_by_network = tmpl_networks = None
+        if _fields is None or _fields.intersection(['vms', 'in_use']):
+            vms_by_network = self.network._get_vms_by_network()
+            tmpl_networks = self.network._get_templates_networks()
+
+        res = []
+        for name, network in networks:
+            info = self.network._get_network_info(network)
+            if vms_by_network is not None:
+                vms = vms_by_network.get(name.encode('utf-8'), [])
+                if _fields is None or 'vms' in _fields:
+                    info['vms'] = vms
+                if _fields is None or 'in_use' in _fields:
+                    info['in_use'] = self.network._is_network_in_use(
+                        name, vms, tmpl_networks)
+            res.append((name, info))
+        return res
+
     def _get_available_address(self, addr_pools=[]):
         invalid_addrs = []
         for net_name in self.get_list():
@@ -229,8 +256,21 @@ class NetworkModel(object):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
 
-    def lookup(self, name):
+    def lookup(self, name, _fields=None):
         network = self.get_network(self.conn.get(), name)
+        info = self._get_network_info(network)
+
+        # finding out the VMs attached to the network requires walking
+        # through all of them, so only do it when requested
+        if _fields is None or _fields.intersection(['vms', 'in_use']):
+            vms = self._get_vms_attach_to_a_network(name)
+            if _fields is None or 'vms' in _fields:
+                info['vms'] = vms
+            if _fields is None or 'in_use' in _fields:
+                info['in_use'] = self._is_network_in_use(name, vms)
+        return info
+
+    def _get_network_info(self, network):
         xml = network.XMLDesc(0)
         net_dict = self.get_network_from_xml(xml)
         subnet = net_dict['subnet']
@@ -257,47 +297,67 @@ class NetworkModel(object):
                 'interface': interface,
                 'subnet': subnet,
                 'dhcp': dhcp,
-                'vms': self._get_vms_attach_to_a_network(name),
-                'in_use': self._is_network_in_use(name),
                 'autostart': network.autostart() == 1,
                 'state':  network.isActive() and "active" or "inactive",
                 'persistent': True if network.isPersistent() else False}
 
-    def _is_network_in_use(self, name):
+    def _is_network_in_use(self, name, vms=None, tmpl_networks=None):
         # The network "default" is used for Kimchi proposal and should not be
         # deactivate or deleted. Otherwise, we will allow user create
         # inconsistent templates from scratch
         if name == 'default':
             return True
 
-        vms = self._get_vms_attach_to_a_network(name)
+        if vms is None:
+            vms = self._get_vms_attach_to_a_network(name)
+        if tmpl_networks is not None:
+            return bool(vms) or name in tmpl_networks
         return bool(vms) or self._is_network_used_by_template(name)
 
     def _is_network_used_by_template(self, network):
         with self.objstore as session:
-            templates = session.get_list('template')
-            for tmpl in templates:
-                tmpl_net = session.get('template', tmpl)['networks']
-                if network in tmpl_net:
-                    return True
-            return False
+            return len(session.find('template', networks=network)) > 0
+
+    def _get_templates_networks(self):
+        networks = set()
+        with self.objstore as session:
+            for tmpl in session.get_list('template'):
+                networks.update(session.get('template', tmpl)['networks'])
+        return networks
 
     def _get_vms_attach_to_a_network(self, network, filter="all"):
         DOM_STATE_MAP = {'nostate': 0, 'running': 1, 'blocked': 2,
                          'paused': 3, 'shutdown': 4, 'shutoff': 5,
                          'crashed': 6}
         state = DOM_STATE_MAP.get(filter)
-        vms = []
+        vms = self._get_vms_by_network(state)
+        return vms.get(network.encode('utf-8'), [])
+
+    def _get_vms_by_network(self, state=None):
+        """Return the names of the VMs attached to each network, walking
+        through all the VMs only once."""
+        vms = {}
+        inventory = DomainInventory.get_inventory(self.conn)
+        if inventory is not None:
+            for name in inventory.get_names():
+                root = inventory.get_root(name)
+                if root is None:
+                    continue
+                if state is None or state == inventory.get_state(name):
+                    for network in set(self._vm_get_networks(root)):
+                        vms.setdefault(network, []).append(
+                            name.encode('utf-8'))
+            return vms
+
         conn = self.conn.get()
         for dom in conn.listAllDomains(0):
-            networks = self._vm_get_networks(dom)
-            if network.encode('utf-8') in networks and \
-               (state is None or state == dom.state(0)[0]):
-                vms.append(dom.name())
+            networks = self._vm_get_networks(dom.XMLDesc(0))
+            if networks and (state is None or state == dom.state(0)[0]):
+                for network in set(networks):
+                    vms.setdefault(network, []).append(dom.name())
         return vms
 
-    def _vm_get_networks(self, dom):
-        xml = dom.XMLDesc(0)
+    def _vm_get_networks(self, xml):
         xpath = "/domain/devices/interface[@type='network']/source/@network"
         return xpath_get_text(xml, xpath)
 
@@ -18,14 +18,21 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 import libvirt
+import threading
+import time
 
+from collections import defaultdict
+
+from kimchi.config import config
+from kimchi.notifier import notifier
 from kimchi.scan import Scanner
 from kimchi.exception import InvalidOperation, MissingParameter
 from kimchi.exception import NotFoundError, OperationFailed
 from kimchi.model.config import CapabilitiesModel
 from kimchi.model.host import DeviceModel
 from kimchi.model.libvirtstoragepool import StoragePoolDef
-from kimchi.utils import add_task, kimchi_log, pool_name_from_uri, run_command
+from kimchi.utils import add_task, compile_filter_flags, kimchi_log
+from kimchi.utils import pool_name_from_uri, run_command
 from kimchi.xmlutils.utils import xpath_get_text
 
 
@@ -36,6 +43,19 @@ POOL_STATE_MAP = {0: 'inactive',
                   3: 'degraded',
                   4: 'inaccessible'}
 
+# listAllStoragePools() flags to list the pools of a given type.  The ISO
+# pools created by a deep scan are "dir" pools reported as "kimchi-iso"
+_POOL_LIST_PREFIX = 'VIR_CONNECT_LIST_STORAGE_POOLS_'
+POOL_LIST_FLAGS = dict((name[len(_POOL_LIST_PREFIX):].lower(),
+                        getattr(libvirt, name))
+                       for name in dir(libvirt)
+                       if name.startswith(_POOL_LIST_PREFIX) and
+                       name[len(_POOL_LIST_PREFIX):] not in
+                       ['ACTIVE', 'INACTIVE', 'PERSISTENT', 'TRANSIENT',
+                        'AUTOSTART', 'NO_AUTOSTART'])
+if 'dir' in POOL_LIST_FLAGS:
+    POOL_LIST_FLAGS['kimchi-iso'] = POOL_LIST_FLAGS['dir']
+
 # Types of pools supported
 STORAGE_SOURCES = {'netfs': {'addr': '/pool/source/host/@name',
                              'path': '/pool/source/dir/@path'},
@@ -48,14 +68,88 @@ STORAGE_SOURCES = {'netfs': {'addr': '/pool/source/host/@name',
                             'wwpn': '/pool/source/adapter/@wwpn'}}
 
 
+class _PoolRefresh(object):
+    def __init__(self, version):
+        self.started = time.time()
+        self.version = version
+        self.error = None
+        self.done = threading.Event()
+
+
+class PoolRefresher(object):
+    """
+    Coordinate the refreshes of the storage pools, which rescan all their
+    volumes. A refresh which started less than "window" seconds ago is reused,
+    unless the pool was marked dirty since then by a change made through
+    Kimchi, and the concurrent callers share the refresh in progress.
+    """
+    def __init__(self, window):
+        self.window = window
+        self._lock = threading.Lock()
+        self._last = {}
+        self._running = {}
+        self._versions = defaultdict(int)
+
+    def mark_dirty(self, name):
+        with self._lock:
+            self._versions[name] += 1
+        notifier.notify('storagepools')
+
+    def _is_fresh(self, name, refresh, oldest):
+        return (refresh is not None and refresh.started >= oldest and
+                refresh.version == self._versions[name])
+
+    def refresh(self, pool, force=False):
+        """
+        Refresh the pool if needed. With force, wait for a refresh started
+        after the call.
+        """
+        name = pool.name().decode('utf-8')
+        oldest = time.time() - (0 if force else self.window)
+        while True:
+            with self._lock:
+                if self._is_fresh(name, self._last.get(name), oldest):
+                    return
+
+                current = self._running.get(name)
+                if current is None:
+                    current = _PoolRefresh(self._versions[name])
+                    self._running[name] = current
+                    break
+                join = self._is_fresh(name, current, oldest)
+
+            current.done.wait()
+            if join:
+                if current.error is not None:
+                    raise current.error
+                return
+
+        try:
+            pool.refresh(0)
+        except Exception as e:
+            current.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._running[name]
+                if current.error is None:
+                    self._last[name] = current
+            current.done.set()
+
+
+pool_refresher = PoolRefresher(config.getint('storage',
+                                             'pool_refresh_window'))
+
+
 class StoragePoolsModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
-        self.scanner = Scanner(self._clean_scan)
+        self.scanner = Scanner(self._clean_scan, self.objstore)
         self.scanner.delete()
         self.caps = CapabilitiesModel(**kargs)
         self.device = DeviceModel(**kargs)
+        self.storagepool = StoragePoolModel(**kargs)
 
     def get_list(self):
         try:
@@ -67,6 +161,24 @@ class StoragePoolsModel(object):
             raise OperationFailed("KCHPOOL0006E",
                                   {'err': e.get_error_message()})
 
+    def get_list_detailed(self, _fields=None, _type=None):
+        # when filtering on the pool type, only list the pools of the
+        # matching types.  The "dir" pools are listed for "kimchi-iso", so the
+        # result may still need filtering
+        flags = compile_filter_flags(_type, POOL_LIST_FLAGS,
+                                     POOL_LIST_FLAGS.keys())
+
+        try:
+            conn = self.conn.get()
+            pools = conn.listAllStoragePools(flags)
+        except libvirt.libvirtError as e:
+            raise OperationFailed("KCHPOOL0006E",
+                                  {'err': e.get_error_message()})
+
+        pools = sorted((pool.name().decode('utf-8'), pool) for pool in pools)
+        return [(name, self.storagepool._get_pool_info(name, pool, _fields))
+                for name, pool in pools]
+
     def create(self, params):
         task_id = None
         conn = self.conn.get()
@@ -130,6 +242,7 @@ class StoragePoolsModel(object):
             kimchi_log.error("Problem creating Storage Pool: %s", e)
             raise OperationFailed("KCHPOOL0007E",
                                   {'name': name, 'err': e.get_error_message()})
+        pool_refresher.mark_dirty(name)
         if params['type'] == 'netfs':
             output, error, returncode = run_command(['setsebool', '-P',
                                                     'virt_use_nfs=1'])
@@ -197,7 +310,7 @@ class StoragePoolModel(object):
     def _get_storagepool_vols_num(self, pool):
         try:
             if pool.isActive():
-                pool.refresh(0)
+                pool_refresher.refresh(pool)
                 return pool.numOfVolumes()
             else:
                 return 0
@@ -248,8 +361,11 @@ class StoragePoolModel(object):
         except Exception:
             return False
 
-    def lookup(self, name):
+    def lookup(self, name, _fields=None):
         pool = self.get_storagepool(name, self.conn)
+        return self._get_pool_info(name, pool, _fields)
+
+    def _get_pool_info(self, name, pool, fields=None):
         info = pool.info()
         autostart = True if pool.autostart() else False
         persistent = True if pool.isPersistent() else False
@@ -267,8 +383,12 @@ class StoragePoolModel(object):
             info[0] = 4
             # skip calculating volumes
             nr_volumes = 0
-        else:
+        elif fields is None or 'nr_volumes' in fields:
             nr_volumes = self._get_storagepool_vols_num(pool)
+        else:
+            # counting the volumes requires the pool to be refreshed, so only
+            # do it when requested
+            nr_volumes = None
 
         res = {'state': POOL_STATE_MAP[info[0]],
                'path': path,
@@ -278,8 +398,9 @@ class StoragePoolModel(object):
                'capacity': info[1],
                'allocated': info[2],
                'available': info[3],
-               'nr_volumes': nr_volumes,
                'persistent': persistent}
+        if nr_volumes is not None:
+            res['nr_volumes'] = nr_volumes
 
         if not pool.isPersistent():
             # Deal with deep scan generated pool
@@ -315,7 +436,7 @@ class StoragePoolModel(object):
         # refreshing pool state
         pool = self.get_storagepool(pool_name, self.conn)
         if pool.isActive():
-            pool.refresh(0)
+            pool_refresher.refresh(pool, force=True)
 
     def update(self, name, params):
         pool = self.get_storagepool(name, self.conn)
@@ -352,6 +473,17 @@ class StoragePoolModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHPOOL0009E",
                                   {'name': name, 'err': e.get_error_message()})
+        pool_refresher.mark_dirty(name)
+
+    def refresh(self, name):
+        pool = self.get_storagepool(name, self.conn)
+        if not pool.isActive():
+            raise InvalidOperation("KCHPOOL0038E", {'name': name})
+        try:
+            pool_refresher.refresh(pool, force=True)
+        except libvirt.libvirtError as e:
+            raise OperationFailed("KCHPOOL0039E",
+                                  {'name': name, 'err': e.get_error_message()})
 
     def _pool_used_by_template(self, pool_name):
         with self.objstore as session:
@@ -384,6 +516,7 @@ class StoragePoolModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHPOOL0010E",
                                   {'name': name, 'err': e.get_error_message()})
+        pool_refresher.mark_dirty(name)
         # If pool was not persistent, then it was erased by destroy() and
         # must return nothing here, to trigger _redirect() and avoid errors
         if not persistent:
@@ -401,6 +534,7 @@ class StoragePoolModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHPOOL0011E",
                                   {'name': name, 'err': e.get_error_message()})
+        pool_refresher.mark_dirty(name)
 
 
 class IsoPoolModel(object):
@@ -30,13 +30,12 @@ import libvirt
 from kimchi.config import READONLY_POOL_TYPE
 from kimchi.exception import InvalidOperation, InvalidParameter, IsoFormatError
 from kimchi.exception import MissingParameter, NotFoundError, OperationFailed
-from kimchi.isoinfo import IsoImage
-from kimchi.model.diskutils import get_disk_ref_cnt
-from kimchi.model.storagepools import StoragePoolModel
+from kimchi.isoinfo import probe_iso_cached
+from kimchi.model.diskutils import get_disk_ref_cnts
+from kimchi.model.storagepools import pool_refresher, StoragePoolModel
 from kimchi.model.tasks import TaskModel
 from kimchi.utils import add_task, get_next_clone_name, get_unique_file_name
 from kimchi.utils import kimchi_log
-from kimchi.xmlutils.utils import xpath_get_text
 
 
 VOLUME_TYPE_MAP = {0: 'file',
@@ -45,6 +44,13 @@ VOLUME_TYPE_MAP = {0: 'file',
                    3: 'network'}
 
 
+# the volume types as found in the 'type' attribute of the volume XML
+VOLUME_XML_TYPE_MAP = {'file': 'file',
+                       'block': 'block',
+                       'dir': 'directory',
+                       'network': 'network'}
+
+
 READ_CHUNK_SIZE = 1048576  # 1 MiB
 
 
@@ -56,6 +62,7 @@ class StorageVolumesModel(object):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
         self.task = TaskModel(**kargs)
+        self.storagevolume = StorageVolumeModel(**kargs)
 
     def create(self, pool_name, params):
         vol_source = ['file', 'url', 'capacity']
@@ -117,7 +124,9 @@ class StorageVolumesModel(object):
 
         params['pool'] = pool_name
         targeturi = '/storagepools/%s/storagevolumes/%s' % (pool_name, name)
-        taskid = add_task(targeturi, create_func, self.objstore, params)
+        category = 'transfer' if create_param in ('file', 'url') else None
+        taskid = add_task(targeturi, create_func, self.objstore, params,
+                          category)
         return self.task.lookup(taskid)
 
     def _create_volume_with_file(self, cb, params):
@@ -147,7 +156,8 @@ class StorageVolumesModel(object):
                                    'err': e.message})
 
         # Refresh to make sure volume can be found in following lookup
-        StoragePoolModel.get_storagepool(pool_name, self.conn).refresh(0)
+        pool_refresher.refresh(
+            StoragePoolModel.get_storagepool(pool_name, self.conn), force=True)
         cb('OK', True)
 
     def _create_volume_with_capacity(self, cb, params):
@@ -181,6 +191,7 @@ class StorageVolumesModel(object):
             raise OperationFailed("KCHVOL0007E",
                                   {'name': name, 'pool': pool,
                                    'err': e.get_error_message()})
+        pool_refresher.mark_dirty(pool_name)
 
         path = StoragePoolModel(
             conn=self.conn, objstore=self.objstore).lookup(pool_name)['path']
@@ -234,7 +245,7 @@ class StorageVolumesModel(object):
 
         if pool['type'] in ['dir', 'netfs']:
             virt_pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-            virt_pool.refresh(0)
+            pool_refresher.refresh(virt_pool, force=True)
         else:
             def _stream_handler(stream, nbytes, fd):
                 return fd.read(nbytes)
@@ -280,20 +291,36 @@ class StorageVolumesModel(object):
         if not pool.isActive():
             raise InvalidOperation("KCHVOL0006E", {'pool': pool_name})
         try:
-            pool.refresh(0)
+            pool_refresher.refresh(pool)
             return sorted(map(lambda x: x.decode('utf-8'), pool.listVolumes()))
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0008E",
                                   {'pool': pool_name,
                                    'err': e.get_error_message()})
 
+    def get_list_detailed(self, pool_name, _fields=None):
+        pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
+        if not pool.isActive():
+            raise InvalidOperation("KCHVOL0006E", {'pool': pool_name})
+        try:
+            pool_refresher.refresh(pool)
+            vols = pool.listAllVolumes(0)
+        except libvirt.libvirtError as e:
+            raise OperationFailed("KCHVOL0008E",
+                                  {'pool': pool_name,
+                                   'err': e.get_error_message()})
+
+        vols = sorted((vol.name().decode('utf-8'), vol) for vol in vols)
+        infos = self.storagevolume._get_volumes_info([vol for _, vol in vols],
+                                                     _fields)
+        return zip([name for name, _ in vols], infos)
+
 
 class StorageVolumeModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
         self.task = TaskModel(**kargs)
-        self.storagevolumes = StorageVolumesModel(**kargs)
 
     @staticmethod
     def get_storagevolume(poolname, name, conn):
@@ -309,39 +336,69 @@ class StorageVolumeModel(object):
             else:
                 raise
 
-    def lookup(self, pool, name):
+    def lookup(self, pool, name, _fields=None):
         vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
-        path = vol.path()
-        info = vol.info()
-        xml = vol.XMLDesc(0)
-        try:
-            fmt = xpath_get_text(xml, "/volume/target/format/@type")[0]
-        except IndexError:
-            # Not all types of libvirt storage can provide volume format
-            # infomation. When there is no format information, we assume
-            # it's 'raw'.
-            fmt = 'raw'
-        ref_cnt = get_disk_ref_cnt(self.objstore, self.conn, path)
-        res = dict(type=VOLUME_TYPE_MAP[info[0]],
-                   capacity=info[1],
-                   allocation=info[2],
-                   path=path,
-                   ref_cnt=ref_cnt,
-                   format=fmt)
-        if fmt == 'iso':
+        return self._get_volume_info(vol, _fields)
+
+    def _get_volume_info(self, vol, fields=None):
+        return self._get_volumes_info([vol], fields)[0]
+
+    def _get_volumes_info(self, vols, fields=None):
+        """
+        Return the info of each volume in vols, reading all their reference
+        counts from the object store at once.
+        """
+        # the reference count and the ISO probing are only computed when
+        # requested as they are expensive
+        def wanted(*keys):
+            return fields is None or bool(fields.intersection(keys))
+
+        infos = [self._parse_volume(vol) for vol in vols]
+        if wanted('ref_cnt'):
+            ref_cnts = get_disk_ref_cnts(self.objstore, self.conn,
+                                         [res['path'] for res in infos])
+            for res in infos:
+                res['ref_cnt'] = ref_cnts[res['path']]
+
+        for res in infos:
+            if res['format'] != 'iso':
+                continue
+
+            path = res['path']
             if os.path.islink(path):
                 path = os.path.join(os.path.dirname(path), os.readlink(path))
-            os_distro = os_version = 'unknown'
-            try:
-                iso_img = IsoImage(path)
-                os_distro, os_version = iso_img.probe()
-                bootable = True
-            except IsoFormatError:
-                bootable = False
-            res.update(
-                dict(os_distro=os_distro, os_version=os_version, path=path,
-                     bootable=bootable))
-        return res
+            res['path'] = path
+            if wanted('os_distro', 'os_version', 'bootable'):
+                os_distro = os_version = 'unknown'
+                try:
+                    os_distro, os_version = probe_iso_cached(self.objstore,
+                                                             path)
+                    bootable = True
+                except IsoFormatError:
+                    bootable = False
+                res.update(dict(os_distro=os_distro, os_version=os_version,
+                                bootable=bootable))
+        return infos
+
+    @staticmethod
+    def _parse_volume(vol):
+        # everything comes from the volume XML, so a single call to libvirt
+        # is needed unless it does not tell the volume type
+        root = ET.fromstring(vol.XMLDesc(0))
+        vol_type = VOLUME_XML_TYPE_MAP.get(root.get('type'))
+        if vol_type is None:
+            vol_type = VOLUME_TYPE_MAP[vol.info()[0]]
+
+        # Not all types of libvirt storage can provide volume format
+        # infomation. When there is no format information, we assume
+        # it's 'raw'.
+        fmt = root.find('target/format')
+        fmt = 'raw' if fmt is None else fmt.get('type', 'raw')
+        return dict(type=vol_type,
+                    capacity=int(root.findtext('capacity')),
+                    allocation=int(root.findtext('allocation')),
+                    path=root.findtext('target/path'),
+                    format=fmt)
 
     def wipe(self, pool, name):
         volume = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
@@ -350,6 +407,7 @@ class StorageVolumeModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0009E",
                                   {'name': name, 'err': e.get_error_message()})
+        pool_refresher.mark_dirty(pool)
 
     def delete(self, pool, name):
         pool_info = StoragePoolModel(conn=self.conn,
@@ -363,6 +421,7 @@ class StorageVolumeModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0010E",
                                   {'name': name, 'err': e.get_error_message()})
+        pool_refresher.mark_dirty(pool)
 
     def resize(self, pool, name, size):
         volume = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
@@ -382,6 +441,7 @@ class StorageVolumeModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVOL0011E",
                                   {'name': name, 'err': e.get_error_message()})
+        pool_refresher.mark_dirty(pool)
 
     def clone(self, pool, name, new_pool=None, new_name=None):
         """Clone a storage volume.
@@ -406,8 +466,9 @@ class StorageVolumeModel(object):
         # is specified
         if new_name is None:
             base, ext = os.path.splitext(name)
-            new_name = get_next_clone_name(self.storagevolumes.get_list(pool),
-                                           base, ext)
+            volumes = StorageVolumesModel(conn=self.conn,
+                                          objstore=self.objstore)
+            new_name = get_next_clone_name(volumes.get_list(pool), base, ext)
 
         params = {'pool': pool,
                   'name': name,
@@ -415,7 +476,7 @@ class StorageVolumeModel(object):
                   'new_name': new_name}
         taskid = add_task(u'/storagepools/%s/storagevolumes/%s' %
                           (pool, new_name), self._clone_task, self.objstore,
-                          params)
+                          params, 'disk_copy')
         return self.task.lookup(taskid)
 
     def _clone_task(self, cb, params):
@@ -459,6 +520,7 @@ class StorageVolumeModel(object):
 
             cb('cloning volume')
             new_vir_pool.createXMLFrom(new_vol_xml, orig_vir_vol, 0)
+            pool_refresher.mark_dirty(new_pool_name)
         except (InvalidOperation, NotFoundError, libvirt.libvirtError), e:
             raise OperationFailed('KCHVOL0023E',
                                   {'name': orig_vol_name,
@@ -487,18 +549,17 @@ class IsoVolumesModel(object):
         for pool_name in pools:
             try:
                 pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-                pool.refresh(0)
-                volumes = pool.listVolumes()
+                pool_refresher.refresh(pool)
+                volumes = pool.listAllVolumes(0)
             except Exception, e:
                 # Skip inactive pools
                 kimchi_log.debug("Shallow scan: skipping pool %s because of "
                                  "error: %s", (pool_name, e.message))
                 continue
 
-            for volume in volumes:
-                res = self.storagevolume.lookup(pool_name,
-                                                volume.decode("utf-8"))
+            infos = self.storagevolume._get_volumes_info(volumes)
+            for volume, res in zip(volumes, infos):
                 if res['format'] == 'iso':
-                    res['name'] = '%s' % volume
+                    res['name'] = '%s' % volume.name()
                     iso_volumes.append(res)
         return iso_volumes
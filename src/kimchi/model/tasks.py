@@ -18,14 +18,48 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 
-import time
+from cherrypy.process.plugins import BackgroundTask
 
-from kimchi.exception import TimeoutExpired
+from kimchi.asynctask import finished_tasks, live_tasks, scheduler
+from kimchi.config import config
+from kimchi.exception import InvalidOperation, TimeoutExpired
+from kimchi.utils import kimchi_log
+
+
+TASKS_SWEEP_INTERVAL = 60
+
+# the finished tasks of each object store are removed by a single thread,
+# however many TasksModel are created
+tasks_sweepers = {}
 
 
 class TasksModel(object):
     def __init__(self, **kargs):
         self.objstore = kargs['objstore']
+        self.finished_ttl = config.getint('tasks', 'finished_task_ttl')
+        self.max_finished = config.getint('tasks', 'max_finished_tasks')
+        self.sweeper = tasks_sweepers.get(self.objstore)
+        if self.sweeper is None:
+            self.sweeper = BackgroundTask(TASKS_SWEEP_INTERVAL,
+                                          self._sweep_tasks)
+            tasks_sweepers[self.objstore] = self.sweeper
+            self.sweeper.start()
+
+    def _sweep_tasks(self):
+        """
+        Remove the finished and failed tasks which are over the retention
+        time or count from the object store.
+        """
+        expired = finished_tasks.pop_expired(self.objstore, self.finished_ttl,
+                                             self.max_finished)
+        if not expired:
+            return
+
+        try:
+            with self.objstore as session:
+                session.delete_many('task', expired)
+        except Exception as e:
+            kimchi_log.error('Error removing finished tasks: %s', e.message)
 
     def get_list(self):
         with self.objstore as session:
@@ -37,13 +71,24 @@ class TaskModel(object):
         self.objstore = kargs['objstore']
 
     def lookup(self, id):
+        task = live_tasks.get(str(id))
+        if task is not None:
+            return task.get_info()
+
         with self.objstore as session:
             return session.get('task', str(id))
 
+    def cancel(self, id):
+        if not scheduler.cancel(str(id)):
+            # raise NotFoundError if the task does not exist
+            self.lookup(id)
+            raise InvalidOperation('KCHASYNC0004E', {'id': id})
+
     def wait(self, id, timeout=10):
         """Wait for a task until it stops running (successfully or due to
-        an error). If the Task finishes its execution before <timeout>, this
-        function returns normally; otherwise an exception is raised.
+        an error). If the Task finishes its execution before <timeout>,
+        including the time it is queued, this function returns normally;
+        otherwise an exception is raised.
 
         Parameters:
         id -- The Task ID.
@@ -51,14 +96,13 @@ class TaskModel(object):
             for the Task. If the Task runs for more than <timeout>,
             "TimeoutExpired" is raised.
         """
-        for i in range(0, timeout):
-            with self.objstore as session:
-                task = session.get('task', str(id))
-
-            if task['status'] != 'running':
-                return
-
-            time.sleep(1)
+        task = live_tasks.get(str(id))
+        if task is None:
+            # the task is over, or it does not exist: raise NotFoundError
+            self.lookup(id)
+            return
 
-        raise TimeoutExpired('KCHASYNC0003E', {'seconds': timeout,
-                                               'task': task['target_uri']})
+        if not task.wait(timeout):
+            raise TimeoutExpired('KCHASYNC0003E',
+                                 {'seconds': timeout,
+                                  'task': task.target_uri})
@@ -38,6 +38,13 @@ class TemplatesModel(object):
         self.conn = kargs['conn']
 
     def create(self, params):
+        return self._save_template(params)
+
+    def _save_template(self, params, replace=None):
+        """
+        Validate the template params and store the template, replacing the
+        template "replace" in the same transaction if it is given.
+        """
         name = params.get('name', '').strip()
         iso = params.get('cdrom')
         # check search permission
@@ -90,14 +97,17 @@ class TemplatesModel(object):
         # Creates the template class with necessary information
         # Checkings will be done while creating this class, so any exception
         # will be raised here
-        t = LibvirtVMTemplate(params, scan=True)
+        t = LibvirtVMTemplate(params, scan=True, objstore=self.objstore)
         name = params['name']
         try:
             with self.objstore as session:
-                if name in session.get_list('template'):
-                    raise InvalidOperation("KCHTMPL0001E", {'name': name})
-                session.store('template', name, t.info)
-        except InvalidOperation:
+                with session.transaction():
+                    if replace is not None:
+                        session.delete('template', replace)
+                    if name in session.get_list('template'):
+                        raise InvalidOperation("KCHTMPL0001E", {'name': name})
+                    session.store('template', name, t.info)
+        except (InvalidOperation, NotFoundError):
             raise
         except Exception, e:
             raise OperationFailed('KCHTMPL0020E', {'err': e.message})
@@ -108,6 +118,27 @@ class TemplatesModel(object):
         with self.objstore as session:
             return session.get_list('template')
 
+    def get_list_detailed(self, _fields=None):
+        with self.objstore as session:
+            templates = [(name, session.get('template', name))
+                         for name in session.get_list('template')]
+
+        # list the networks and storage pools only once for all templates
+        networks = storagepools = None
+        res = []
+        for name, params in templates:
+            t = LibvirtVMTemplate(params, False, self.conn)
+            if _fields is not None and 'invalid' not in _fields:
+                # skip the integrity validation
+                res.append((name, t.info))
+                continue
+
+            if networks is None:
+                networks = t._get_all_networks_name()
+                storagepools = t._get_all_storagepools_name()
+            res.append((name, t.validate_integrity(networks, storagepools)))
+        return res
+
     def template_volume_validate(self, tmp_volumes, pool):
         kwargs = {'conn': self.conn, 'objstore': self.objstore}
         pool_type = xpath_get_text(pool.XMLDesc(0), "/pool/@type")[0]
@@ -182,8 +213,6 @@ class TemplateModel(object):
         if not self._validate_updated_cpu_params(new_t):
             raise InvalidParameter('KCHTMPL0025E')
 
-        ident = name
-
         conn = self.conn.get()
         pool_uri = new_t.get(u'storagepool', '')
 
@@ -205,13 +234,8 @@ class TemplateModel(object):
                 raise InvalidParameter("KCHTMPL0003E", {'network': net_name,
                                                         'template': name})
 
-        self.delete(name)
-        try:
-            ident = self.templates.create(new_t)
-        except:
-            ident = self.templates.create(old_t)
-            raise
-        return ident
+        # the old template is only deleted if the new one is stored
+        return self.templates._save_template(new_t, replace=name)
 
     def _validate_updated_cpu_params(self, info):
         # Note: cpu_info is the parent of topology. cpus is vcpus
@@ -226,8 +250,8 @@ class TemplateModel(object):
 
 
 class LibvirtVMTemplate(VMTemplate):
-    def __init__(self, args, scan=False, conn=None):
-        VMTemplate.__init__(self, args, scan)
+    def __init__(self, args, scan=False, conn=None, objstore=None):
+        VMTemplate.__init__(self, args, scan, objstore)
         self.conn = conn
 
     def _storage_validate(self):
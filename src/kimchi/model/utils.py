@@ -17,6 +17,7 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import copy
 import libvirt
 import socket
 import urlparse
@@ -161,3 +162,37 @@ def get_metadata_node(dom, tag, metadata_support, mode="current"):
         if node is not None:
             return etree.tostring(node)
     return ""
+
+
+def get_metadata_node_from_xml(root, tag):
+    """Return the kimchi metadata node <tag> from an already parsed domain
+    descriptor, so the callers which hold the domain XML do not need another
+    round trip to libvirt.
+
+    Both layouts are handled: the one written by libvirt's metadata API and
+    the one written by "_kimchi_set_metadata_node".
+    """
+    metadata = root.find("metadata")
+    if metadata is None:
+        return ""
+
+    # iterchildren() as iterating an objectified element yields its
+    # siblings with the same tag, not its children
+    for kimchi in metadata.iterchildren():
+        if not isinstance(kimchi.tag, basestring) or \
+           etree.QName(kimchi).namespace != KIMCHI_META_URL:
+            continue
+
+        for node in kimchi.iterchildren():
+            if not isinstance(node.tag, basestring) or \
+               etree.QName(node).localname != tag:
+                continue
+
+            node = copy.deepcopy(node)
+            # remove the "kimchi" prefix of xml
+            for elem in node.iter():
+                if isinstance(elem.tag, basestring):
+                    elem.tag = etree.QName(elem).localname
+            etree.cleanup_namespaces(node)
+            return etree.tostring(node)
+    return ""
@@ -26,6 +26,7 @@ from lxml.builder import E
 
 from kimchi.exception import InvalidOperation, InvalidParameter, NotFoundError
 from kimchi.model.config import CapabilitiesModel
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.host import DeviceModel, DevicesModel
 from kimchi.model.utils import get_vm_config_flag
 from kimchi.model.vms import DOM_STATE_MAP, VMModel
@@ -40,8 +41,7 @@ class VMHostDevsModel(object):
 
     def get_list(self, vmid):
         dom = VMModel.get_vm(vmid, self.conn)
-        xmlstr = dom.XMLDesc(0)
-        root = objectify.fromstring(xmlstr)
+        root = VMModel.get_vm_root(dom, self.conn)
         try:
             hostdev = root.devices.hostdev
         except AttributeError:
@@ -192,6 +192,7 @@ class VMHostDevsModel(object):
                                       xmlstr, device_flags)
             rollback.commitAll()
 
+        DomainInventory.invalidate_domain(self.conn, vmid)
         return dev_info['name']
 
     def _get_scsi_device_xml(self, dev_info):
@@ -207,6 +208,7 @@ class VMHostDevsModel(object):
         xmlstr = self._get_scsi_device_xml(dev_info)
         dom = VMModel.get_vm(vmid, self.conn)
         dom.attachDeviceFlags(xmlstr, get_vm_config_flag(dom, mode='all'))
+        DomainInventory.invalidate_domain(self.conn, vmid)
         return dev_info['name']
 
     def _get_usb_device_xml(self, dev_info):
@@ -224,6 +226,7 @@ class VMHostDevsModel(object):
         xmlstr = self._get_usb_device_xml(dev_info)
         dom = VMModel.get_vm(vmid, self.conn)
         dom.attachDeviceFlags(xmlstr, get_vm_config_flag(dom, mode='all'))
+        DomainInventory.invalidate_domain(self.conn, vmid)
         return dev_info['name']
 
 
@@ -273,6 +276,7 @@ class VMHostDevModel(object):
                     xmlstr, get_vm_config_flag(dom, mode='all'))
                 if e.attrib['type'] == 'pci':
                     self._delete_affected_pci_devices(dom, dev_name, pci_devs)
+                DomainInventory.invalidate_domain(self.conn, vmid)
                 break
         else:
             raise NotFoundError('KCHVMHDEV0001E',
@@ -303,6 +307,15 @@ class VMHoldersModel(object):
     def get_list(self, device_id):
         devsmodel = VMHostDevsModel(conn=self.conn)
 
+        inventory = DomainInventory.get_inventory(self.conn)
+        if inventory is not None:
+            res = []
+            for dom_name in inventory.get_names():
+                if device_id in devsmodel.get_list(dom_name):
+                    state = DOM_STATE_MAP.get(inventory.get_state(dom_name))
+                    res.append({"name": dom_name, "state": state})
+            return res
+
         conn = self.conn.get()
         doms = conn.listAllDomains(0)
 
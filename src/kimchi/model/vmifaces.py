@@ -24,6 +24,7 @@ from lxml import etree, objectify
 
 from kimchi.exception import InvalidOperation, InvalidParameter, NotFoundError
 from kimchi.model.config import CapabilitiesModel
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.vms import DOM_STATE_MAP, VMModel
 from kimchi.xmlutils.interface import get_iface_xml
 
@@ -64,6 +65,7 @@ class VMIfacesModel(object):
         os_distro, os_version = os_data
         xml = get_iface_xml(params, conn.getInfo()[0], os_distro, os_version)
         dom.attachDeviceFlags(xml, libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        DomainInventory.invalidate_domain(self.conn, vm)
 
         return params['mac']
 
@@ -126,6 +128,7 @@ class VMIfaceModel(object):
 
         dom.detachDeviceFlags(etree.tostring(iface),
                               libvirt.VIR_DOMAIN_AFFECT_CURRENT)
+        DomainInventory.invalidate_domain(self.conn, vm)
 
     def update(self, vm, mac, params):
         dom = VMModel.get_vm(vm, self.conn)
@@ -146,4 +149,5 @@ class VMIfaceModel(object):
             xml = etree.tostring(iface)
             dom.updateDeviceFlags(xml, flags=libvirt.VIR_DOMAIN_AFFECT_CONFIG)
 
+        DomainInventory.invalidate_domain(self.conn, vm)
         return mac
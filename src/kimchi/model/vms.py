@@ -25,7 +25,6 @@ import random
 import string
 import time
 import uuid
-from xml.etree import ElementTree
 
 import libvirt
 from cherrypy.process.plugins import BackgroundTask
@@ -35,14 +34,19 @@ from kimchi.config import READONLY_POOL_TYPE, config
 from kimchi.exception import InvalidOperation, InvalidParameter
 from kimchi.exception import NotFoundError, OperationFailed
 from kimchi.model.config import CapabilitiesModel
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.tasks import TaskModel
 from kimchi.model.templates import TemplateModel
 from kimchi.model.utils import get_vm_name
 from kimchi.model.utils import get_metadata_node
+from kimchi.model.utils import get_metadata_node_from_xml
 from kimchi.model.utils import set_metadata_node
+from kimchi.notifier import notifier
 from kimchi.rollbackcontext import RollbackContext
-from kimchi.screenshot import VMScreenshot
-from kimchi.utils import add_task, get_next_clone_name, import_class
+from kimchi.screenshot import ScreenshotRefresher, VMScreenshot
+from kimchi.statshistory import StatsHistory
+from kimchi.utils import add_task, compile_filter, compile_filter_flags
+from kimchi.utils import get_next_clone_name, import_class
 from kimchi.utils import kimchi_log, run_setfacl_set_attr
 from kimchi.utils import template_name_from_uri
 from kimchi.xmlutils.utils import xpath_get_text, xml_item_update
@@ -58,13 +62,27 @@ DOM_STATE_MAP = {0: 'nostate',
                  6: 'crashed',
                  7: 'pmsuspended'}
 
+# listAllDomains() flags to list the VMs in a given state
+DOM_LIST_FLAGS = {'running': libvirt.VIR_CONNECT_LIST_DOMAINS_RUNNING,
+                  'paused': libvirt.VIR_CONNECT_LIST_DOMAINS_PAUSED,
+                  'shutoff': libvirt.VIR_CONNECT_LIST_DOMAINS_SHUTOFF}
+
+# number of VMs looked up at once when listing them with their details
+DETAILED_LIST_BATCH = 20
+
 GUESTS_STATS_INTERVAL = 5
+STATS_HISTORY_METRICS = ['cpu_utilization', 'net_throughput', 'io_throughput']
 VM_STATIC_UPDATE_PARAMS = {'name': './name',
                            'cpus': './vcpu',
                            'memory': './memory'}
 VM_LIVE_UPDATE_PARAMS = {}
 
 stats = {}
+stats_history = {}
+# the guests statistics are collected by a single thread for each libvirt
+# URI, however many VMsModel are created, so the history gets one sample
+# every GUESTS_STATS_INTERVAL seconds
+guests_stats_threads = {}
 
 
 XPATH_DOMAIN_DISK = "/domain/devices/disk[@device='disk']/source/@file"
@@ -76,75 +94,160 @@ XPATH_DOMAIN_MAC_BY_ADDRESS = "./devices/interface[@type='network']/"\
 XPATH_DOMAIN_UUID = '/domain/uuid'
 
 
+def new_stats_history():
+    return StatsHistory(STATS_HISTORY_METRICS, GUESTS_STATS_INTERVAL,
+                        config.getint('statistics', 'guest_history_size'),
+                        config.getint('statistics', 'guest_history_tiers'),
+                        config.getint('statistics', 'guest_history_factor'))
+
+
 class VMsModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
         self.caps = CapabilitiesModel(**kargs)
-        self.guests_stats_thread = BackgroundTask(GUESTS_STATS_INTERVAL,
-                                                  self._update_guests_stats)
-        self.guests_stats_thread.start()
+        self.vmscreenshot = VMScreenshotModel(**kargs)
+        self.guests_stats_thread = guests_stats_threads.get(self.conn.uri)
+        if self.guests_stats_thread is None:
+            self.guests_stats_thread = BackgroundTask(
+                GUESTS_STATS_INTERVAL, self._update_guests_stats)
+            guests_stats_threads[self.conn.uri] = self.guests_stats_thread
+            self.guests_stats_thread.start()
 
     def _update_guests_stats(self):
-        vm_list = self.get_list()
+        try:
+            samples = self._get_guests_samples()
+        except Exception as e:
+            kimchi_log.debug('Error listing VM stats: %s', e.message)
+            return
 
-        for name in vm_list:
+        for vm_uuid, sample in samples.iteritems():
             try:
-                dom = VMModel.get_vm(name, self.conn)
+                self._update_guest_stats(vm_uuid, sample)
+            except Exception as e:
+                kimchi_log.debug('Error processing VM stats: %s', e.message)
 
-                vm_uuid = dom.UUIDString()
-                info = dom.info()
-                state = DOM_STATE_MAP[info[0]]
+        # forget about the guests which do not exist anymore
+        for vm_uuid in stats.keys():
+            if vm_uuid not in samples:
+                stats.pop(vm_uuid, None)
+        for vm_uuid in stats_history.keys():
+            if vm_uuid not in samples:
+                stats_history.pop(vm_uuid, None)
 
-                if state != 'running':
-                    stats[vm_uuid] = {}
-                    continue
+        # the guests statistics are part of the VM resources
+        if samples:
+            notifier.notify('vms')
 
-                if stats.get(vm_uuid, None) is None:
-                    stats[vm_uuid] = {}
+    def _get_guests_samples(self):
+        """Return the raw counters of all the guests, indexed by UUID.
 
-                timestamp = time.time()
-                prevStats = stats.get(vm_uuid, {})
-                seconds = timestamp - prevStats.get('timestamp', 0)
-                stats[vm_uuid].update({'timestamp': timestamp})
-
-                self._get_percentage_cpu_usage(vm_uuid, info, seconds)
-                self._get_network_io_rate(vm_uuid, dom, seconds)
-                self._get_disk_io_rate(vm_uuid, dom, seconds)
+        All the counters are retrieved in a single call to libvirt when it
+        supports the bulk stats API (libvirt >= 1.2.8). Otherwise they are
+        queried guest by guest.
+        """
+        conn = self.conn.get()
+        try:
+            flags = (libvirt.VIR_DOMAIN_STATS_STATE |
+                     libvirt.VIR_DOMAIN_STATS_CPU_TOTAL |
+                     libvirt.VIR_DOMAIN_STATS_VCPU |
+                     libvirt.VIR_DOMAIN_STATS_INTERFACE |
+                     libvirt.VIR_DOMAIN_STATS_BLOCK)
+            records = conn.getAllDomainStats(flags)
+        except AttributeError:
+            return self._get_guests_samples_by_vm()
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                raise
+            return self._get_guests_samples_by_vm()
+
+        samples = {}
+        for dom, record in records:
+            sample = {'state': record.get('state.state'),
+                      'cputime': record.get('cpu.time', 0),
+                      'cpus': record.get('vcpu.current', 1),
+                      'net_rx': 0, 'net_tx': 0, 'disk_rd': 0, 'disk_wr': 0}
+            for i in xrange(record.get('net.count', 0)):
+                sample['net_rx'] += record.get('net.%d.rx.bytes' % i, 0)
+                sample['net_tx'] += record.get('net.%d.tx.bytes' % i, 0)
+            for i in xrange(record.get('block.count', 0)):
+                sample['disk_rd'] += record.get('block.%d.rd.bytes' % i, 0)
+                sample['disk_wr'] += record.get('block.%d.wr.bytes' % i, 0)
+            samples[dom.UUIDString()] = sample
+        return samples
+
+    def _get_guests_samples_by_vm(self):
+        samples = {}
+        for name in self.get_list():
+            try:
+                dom = VMModel.get_vm(name, self.conn)
+                info = dom.info()
+                sample = {'state': info[0], 'cputime': info[4],
+                          'cpus': info[3], 'net_rx': 0, 'net_tx': 0,
+                          'disk_rd': 0, 'disk_wr': 0}
+
+                if DOM_STATE_MAP[info[0]] == 'running':
+                    root = VMModel.get_vm_root(dom, self.conn)
+                    for target in root.findall('devices/interface/target'):
+                        io = dom.interfaceStats(target.get('dev'))
+                        sample['net_rx'] += io[0]
+                        sample['net_tx'] += io[4]
+                    for target in root.findall('devices/disk/target'):
+                        io = dom.blockStats(target.get('dev'))
+                        sample['disk_rd'] += io[1]
+                        sample['disk_wr'] += io[3]
+
+                samples[dom.UUIDString()] = sample
             except Exception as e:
                 # VM might be deleted just after we get the list.
                 # This is OK, just skip.
                 kimchi_log.debug('Error processing VM stats: %s', e.message)
                 continue
+        return samples
+
+    def _update_guest_stats(self, vm_uuid, sample):
+        if DOM_STATE_MAP.get(sample['state']) != 'running':
+            stats[vm_uuid] = {}
+            return
+
+        if stats.get(vm_uuid, None) is None:
+            stats[vm_uuid] = {}
+
+        timestamp = time.time()
+        prevStats = stats.get(vm_uuid, {})
+        seconds = timestamp - prevStats.get('timestamp', 0)
+        stats[vm_uuid].update({'timestamp': timestamp})
+
+        self._get_percentage_cpu_usage(vm_uuid, sample, seconds)
+        self._get_network_io_rate(vm_uuid, sample, seconds)
+        self._get_disk_io_rate(vm_uuid, sample, seconds)
 
-    def _get_percentage_cpu_usage(self, vm_uuid, info, seconds):
+        history = stats_history.get(vm_uuid)
+        if history is None:
+            history = stats_history[vm_uuid] = new_stats_history()
+        history.append(timestamp, {'cpu_utilization': stats[vm_uuid]['cpu'],
+                                   'net_throughput': stats[vm_uuid]['net_io'],
+                                   'io_throughput': stats[vm_uuid]['disk_io']})
+
+    def _get_percentage_cpu_usage(self, vm_uuid, sample, seconds):
         prevCpuTime = stats[vm_uuid].get('cputime', 0)
 
-        cpus = info[3]
-        cpuTime = info[4] - prevCpuTime
+        cpus = sample['cpus']
+        cpuTime = sample['cputime'] - prevCpuTime
 
         base = (((cpuTime) * 100.0) / (seconds * 1000.0 * 1000.0 * 1000.0))
         percentage = max(0.0, min(100.0, base / cpus))
 
-        stats[vm_uuid].update({'cputime': info[4], 'cpu': percentage})
+        stats[vm_uuid].update({'cputime': sample['cputime'],
+                               'cpu': percentage})
 
-    def _get_network_io_rate(self, vm_uuid, dom, seconds):
+    def _get_network_io_rate(self, vm_uuid, sample, seconds):
         prevNetRxKB = stats[vm_uuid].get('netRxKB', 0)
         prevNetTxKB = stats[vm_uuid].get('netTxKB', 0)
         currentMaxNetRate = stats[vm_uuid].get('max_net_io', 100)
 
-        rx_bytes = 0
-        tx_bytes = 0
-
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall('devices/interface/target'):
-            dev = target.get('dev')
-            io = dom.interfaceStats(dev)
-            rx_bytes += io[0]
-            tx_bytes += io[4]
-
-        netRxKB = float(rx_bytes) / 1000
-        netTxKB = float(tx_bytes) / 1000
+        netRxKB = float(sample['net_rx']) / 1000
+        netTxKB = float(sample['net_tx']) / 1000
 
         rx_stats = (netRxKB - prevNetRxKB) / seconds
         tx_stats = (netTxKB - prevNetTxKB) / seconds
@@ -155,23 +258,13 @@ class VMsModel(object):
         stats[vm_uuid].update({'net_io': rate, 'max_net_io': max_net_io,
                                'netRxKB': netRxKB, 'netTxKB': netTxKB})
 
-    def _get_disk_io_rate(self, vm_uuid, dom, seconds):
+    def _get_disk_io_rate(self, vm_uuid, sample, seconds):
         prevDiskRdKB = stats[vm_uuid].get('diskRdKB', 0)
         prevDiskWrKB = stats[vm_uuid].get('diskWrKB', 0)
         currentMaxDiskRate = stats[vm_uuid].get('max_disk_io', 100)
 
-        rd_bytes = 0
-        wr_bytes = 0
-
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall("devices/disk/target"):
-            dev = target.get("dev")
-            io = dom.blockStats(dev)
-            rd_bytes += io[1]
-            wr_bytes += io[3]
-
-        diskRdKB = float(rd_bytes) / 1024
-        diskWrKB = float(wr_bytes) / 1024
+        diskRdKB = float(sample['disk_rd']) / 1024
+        diskWrKB = float(sample['disk_wr']) / 1024
 
         rd_stats = (diskRdKB - prevDiskRdKB) / seconds
         wr_stats = (diskWrKB - prevDiskWrKB) / seconds
@@ -234,7 +327,7 @@ class VMsModel(object):
                           volumes=vol_list)
 
         try:
-            conn.defineXML(xml.encode('utf-8'))
+            dom = conn.defineXML(xml.encode('utf-8'))
         except libvirt.libvirtError as e:
             if t._get_storage_type() not in READONLY_POOL_TYPE:
                 for v in vol_list:
@@ -243,18 +336,86 @@ class VMsModel(object):
             raise OperationFailed("KCHVM0007E", {'name': name,
                                                  'err': e.get_error_message()})
 
-        VMModel.vm_update_os_metadata(VMModel.get_vm(name, self.conn), t.info,
-                                      self.caps.metadata_support)
+        VMModel.vm_update_os_metadata(dom, t.info, self.caps.metadata_support)
+        DomainInventory.domain_defined(self.conn, dom)
 
         return name
 
     def get_list(self):
         return self.get_vms(self.conn)
 
+    def get_list_detailed(self, _fields=None, _state=None):
+        if _state is None:
+            names = self.get_list()
+        else:
+            names = self._get_vms_by_state(_state)
+
+        # the VMs are looked up in batches, so the ones after the requested
+        # page are not looked up at all
+        for i in xrange(0, len(names), DETAILED_LIST_BATCH):
+            doms = []
+            for name in names[i:i + DETAILED_LIST_BATCH]:
+                try:
+                    doms.append((name, VMModel.get_vm(name, self.conn)))
+                except NotFoundError:
+                    # VM might be deleted just after we get the list
+                    continue
+
+            # read the extra information of the batch in a single session
+            extra_infos = dict((name, {}) for name, dom in doms)
+            if _fields is None or 'icon' in _fields:
+                with self.objstore as session:
+                    for name, dom in doms:
+                        try:
+                            extra_infos[name] = session.get('vm',
+                                                            dom.UUIDString())
+                        except NotFoundError:
+                            pass
+
+            for name, dom in doms:
+                try:
+                    info = VMModel._get_vm_info(name, dom, extra_infos[name],
+                                                _fields, self.conn, self.caps,
+                                                self.vmscreenshot)
+                except NotFoundError:
+                    continue
+                except libvirt.libvirtError as e:
+                    # the VM was deleted since its batch was looked up
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                        raise
+                    continue
+                yield name, info
+
+    def _get_vms_by_state(self, state):
+        inventory = DomainInventory.get_inventory(self.conn)
+        if inventory is not None:
+            match = compile_filter(state)
+            names = []
+            for name in inventory.get_names():
+                vm_state = DOM_STATE_MAP.get(inventory.get_state(name))
+                if vm_state is not None and match(vm_state):
+                    names.append(name)
+        else:
+            flags = compile_filter_flags(state, DOM_LIST_FLAGS,
+                                         DOM_STATE_MAP.values())
+            if flags:
+                conn = self.conn.get()
+                names = [dom.name().decode('utf-8')
+                         for dom in conn.listAllDomains(flags)]
+            else:
+                # the state is checked again when filtering the VMs details
+                names = self.get_list()
+        return sorted(names, key=unicode.lower)
+
     @staticmethod
     def get_vms(conn):
-        conn = conn.get()
-        names = [dom.name().decode('utf-8') for dom in conn.listAllDomains(0)]
+        inventory = DomainInventory.get_inventory(conn)
+        if inventory is not None:
+            names = inventory.get_names()
+        else:
+            conn = conn.get()
+            names = [dom.name().decode('utf-8')
+                     for dom in conn.listAllDomains(0)]
         return sorted(names, key=unicode.lower)
 
 
@@ -321,7 +482,8 @@ class VMModel(object):
 
         # lookup names of VMs being created right now
         with self.objstore as session:
-            task_names = session.get_list('task')
+            task_names = (session.find('task', status='queued') +
+                          session.find('task', status='running'))
             for tn in task_names:
                 t = session.get('task', tn)
                 if t['target_uri'].startswith('/vms/'):
@@ -387,11 +549,12 @@ class VMModel(object):
             # create new guest
             cb('defining new VM')
             try:
-                vir_conn.defineXML(xml)
+                new_dom = vir_conn.defineXML(xml)
             except libvirt.libvirtError, e:
                 raise OperationFailed('KCHVM0035E', {'name': name,
                                                      'err': e.message})
 
+            DomainInventory.domain_defined(self.conn, new_dom)
             rollback.commitAll()
 
         cb('OK', True)
@@ -534,9 +697,10 @@ class VMModel(object):
         """
         with self.objstore as session:
             try:
-                vm = session.get('vm', old_uuid)
-                icon = vm['icon']
-                session.store('vm', new_uuid, {'icon': icon})
+                with session.transaction():
+                    vm = session.get('vm', old_uuid)
+                    icon = vm['icon']
+                    session.store('vm', new_uuid, {'icon': icon})
             except NotFoundError:
                 # if we cannot find an object store entry for the original VM,
                 # don't store one with an empty value.
@@ -585,18 +749,30 @@ class VMModel(object):
         if users is None and groups is None:
             return
 
-        old_users, old_groups = self._get_access_info(dom)
+        old_users, old_groups = self._get_access_info(dom, self.caps)
         users = old_users if users is None else users
         groups = old_groups if groups is None else groups
 
         node = self._build_access_elem(users, groups)
         set_metadata_node(dom, node, self.caps.metadata_support)
 
-    def _get_access_info(self, dom):
+    @staticmethod
+    def _get_access_info(dom, caps, root=None):
+        """Return the users and groups allowed to access the domain.
+
+        If "root", the parsed domain descriptor, is provided, the access
+        metadata is read from it instead of being requested to libvirt.
+        Without the libvirt metadata API, the access metadata is only written
+        to the persistent configuration, so it is always read from there.
+        """
         users = groups = list()
-        access_xml = (get_metadata_node(dom, "access",
-                                        self.caps.metadata_support) or
-                      """<access></access>""")
+        if root is None or not caps.metadata_support:
+            access_xml = get_metadata_node(dom, "access",
+                                           caps.metadata_support)
+        else:
+            access_xml = get_metadata_node_from_xml(root, "access")
+        access_xml = objectify.fromstring(access_xml or
+                                          """<access></access>""")
         access_info = dictize(access_xml)
         auth = config.get("authentication", "method")
         if ('auth' in access_info['access'] and
@@ -735,6 +911,8 @@ class VMModel(object):
 
                 # Undefine old vm, only if name is going to change
                 dom.undefine()
+                DomainInventory.domain_removed(self.conn,
+                                               vm_name.decode('utf-8'))
 
             root = ET.fromstring(new_xml)
             currentMem = root.find('.currentMemory')
@@ -742,10 +920,12 @@ class VMModel(object):
                 root.remove(currentMem)
 
             dom = conn.defineXML(ET.tostring(root, encoding="utf-8"))
+            DomainInventory.domain_defined(self.conn, dom)
             if 'name' in params:
                 self._redefine_snapshots(dom, snapshots_info)
         except libvirt.libvirtError as e:
             dom = conn.defineXML(old_xml)
+            DomainInventory.domain_defined(self.conn, dom)
             if 'name' in params:
                 self._redefine_snapshots(dom, snapshots_info)
 
@@ -755,65 +935,101 @@ class VMModel(object):
 
     def _live_vm_update(self, dom, params):
         self._vm_update_access_metadata(dom, params)
+        # libvirt does not emit any event for metadata changes
+        DomainInventory.invalidate_domain(self.conn,
+                                          dom.name().decode('utf-8'))
 
-    def _has_video(self, dom):
-        dom = ElementTree.fromstring(dom.XMLDesc(0))
-        return dom.find('devices/video') is not None
+    @staticmethod
+    def _has_video(root):
+        return root.find('devices/video') is not None
 
-    def lookup(self, name):
+    def lookup(self, name, _fields=None):
         dom = self.get_vm(name, self.conn)
+        extra_info = {}
+        if _fields is None or 'icon' in _fields:
+            with self.objstore as session:
+                try:
+                    extra_info = session.get('vm', dom.UUIDString())
+                except NotFoundError:
+                    pass
+
+        return self._get_vm_info(name, dom, extra_info, _fields, self.conn,
+                                 self.caps, self.vmscreenshot)
+
+    @staticmethod
+    def _get_vm_info(name, dom, extra_info, fields, conn, caps, vmscreenshot):
+        """Return the information of the VM.
+
+        "fields" is the set of attributes to be returned, or None for all of
+        them. The attributes which are expensive to compute (graphics,
+        screenshot, stats, icon, users and groups) are only computed when
+        requested.
+
+        It is shared by the VM lookup and the VMs listing, which pass their
+        connection, capabilities and screenshot model.
+        """
+        def wanted(*keys):
+            return fields is None or bool(fields.intersection(keys))
+
         info = dom.info()
         state = DOM_STATE_MAP[info[0]]
-        screenshot = None
-        # (type, listen, port, passwd, passwdValidTo)
-        graphics = self._vm_get_graphics(name)
-        graphics_port = graphics[2]
-        graphics_port = graphics_port if state == 'running' else None
-        try:
-            if state == 'running' and self._has_video(dom):
-                screenshot = self.vmscreenshot.lookup(name)
-            elif state == 'shutoff':
-                # reset vm stats when it is powered off to avoid sending
-                # incorrect (old) data
-                stats[dom.UUIDString()] = {}
-        except NotFoundError:
-            pass
-
-        with self.objstore as session:
+        res = {'name': name,
+               'state': state,
+               'uuid': dom.UUIDString(),
+               'memory': info[2] >> 10,
+               'cpus': info[3],
+               'access': 'full',
+               'persistent': True if dom.isPersistent() else False}
+
+        if state == 'shutoff':
+            # reset vm stats when it is powered off to avoid sending
+            # incorrect (old) data
+            stats[dom.UUIDString()] = {}
+
+        if wanted('stats'):
+            vm_stats = stats.get(dom.UUIDString(), {})
+            res['stats'] = {
+                'cpu_utilization': vm_stats.get('cpu', 0),
+                'net_throughput': vm_stats.get('net_io', 0),
+                'net_throughput_peak': vm_stats.get('max_net_io', 100),
+                'io_throughput': vm_stats.get('disk_io', 0),
+                'io_throughput_peak': vm_stats.get('max_disk_io', 100)}
+
+        if wanted('icon'):
+            res['icon'] = extra_info.get('icon')
+
+        if not wanted('graphics', 'screenshot', 'users', 'groups'):
+            return res
+
+        # the domain descriptor is fetched and parsed only once and shared by
+        # all the helpers below
+        root = VMModel.get_vm_root(dom, conn)
+        if wanted('graphics'):
+            # (type, listen, port, passwd, passwdValidTo)
+            graphics = VMModel._get_graphics_info(root)
+            graphics_port = graphics[2]
+            graphics_port = graphics_port if state == 'running' else None
+            res['graphics'] = {"type": graphics[0],
+                               "listen": graphics[1],
+                               "port": graphics_port,
+                               "passwd": graphics[3],
+                               "passwdValidTo": graphics[4]}
+
+        if wanted('screenshot'):
+            screenshot = None
             try:
-                extra_info = session.get('vm', dom.UUIDString())
+                if state == 'running' and VMModel._has_video(root):
+                    screenshot = vmscreenshot._get_last_thumbnail(
+                        dom.UUIDString())
             except NotFoundError:
-                extra_info = {}
-        icon = extra_info.get('icon')
-
-        vm_stats = stats.get(dom.UUIDString(), {})
-        res = {}
-        res['cpu_utilization'] = vm_stats.get('cpu', 0)
-        res['net_throughput'] = vm_stats.get('net_io', 0)
-        res['net_throughput_peak'] = vm_stats.get('max_net_io', 100)
-        res['io_throughput'] = vm_stats.get('disk_io', 0)
-        res['io_throughput_peak'] = vm_stats.get('max_disk_io', 100)
-        users, groups = self._get_access_info(dom)
-
-        return {'name': name,
-                'state': state,
-                'stats': res,
-                'uuid': dom.UUIDString(),
-                'memory': info[2] >> 10,
-                'cpus': info[3],
-                'screenshot': screenshot,
-                'icon': icon,
-                # (type, listen, port, passwd, passwdValidTo)
-                'graphics': {"type": graphics[0],
-                             "listen": graphics[1],
-                             "port": graphics_port,
-                             "passwd": graphics[3],
-                             "passwdValidTo": graphics[4]},
-                'users': users,
-                'groups': groups,
-                'access': 'full',
-                'persistent': True if dom.isPersistent() else False
-                }
+                pass
+            res['screenshot'] = screenshot
+
+        if wanted('users', 'groups'):
+            res['users'], res['groups'] = VMModel._get_access_info(dom, caps,
+                                                                   root)
+
+        return res
 
     def _vm_get_disk_paths(self, dom):
         xml = dom.XMLDesc(0)
@@ -822,10 +1038,20 @@ class VMModel(object):
 
     @staticmethod
     def get_vm(name, conn):
-        conn = conn.get()
+        inventory = DomainInventory.get_inventory(conn)
+        if inventory is not None:
+            dom = inventory.get_domain(name)
+            if dom is not None:
+                return dom
+
+        vir_conn = conn.get()
         try:
             # outgoing text to libvirt, encode('utf-8')
-            return conn.lookupByName(name.encode("utf-8"))
+            dom = vir_conn.lookupByName(name.encode("utf-8"))
+            if inventory is not None:
+                # the domain event has not been processed yet
+                inventory.update_domain(dom)
+            return dom
         except libvirt.libvirtError as e:
             if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
                 raise NotFoundError("KCHVM0002E", {'name': name})
@@ -833,13 +1059,31 @@ class VMModel(object):
                 raise OperationFailed("KCHVM0009E", {'name': name,
                                                      'err': e.message})
 
+    @staticmethod
+    def get_vm_root(dom, conn):
+        """Return the parsed (objectified) secure XML descriptor of "dom".
+
+        The descriptor comes from the domain inventory when it is available
+        and is shared with other callers, so it must not be modified.
+        """
+        inventory = DomainInventory.get_inventory(conn)
+        if inventory is not None:
+            root = inventory.get_root(dom.name().decode('utf-8'))
+            if root is not None:
+                return root
+
+        xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
+        return objectify.fromstring(xml)
+
     def delete(self, name):
         conn = self.conn.get()
         dom = self.get_vm(name, self.conn)
         if not dom.isPersistent():
             raise InvalidOperation("KCHVM0036E", {'name': name})
 
-        self._vmscreenshot_delete(dom.UUIDString())
+        vm_uuid = dom.UUIDString()
+        # the screenshot files are found by the VM uuid
+        LibvirtVMScreenshot({'uuid': vm_uuid}, self.conn).delete()
         paths = self._vm_get_disk_paths(dom)
         info = self.lookup(name)
 
@@ -865,7 +1109,9 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVM0021E",
                                   {'name': name, 'err': e.get_error_message()})
+        DomainInventory.domain_removed(self.conn, name)
 
+        deleted_paths = []
         for path in paths:
             try:
                 vol = conn.storageVolLookupByPath(path)
@@ -874,29 +1120,29 @@ class VMModel(object):
                 pool_type = xpath_get_text(xml, "/pool/@type")[0]
                 if pool_type not in READONLY_POOL_TYPE:
                     vol.delete(0)
-                    # Update objstore to remove the volume
-                    with self.objstore as session:
-                        session.delete('storagevolume', path,
-                                       ignore_missing=True)
+                    deleted_paths.append(path)
             except libvirt.libvirtError as e:
                 kimchi_log.error('Unable to get storage volume by path: %s' %
                                  e.message)
             except Exception as e:
                 raise OperationFailed('KCHVOL0017E', {'err': e.message})
 
-            try:
-                with self.objstore as session:
-                    if path in session.get_list('storagevolume'):
-                        n = session.get('storagevolume', path)['ref_cnt']
-                        session.store('storagevolume', path, {'ref_cnt': n-1})
-            except Exception as e:
-                raise OperationFailed('KCHVOL0017E', {'err': e.message})
-
+        # update the objstore in a single transaction: remove the deleted
+        # volumes, release the other ones and remove the VM information
         try:
             with self.objstore as session:
-                session.delete('vm', dom.UUIDString(), ignore_missing=True)
+                with session.transaction():
+                    session.delete_many('storagevolume', deleted_paths)
+                    kept_paths = [p for p in paths if p not in deleted_paths]
+                    volumes = session.get_many('storagevolume', kept_paths)
+                    for path in kept_paths:
+                        if path in volumes:
+                            volumes[path]['ref_cnt'] -= 1
+                    session.store_many('storagevolume', volumes.items())
+                    session.delete_many('vm', [vm_uuid])
+                    session.delete_many('screenshot', [vm_uuid])
         except Exception as e:
-            # It is possible to delete vm without delete its database info
+            # the VM is already deleted at this point, so this is not fatal
             kimchi_log.error('Error deleting vm information from database: '
                              '%s', e.message)
 
@@ -917,6 +1163,8 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVM0019E",
                                   {'name': name, 'err': e.get_error_message()})
+        # the graphics port and state change with the domain state
+        DomainInventory.invalidate_domain(self.conn, name)
 
     def poweroff(self, name):
         dom = self.get_vm(name, self.conn)
@@ -925,6 +1173,8 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVM0020E",
                                   {'name': name, 'err': e.get_error_message()})
+        # the graphics port and state change with the domain state
+        DomainInventory.invalidate_domain(self.conn, name)
 
     def shutdown(self, name):
         dom = self.get_vm(name, self.conn)
@@ -943,29 +1193,31 @@ class VMModel(object):
                                   {'name': name, 'err': e.get_error_message()})
 
     def _vm_get_graphics(self, name):
-        dom = self.get_vm(name, self.conn)
-        xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
+        root = self.get_vm_root(self.get_vm(name, self.conn), self.conn)
+        return self._get_graphics_info(root)
 
+    @staticmethod
+    def _get_graphics_info(root):
         expr = "/domain/devices/graphics/@type"
-        res = xpath_get_text(xml, expr)
+        res = xpath_get_text(root, expr)
         graphics_type = res[0] if res else None
 
         expr = "/domain/devices/graphics/@listen"
-        res = xpath_get_text(xml, expr)
+        res = xpath_get_text(root, expr)
         graphics_listen = res[0] if res else None
 
         graphics_port = graphics_passwd = graphics_passwdValidTo = None
         if graphics_type:
             expr = "/domain/devices/graphics[@type='%s']/@port"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = xpath_get_text(root, expr % graphics_type)
             graphics_port = int(res[0]) if res else None
 
             expr = "/domain/devices/graphics[@type='%s']/@passwd"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = xpath_get_text(root, expr % graphics_type)
             graphics_passwd = res[0] if res else None
 
             expr = "/domain/devices/graphics[@type='%s']/@passwdValidTo"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = xpath_get_text(root, expr % graphics_type)
             if res:
                 to = time.mktime(time.strptime(res[0], '%Y-%m-%dT%H:%M:%S'))
                 graphics_passwdValidTo = to - time.mktime(time.gmtime())
@@ -981,21 +1233,27 @@ class VMModel(object):
         else:
             raise OperationFailed("KCHVM0010E", {'name': name})
 
-    def _vmscreenshot_delete(self, vm_uuid):
-        screenshot = VMScreenshotModel.get_screenshot(vm_uuid, self.objstore,
-                                                      self.conn)
-        screenshot.delete()
-        try:
-            with self.objstore as session:
-                session.delete('screenshot', vm_uuid)
-        except Exception as e:
-            # It is possible to continue Kimchi executions without delete
-            # screenshots
-            kimchi_log.error('Error trying to delete vm screenshot from '
-                             'database due error: %s', e.message)
+
+class VMStatsHistoryModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+
+    def lookup(self, name):
+        dom = VMModel.get_vm(name, self.conn)
+        history = stats_history.get(dom.UUIDString())
+        if history is None:
+            history = new_stats_history()
+        return history.get()
 
 
 class VMScreenshotModel(object):
+    # shared by all the instances, so the number of screenshots being taken
+    # at the same time is bounded
+    refresher = ScreenshotRefresher()
+    # seconds to wait for an explicitly requested screenshot, the current
+    # thumbnail is returned if it takes longer
+    REFRESH_TIMEOUT = 10
+
     def __init__(self, **kargs):
         self.objstore = kargs['objstore']
         self.conn = kargs['conn']
@@ -1008,17 +1266,48 @@ class VMScreenshotModel(object):
             raise NotFoundError("KCHVM0004E", {'name': name})
 
         screenshot = self.get_screenshot(vm_uuid, self.objstore, self.conn)
-        img_path = screenshot.lookup()
+        if screenshot.outdated():
+            # the screenshot was explicitly requested, so wait for it
+            event = self.refresher.refresh(screenshot, self._store_screenshot)
+            event.wait(self.REFRESH_TIMEOUT)
+            screenshot = self.get_screenshot(vm_uuid, self.objstore,
+                                             self.conn)
+        return screenshot.get_url()
+
+    def _get_last_thumbnail(self, vm_uuid):
+        """
+        Return the last thumbnail of a running VM without waiting for a new
+        screenshot: it is taken in background when the thumbnail is outdated.
+        """
+        screenshot = self.get_screenshot(vm_uuid, self.objstore, self.conn)
+        if screenshot.create_placeholder():
+            self._store_screenshot(screenshot)
+            self.refresher.refresh(screenshot, self._store_screenshot)
+        elif screenshot.outdated():
+            self.refresher.refresh(screenshot, self._store_screenshot)
+        return screenshot.get_url()
+
+    def _store_screenshot(self, screenshot):
+        try:
+            self.conn.get().lookupByUUIDString(screenshot.vm_uuid)
+        except libvirt.libvirtError:
+            # the VM was deleted while the screenshot was taken
+            screenshot.delete()
+            return
+
         # screenshot info changed after scratch generation
         try:
             with self.objstore as session:
-                session.store('screenshot', vm_uuid, screenshot.info)
+                session.store('screenshot', screenshot.vm_uuid,
+                              screenshot.info)
         except Exception as e:
             # It is possible to continue Kimchi executions without store
             # screenshots
             kimchi_log.error('Error trying to update database with guest '
                              'screenshot information due error: %s', e.message)
-        return img_path
+
+        # the thumbnail is part of the VM resources
+        notifier.notify('vms')
 
     @staticmethod
     def get_screenshot(vm_uuid, objstore, conn):
@@ -1044,19 +1333,20 @@ class LibvirtVMScreenshot(VMScreenshot):
         VMScreenshot.__init__(self, vm_uuid)
         self.conn = conn
 
-    def _generate_scratch(self, thumbnail):
+    def _get_scratch(self):
         def handler(stream, buf, opaque):
-            fd = opaque
-            os.write(fd, buf)
+            opaque.append(buf)
 
-        fd = os.open(thumbnail, os.O_WRONLY | os.O_TRUNC | os.O_CREAT, 0644)
+        chunks = []
+        vm_name = self.vm_uuid
+        stream = None
         try:
             conn = self.conn.get()
             dom = conn.lookupByUUIDString(self.vm_uuid)
             vm_name = dom.name()
             stream = conn.newStream(0)
             dom.screenshot(stream, 0, 0)
-            stream.recvAll(handler, fd)
+            stream.recvAll(handler, chunks)
         except libvirt.libvirtError:
             try:
                 stream.abort()
@@ -1065,5 +1355,4 @@ class LibvirtVMScreenshot(VMScreenshot):
             raise NotFoundError("KCHVM0006E", {'name': vm_name})
         else:
             stream.finish()
-        finally:
-            os.close(fd)
+        return ''.join(chunks)
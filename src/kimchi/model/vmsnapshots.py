@@ -25,6 +25,7 @@ from lxml import objectify
 from lxml.builder import E
 
 from kimchi.exception import InvalidOperation, NotFoundError, OperationFailed
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.tasks import TaskModel
 from kimchi.model.vms import DOM_STATE_MAP, VMModel
 from kimchi.model.vmstorages import VMStorageModel, VMStoragesModel
@@ -161,6 +162,13 @@ class VMSnapshotModel(object):
             # get vm name recorded in the snapshot and return new uri params
             vm_new_name = xpath_get_text(vir_snap.getXMLDesc(0),
                                          'domain/name')[0]
+
+            # the descriptor and the state changed, and libvirt does not
+            # undefine the domain under its previous name if it was renamed
+            if vm_new_name != vm_name:
+                DomainInventory.domain_removed(self.conn, vm_name)
+            vir_dom = self.conn.get().lookupByName(vm_new_name.encode('utf-8'))
+            DomainInventory.domain_defined(self.conn, vir_dom)
             return [vm_new_name, name]
         except libvirt.libvirtError, e:
             raise OperationFailed('KCHSNAP0009E', {'name': name,
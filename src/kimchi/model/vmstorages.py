@@ -24,6 +24,7 @@ from lxml import etree
 from kimchi.exception import InvalidOperation, InvalidParameter, NotFoundError
 from kimchi.exception import OperationFailed
 from kimchi.model.config import CapabilitiesModel
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.vms import DOM_STATE_MAP, VMModel
 from kimchi.model.storagevolumes import StorageVolumeModel
 from kimchi.model.utils import check_remote_disk_path, get_vm_config_flag
@@ -142,6 +143,7 @@ class VMStoragesModel(object):
             dom.attachDeviceFlags(xml, get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed("KCHVMSTOR0008E", {'error': e.message})
+        DomainInventory.invalidate_domain(self.conn, vm_name)
 
         # Don't put a try-block here. Let the exception be raised. If we
         #   allow disks ref_cnts to be out of sync, data corruption could
@@ -198,6 +200,7 @@ class VMStorageModel(object):
                                   get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed("KCHVMSTOR0010E", {'error': e.message})
+        DomainInventory.invalidate_domain(self.conn, vm_name)
 
         if ref_cnt is not None and ref_cnt > 0:
             set_disk_ref_cnt(self.objstore, path, ref_cnt - 1)
@@ -236,6 +239,7 @@ class VMStorageModel(object):
             dom.updateDeviceFlags(xml, get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed("KCHVMSTOR0009E", {'error': e.message})
+        DomainInventory.invalidate_domain(self.conn, vm_name)
 
         try:
             if old_disk_ref_cnt is not None and \
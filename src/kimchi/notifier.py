@@ -0,0 +1,87 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2015
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+
+import threading
+import time
+
+
+class ChangeNotifier(object):
+    """
+    Wake up the threads waiting for a change of the state kimchi reports to
+    its clients. The changes are notified by topic ('tasks', 'vms' or
+    'storagepools') and each topic has a generation, increased on every
+    change, so a thread can tell whether one happened since it last read the
+    state. The None topic gets all the changes.
+
+    A topic is tracked (see track()) while every change of its state is
+    notified, so its generation can tag the state reported to the clients.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generations = {}
+        self._conds = {}
+        self._tracked = set()
+
+    def _get_cond(self, topic):
+        # must be called with self._lock held
+        if topic not in self._conds:
+            self._conds[topic] = threading.Condition(self._lock)
+            self._generations[topic] = 0
+        return self._conds[topic]
+
+    def get_generation(self, topic=None):
+        with self._lock:
+            self._get_cond(topic)
+            return self._generations[topic]
+
+    def track(self, topic, tracked=True):
+        with self._lock:
+            if tracked:
+                self._tracked.add(topic)
+            else:
+                self._tracked.discard(topic)
+
+    def is_tracked(self, topic):
+        return topic in self._tracked
+
+    def notify(self, topic):
+        with self._lock:
+            for key in (topic, None):
+                cond = self._get_cond(key)
+                self._generations[key] += 1
+                cond.notifyAll()
+
+    def wait(self, generation, timeout, topic=None):
+        """
+        Wait at most "timeout" seconds for a change of "topic" after
+        "generation". Return its current generation.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            cond = self._get_cond(topic)
+            while self._generations[topic] == generation:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                cond.wait(remaining)
+            return self._generations[topic]
+
+
+notifier = ChangeNotifier()
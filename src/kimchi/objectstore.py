@@ -16,7 +16,10 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import contextlib
+import copy
 import json
+import Queue
 import sqlite3
 import threading
 import traceback
@@ -29,14 +32,157 @@ except ImportError:
 
 
 from kimchi import config
-from kimchi.exception import NotFoundError
+from kimchi.exception import NotFoundError, OperationFailed
 from kimchi.utils import kimchi_log
 
 
+# Attributes indexed for each object type, so find() does not need to decode
+# all the objects of the type. The values of a list attribute are indexed
+# separately: find(obj_type, attr=value) returns the objects whose list
+# contains value.
+OBJECT_INDEXES = {'task': ['status', 'target_uri'],
+                  'template': ['networks']}
+
+# maximum number of ids in a single query of get_many() or delete_many(),
+# under the sqlite limit of 999 variables per statement
+MAX_QUERY_IDS = 500
+
+# Maximum number of objects of each type kept in memory by the cache of the
+# object store. The types not listed here are always read from the database.
+CACHE_CAPACITY = {'vm': 1024,
+                  'screenshot': 1024,
+                  'storagevolume': 4096,
+                  'isoinfo': 1024}
+
+# Number of the threads, besides the HTTP requests and the tasks, which may
+# use the object store at once: the screenshot refreshers, the guests
+# statistics, the tasks sweeper and the nested tasks
+BACKGROUND_THREADS = 10
+
+
+def get_pool_size():
+    """
+    Return the default size of the connection pool of an object store: one
+    connection for each thread which may use it at once.
+    """
+    return (config.config.getint('server', 'thread_pool') +
+            config.config.getint('tasks', 'workers') + BACKGROUND_THREADS)
+
+
+def _get_index_values(data, attr):
+    value = data.get(attr)
+    values = value if isinstance(value, list) else [value]
+    return [v for v in values
+            if v is not None and isinstance(v, (basestring, int, float))]
+
+
+class ObjectCache(object):
+    """
+    Write-through LRU cache of the objects of the types in "capacity", a dict
+    with the maximum number of objects kept for each type. The objects known
+    not to exist are cached too, as None.
+
+    The cache is only updated with the committed writes. An object read from
+    the database is only added to the cache if no write was committed since
+    the lookup which missed it, so a slow reader cannot replace the data of
+    a concurrent write with the data it read before.
+    """
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._objects = dict((t, OrderedDict()) for t in capacity)
+        self._generation = 0
+        self.hits = dict((t, 0) for t in capacity)
+        self.misses = dict((t, 0) for t in capacity)
+
+    def is_cached(self, obj_type):
+        return obj_type in self._capacity
+
+    def lookup(self, obj_type, ident):
+        """
+        Return a tuple (found, data, generation). The generation must be
+        given to fill() to add the object read from the database on a miss.
+        """
+        with self._lock:
+            objects = self._objects[obj_type]
+            try:
+                data = objects.pop(ident)
+            except KeyError:
+                self.misses[obj_type] += 1
+                return False, None, self._generation
+
+            # move the object to the most recently used end
+            objects[ident] = data
+            self.hits[obj_type] += 1
+            return True, copy.deepcopy(data), self._generation
+
+    def fill(self, obj_type, ident, data, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._set(obj_type, ident, copy.deepcopy(data))
+
+    def update(self, changes):
+        """
+        Apply the committed writes in changes, a dict of the new data of each
+        (type, id) pair, or None for the deleted objects.
+        """
+        with self._lock:
+            self._generation += 1
+            for (obj_type, ident), data in changes.iteritems():
+                if obj_type in self._capacity:
+                    self._set(obj_type, ident, copy.deepcopy(data))
+
+    def get_stats(self):
+        with self._lock:
+            return dict((t, {'capacity': self._capacity[t],
+                             'size': len(self._objects[t]),
+                             'hits': self.hits[t],
+                             'misses': self.misses[t]})
+                        for t in self._capacity)
+
+    def _set(self, obj_type, ident, data):
+        objects = self._objects[obj_type]
+        objects.pop(ident, None)
+        objects[ident] = data
+        if len(objects) > self._capacity[obj_type]:
+            objects.popitem(last=False)
+
+
 class ObjectStoreSession(object):
-    def __init__(self, conn):
+    def __init__(self, conn, write_lock, cache):
         self.conn = conn
-        self.conn.text_factory = lambda x: unicode(x, "utf-8", "ignore")
+        self._write_lock = write_lock
+        self._cache = cache
+        self._in_transaction = False
+        # writes of the current transaction, applied to the cache on commit
+        self._pending = OrderedDict()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Run the writes of the block in a single transaction, committed at its
+        end or rolled back if it raises an exception. The other writers wait
+        for the end of the block, so the objects read in it are not changed
+        by another thread meanwhile. A transaction inside another one is
+        part of it.
+        """
+        with self._write_lock:
+            if self._in_transaction:
+                yield
+                return
+
+            self._in_transaction = True
+            try:
+                yield
+            except:
+                self.conn.rollback()
+                raise
+            else:
+                self.conn.commit()
+                self._cache.update(self._pending)
+            finally:
+                self._in_transaction = False
+                self._pending = OrderedDict()
 
     def _get_list(self, obj_type):
         c = self.conn.cursor()
@@ -44,6 +190,15 @@ class ObjectStoreSession(object):
         return [x[0] for x in res]
 
     def get_list(self, obj_type, sort_key=None):
+        if sort_key in OBJECT_INDEXES.get(obj_type, []):
+            c = self.conn.cursor()
+            res = c.execute('''SELECT objects.id FROM objects
+                LEFT JOIN object_attrs ON object_attrs.type=objects.type AND
+                    object_attrs.id=objects.id AND object_attrs.attr=?
+                WHERE objects.type=? GROUP BY objects.id
+                ORDER BY MIN(object_attrs.value)''', (sort_key, obj_type))
+            return [x[0] for x in res]
+
         ids = self._get_list(obj_type)
         if sort_key is None:
             return ids
@@ -51,81 +206,291 @@ class ObjectStoreSession(object):
         objects.sort(key=lambda (_, obj): obj[sort_key])
         return [ident for ident, _ in objects]
 
+    def find(self, obj_type, **attrs):
+        """
+        Return the ids of the objects of type obj_type whose attributes have
+        the given values. The attributes declared in OBJECT_INDEXES are
+        looked up in the index, the others are checked on each object left.
+        """
+        indexed = OBJECT_INDEXES.get(obj_type, [])
+        query = 'SELECT id FROM objects WHERE type=?'
+        params = [obj_type]
+        others = {}
+        for attr, value in attrs.iteritems():
+            if attr not in indexed:
+                others[attr] = value
+                continue
+            query += (' AND id IN (SELECT id FROM object_attrs WHERE type=? '
+                      'AND attr=? AND value=?)')
+            params += [obj_type, attr, value]
+
+        c = self.conn.cursor()
+        ids = [x[0] for x in c.execute(query, params)]
+        if not others:
+            return ids
+
+        res = []
+        for ident in ids:
+            obj = self.get(obj_type, ident)
+            if all(value in _get_index_values(obj, attr)
+                   for attr, value in others.iteritems()):
+                res.append(ident)
+        return res
+
+    def _use_cache(self, obj_type, ident):
+        # the objects written in the current transaction are read from the
+        # database until it is committed
+        return (self._cache.is_cached(obj_type) and
+                (obj_type, ident) not in self._pending)
+
     def get(self, obj_type, ident):
+        if self._use_cache(obj_type, ident):
+            found, data, generation = self._cache.lookup(obj_type, ident)
+            if not found:
+                data = self._get(obj_type, ident)
+                self._cache.fill(obj_type, ident, data, generation)
+        else:
+            data = self._get(obj_type, ident)
+
+        if data is None:
+            raise NotFoundError("KCHOBJST0001E", {'item': ident})
+        return data
+
+    def _get(self, obj_type, ident):
         c = self.conn.cursor()
         res = c.execute('SELECT json FROM objects WHERE type=? AND id=?',
                         (obj_type, ident))
-        try:
-            jsonstr = res.fetchall()[0][0]
-        except IndexError:
-            self.conn.rollback()
-            raise NotFoundError("KCHOBJST0001E", {'item': ident})
-        return json.loads(jsonstr)
+        row = res.fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_many(self, obj_type, idents):
+        """
+        Return a dict of the objects of type obj_type with the given ids.
+        The ids which do not exist are left out.
+        """
+        res = {}
+        missed = []
+        for ident in idents:
+            if not self._use_cache(obj_type, ident):
+                missed.append((ident, None))
+                continue
+
+            found, data, generation = self._cache.lookup(obj_type, ident)
+            if not found:
+                missed.append((ident, generation))
+            elif data is not None:
+                res[ident] = data
 
-    def delete(self, obj_type, ident, ignore_missing=False):
         c = self.conn.cursor()
-        c.execute('DELETE FROM objects WHERE type=? AND id=?',
-                  (obj_type, ident))
-        if c.rowcount != 1 and not ignore_missing:
-            self.conn.rollback()
-            raise NotFoundError("KCHOBJST0001E", {'item': ident})
-        self.conn.commit()
+        for i in xrange(0, len(missed), MAX_QUERY_IDS):
+            chunk = missed[i:i + MAX_QUERY_IDS]
+            query = 'SELECT id, json FROM objects WHERE type=? AND id IN (%s)'
+            query = query % ','.join('?' * len(chunk))
+            params = [obj_type] + [ident for ident, _ in chunk]
+            for ident, jsonstr in c.execute(query, params):
+                res[ident] = json.loads(jsonstr)
+            for ident, generation in chunk:
+                if generation is not None:
+                    self._cache.fill(obj_type, ident, res.get(ident),
+                                     generation)
+        return res
+
+    def delete(self, obj_type, ident, ignore_missing=False):
+        with self.transaction():
+            c = self.conn.cursor()
+            c.execute('DELETE FROM objects WHERE type=? AND id=?',
+                      (obj_type, ident))
+            if c.rowcount != 1 and not ignore_missing:
+                raise NotFoundError("KCHOBJST0001E", {'item': ident})
+            _delete_index(c, obj_type, ident)
+            self._pending[(obj_type, ident)] = None
+
+    def delete_many(self, obj_type, idents):
+        """
+        Delete the objects of type obj_type with the given ids, ignoring the
+        ones which do not exist.
+        """
+        idents = list(idents)
+        with self.transaction():
+            c = self.conn.cursor()
+            for i in xrange(0, len(idents), MAX_QUERY_IDS):
+                chunk = idents[i:i + MAX_QUERY_IDS]
+                where = 'WHERE type=? AND id IN (%s)'
+                where = where % ','.join('?' * len(chunk))
+                c.execute('DELETE FROM objects ' + where, [obj_type] + chunk)
+                if obj_type in OBJECT_INDEXES:
+                    c.execute('DELETE FROM object_attrs ' + where,
+                              [obj_type] + chunk)
+                for ident in chunk:
+                    self._pending[(obj_type, ident)] = None
 
     def store(self, obj_type, ident, data):
-        jsonstr = json.dumps(data)
-        c = self.conn.cursor()
-        c.execute('DELETE FROM objects WHERE type=? AND id=?',
-                  (obj_type, ident))
-        c.execute('INSERT INTO objects (id, type, json) VALUES (?,?,?)',
-                  (ident, obj_type, jsonstr))
-        self.conn.commit()
+        self.store_many(obj_type, [(ident, data)])
+
+    def store_many(self, obj_type, items):
+        """
+        Store the objects of type obj_type in items, a list of (id, data)
+        pairs, in a single transaction.
+        """
+        with self.transaction():
+            c = self.conn.cursor()
+            for ident, data in items:
+                c.execute('''INSERT OR REPLACE INTO objects (id, type, json)
+                    VALUES (?,?,?)''', (ident, obj_type, json.dumps(data)))
+                _delete_index(c, obj_type, ident)
+                _store_index(c, obj_type, ident, data)
+                self._pending[(obj_type, ident)] = data
+
+
+def _delete_index(cursor, obj_type, ident):
+    if obj_type in OBJECT_INDEXES:
+        cursor.execute('DELETE FROM object_attrs WHERE type=? AND id=?',
+                       (obj_type, ident))
+
+
+def _store_index(cursor, obj_type, ident, data):
+    for attr in OBJECT_INDEXES.get(obj_type, []):
+        for value in set(_get_index_values(data, attr)):
+            cursor.execute('''INSERT INTO object_attrs (type, id, attr, value)
+                VALUES (?,?,?,?)''', (obj_type, ident, attr, value))
 
 
 class ObjectStore(object):
-    def __init__(self, location=None):
-        self._lock = threading.Semaphore()
-        self._connections = OrderedDict()
+    """
+    The sessions of the different threads run concurrently: the database is
+    in WAL mode, so the readers do not block each other nor the writer, and
+    only the writes are serialized, each one in a short critical section.
+
+    Each session uses a connection from a pool of at most pool_size
+    connections, by default enough for all the HTTP request threads and the
+    tasks (see get_pool_size()), waiting at most POOL_TIMEOUT seconds for one
+    to be released when they are all in use. The nested sessions of a thread
+    share the same session.
+
+    The objects of the types in CACHE_CAPACITY are also kept in an LRU cache
+    shared by the sessions, updated when the writes are committed.
+    """
+    POOL_TIMEOUT = 30
+
+    def __init__(self, location=None, cache_capacity=CACHE_CAPACITY,
+                 pool_size=None):
+        self.pool_size = pool_size or get_pool_size()
+        self._write_lock = threading.RLock()
+        self._pool_lock = threading.Lock()
+        self._idle = Queue.LifoQueue()
+        self._nconns = 0
+        self._local = threading.local()
+        self._cache = ObjectCache(cache_capacity)
         self.location = location or config.get_object_store()
-        with self._lock:
+        with self._write_lock:
             self._init_db()
 
     def _init_db(self):
-        conn = self._get_conn()
-        c = conn.cursor()
-        c.execute('''SELECT * FROM sqlite_master WHERE type='table' AND
-                     tbl_name='objects'; ''')
-        res = c.fetchall()
-        # Because the tasks are regarded as temporary resource, the task states
-        # are purged every time the daemon startup
-        if len(res) == 0:
-            c.execute('''CREATE TABLE objects
-                (id TEXT, type TEXT, json TEXT, PRIMARY KEY (id, type))''')
+        conn = self._acquire_conn()
+        try:
+            c = conn.cursor()
+            c.execute('''SELECT * FROM sqlite_master WHERE type='table' AND
+                         tbl_name='objects'; ''')
+            res = c.fetchall()
+            # Because the tasks are regarded as temporary resource, the task
+            # states are purged every time the daemon startup
+            if len(res) == 0:
+                c.execute('''CREATE TABLE objects
+                    (id TEXT, type TEXT, json TEXT, PRIMARY KEY (id, type))''')
+            else:
+                # Clear out expired objects from a previous session
+                c.execute('''DELETE FROM objects WHERE type = 'task'; ''')
+
+            # The index is rebuilt, as the indexed attributes may have changed
+            # since the previous session
+            c.execute('''CREATE TABLE IF NOT EXISTS object_attrs
+                (type TEXT, id TEXT, attr TEXT, value,
+                 PRIMARY KEY (type, id, attr, value))''')
+            c.execute('''CREATE INDEX IF NOT EXISTS object_attrs_value
+                ON object_attrs (type, attr, value)''')
+            c.execute('DELETE FROM object_attrs')
+            for obj_type in OBJECT_INDEXES:
+                res = c.execute('SELECT id, json FROM objects WHERE type=?',
+                                (obj_type,)).fetchall()
+                for ident, jsonstr in res:
+                    _store_index(c, obj_type, ident, json.loads(jsonstr))
             conn.commit()
-            return
+        finally:
+            self._release_conn(conn)
 
-        # Clear out expired objects from a previous session
-        c.execute('''DELETE FROM objects WHERE type = 'task'; ''')
-        conn.commit()
+    def get_cache_stats(self):
+        """
+        Return the capacity, size and number of hits and misses of the cache
+        of each object type.
+        """
+        return self._cache.get_stats()
 
-    def _get_conn(self):
-        ident = threading.currentThread().ident
+    def _connect(self):
+        conn = sqlite3.connect(self.location, timeout=10,
+                               check_same_thread=False)
+        conn.text_factory = lambda x: unicode(x, "utf-8", "ignore")
+        # the WAL journal mode is persistent, but setting it on every
+        # connection also converts the databases created in another mode
+        conn.execute('PRAGMA journal_mode=WAL')
+        # in WAL mode, a commit is still durable without waiting for the
+        # disk, but on a power loss
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _acquire_conn(self):
         try:
-            return self._connections[ident]
-        except KeyError:
-            self._connections[ident] = sqlite3.connect(self.location,
-                                                       timeout=10)
-            if len(self._connections.keys()) > 10:
-                id, conn = self._connections.popitem(last=False)
-                conn.interrupt()
-                del conn
-            return self._connections[ident]
+            return self._idle.get_nowait()
+        except Queue.Empty:
+            pass
+
+        with self._pool_lock:
+            if self._nconns < self.pool_size:
+                self._nconns += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except:
+                with self._pool_lock:
+                    self._nconns -= 1
+                raise
+
+        # wait for a session of another thread to release its connection
+        try:
+            return self._idle.get(timeout=self.POOL_TIMEOUT)
+        except Queue.Empty:
+            raise OperationFailed("KCHOBJST0002E",
+                                  {'seconds': self.POOL_TIMEOUT})
+
+    def _release_conn(self, conn):
+        self._idle.put(conn)
 
     def __enter__(self):
-        self._lock.acquire()
-        return ObjectStoreSession(self._get_conn())
+        local = self._local
+        if getattr(local, 'session', None) is None:
+            conn = self._acquire_conn()
+            local.session = ObjectStoreSession(conn, self._write_lock,
+                                               self._cache)
+            local.depth = 0
+        local.depth += 1
+        return local.session
 
     def __exit__(self, type, value, tb):
-        self._lock.release()
+        local = self._local
+        local.depth -= 1
+        if local.depth == 0:
+            conn = local.session.conn
+            local.session = None
+            try:
+                # end the read transaction, if any, so the connection does
+                # not prevent the WAL from being checkpointed
+                conn.rollback()
+            finally:
+                self._release_conn(conn)
+
         if type is not None and issubclass(type, sqlite3.DatabaseError):
                 # Logs the error and return False, which makes __exit__ raise
                 # exception again
@@ -26,7 +26,7 @@ import tempfile
 import time
 
 
-from kimchi.isoinfo import IsoImage, probe_iso
+from kimchi.isoinfo import probe_iso, probe_iso_cached
 from kimchi.utils import kimchi_log
 
 
@@ -36,8 +36,9 @@ SCAN_IGNORE = ['/tmp/kimchi-scan-*']
 class Scanner(object):
     SCAN_TTL = 300
 
-    def __init__(self, record_clean_cb):
+    def __init__(self, record_clean_cb, objstore=None):
         self.clean_cb = record_clean_cb
+        self.objstore = objstore
 
     def delete(self):
         self.clean_stale(-1)
@@ -71,9 +72,8 @@ class Scanner(object):
 
             duplicates = "%s/%s*" % (params['pool_path'], iso_name)
             for f in glob.glob(duplicates):
-                iso_img = IsoImage(f)
                 if (iso_info['distro'], iso_info['version']) == \
-                   iso_img.probe():
+                   probe_iso_cached(self.objstore, f):
                     return
 
             iso_path = iso_name + hashlib.md5(iso_info['path']).hexdigest() + \
@@ -84,6 +84,7 @@ class Scanner(object):
 
         ignore_paths = params.get('ignore_list', [])
         scan_params = dict(path=params['scan_path'], updater=updater,
-                           ignore_list=ignore_paths + SCAN_IGNORE)
+                           ignore_list=ignore_paths + SCAN_IGNORE,
+                           objstore=self.objstore)
         probe_iso(None, scan_params)
         cb('', True)
@@ -18,12 +18,13 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
 
-import glob
 import os
-import signal
+import Queue
 import tempfile
+import threading
 import time
 import uuid
+from StringIO import StringIO
 
 
 try:
@@ -36,8 +37,9 @@ from kimchi import config
 from kimchi.utils import kimchi_log
 
 
-(fd, pipe) = tempfile.mkstemp()
 stream_test_result = None
+stream_test_failures = 0
+stream_test_lock = threading.Lock()
 
 
 class VMScreenshot(object):
@@ -45,6 +47,11 @@ class VMScreenshot(object):
     THUMBNAIL_SIZE = (256, 256)
     LIVE_WINDOW = 60
     MAX_STREAM_ATTEMPTS = 10
+    STREAM_TEST_TIMEOUT = 3
+
+    # thumbnail files of each VM uuid, with their creation time
+    _thumbnails = None
+    _thumbnails_lock = threading.Lock()
 
     def __init__(self, args):
         self.vm_uuid = args['uuid']
@@ -59,49 +66,122 @@ class VMScreenshot(object):
         return stream_test_result
 
     def lookup(self):
-        now = time.time()
+        if self.outdated():
+            self.refresh()
+        return self.get_url()
+
+    def get_url(self):
+        return '/data/screenshots/%s' %\
+               os.path.basename(self.info['thumbnail'])
+
+    def outdated(self):
         try:
             last_update = os.path.getmtime(self.info['thumbnail'])
         except OSError:
             last_update = 0
+        return time.time() - last_update > self.OUTDATED_SECS
 
-        if now - last_update > self.OUTDATED_SECS:
-            self._clean_extra(self.LIVE_WINDOW)
-            self._generate_thumbnail()
-        return '/data/screenshots/%s' %\
-               os.path.basename(self.info['thumbnail'])
+    def refresh(self):
+        """
+        Generate a new thumbnail. Return False if no screenshot could be taken
+        and a black image was saved instead.
+        """
+        taken = self._generate_thumbnail()
+        self._clean_extra(self.LIVE_WINDOW)
+        return taken
 
-    def _clean_extra(self, window=-1):
+    def create_placeholder(self):
         """
-        Clear screenshots before time specified by window,
-        Clear all screenshots if window is -1.
+        Create a black thumbnail if there is none yet, so it can be returned
+        until the first screenshot is taken. Return True if it was created.
+        """
+        if os.path.exists(self.info['thumbnail']):
+            return False
+        self._save_thumbnail(self._create_black_image(),
+                             self.info['thumbnail'])
+        return True
+
+    @classmethod
+    def _get_thumbnails(cls):
+        """
+        Return the thumbnails index. It is built from the screenshots
+        directory the first time, to find the thumbnails of a previous run.
+        Must be called with _thumbnails_lock held.
         """
+        if cls._thumbnails is not None:
+            return cls._thumbnails
+
+        cls._thumbnails = {}
+        path = config.get_screenshot_path()
         try:
-            now = time.time()
-            clear_list = glob.glob("%s/%s-*.png" %
-                                   (config.get_screenshot_path(),
-                                    self.vm_uuid))
-            for f in clear_list:
-                if now - os.path.getmtime(f) > window:
-                    os.unlink(f)
+            names = os.listdir(path)
         except OSError:
-            pass
+            names = []
+
+        # the thumbnails are named "<vm uuid>-<uuid>.png"
+        for name in names:
+            if not name.endswith('.png') or name[36:37] != '-':
+                continue
+            thumbnail = os.path.join(path, name)
+            try:
+                created = os.path.getmtime(thumbnail)
+            except OSError:
+                continue
+            cls._thumbnails.setdefault(name[:36], {})[thumbnail] = created
+        return cls._thumbnails
+
+    def _clean_extra(self, window=-1):
+        """
+        Clear screenshots before time specified by window, but the current one,
+        Clear all screenshots if window is -1.
+        """
+        now = time.time()
+        with self._thumbnails_lock:
+            thumbnails = self._get_thumbnails()
+            vm_thumbnails = thumbnails.get(self.vm_uuid, {})
+            for thumbnail, created in vm_thumbnails.items():
+                if window != -1 and thumbnail == self.info['thumbnail']:
+                    continue
+                if now - created > window:
+                    del vm_thumbnails[thumbnail]
+                    try:
+                        os.unlink(thumbnail)
+                    except OSError:
+                        pass
+            if not vm_thumbnails:
+                thumbnails.pop(self.vm_uuid, None)
 
     def delete(self):
         return self._clean_extra()
 
-    def _generate_scratch(self, thumbnail):
+    def _get_scratch(self):
         """
-        Generate screenshot of given vm.
+        Return the screenshot image data of given vm.
         Override me in child class.
         """
-        pass
+        return None
+
+    def _create_black_image(self):
+        return Image.new("RGB", self.THUMBNAIL_SIZE, 'black')
 
-    def _create_black_image(self, thumbnail):
-        image = Image.new("RGB", self.THUMBNAIL_SIZE, 'black')
-        image.save(thumbnail)
+    def _save_thumbnail(self, image, thumbnail):
+        # write the thumbnail to a temporary file which is then renamed, so
+        # a partially written thumbnail is never served
+        path = config.get_screenshot_path()
+        fd, tmp = tempfile.mkstemp(dir=path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, "PNG")
+            os.rename(tmp, thumbnail)
+        except:
+            os.unlink(tmp)
+            raise
 
-    def _watch_stream_creation(self, thumbnail):
+        with self._thumbnails_lock:
+            thumbnails = self._get_thumbnails()
+            thumbnails.setdefault(self.vm_uuid, {})[thumbnail] = time.time()
+
+    def _test_stream(self):
         """
         This is a verification test for libvirt stream functionality.
 
@@ -110,75 +190,169 @@ class VMScreenshot(object):
 
         This problem was found in libvirt 0.9.6 for SLES11 SP2.
 
-        This test consists in running the screeshot creation with a timeout.
-        If timeout occurs, the libvirt is taking too much time to create the
-        screenshot image and the stream must be disabled it if happens
-        successively (to avoid blocking server requests).
+        This test consists in running the screeshot creation in a thread with
+        a timeout. If timeout occurs, the libvirt is taking too much time to
+        create the screenshot image and the stream is disabled (to avoid
+        blocking server requests). The stream is also disabled if the
+        screenshot creation fails successively without ever succeeding.
+
+        Return the screenshot image data, if any.
         """
-        pid = os.fork()
-        if pid == 0:
+        global stream_test_result, stream_test_failures
+
+        result = {}
+
+        def get_scratch():
             try:
-                self._generate_scratch(thumbnail)
-                os._exit(0)
-            except:
-                os._exit(1)
-        else:
-            counter = 0
-            ret = os.waitpid(pid, os.WNOHANG)
-            while ret == (0, 0) and counter < 3:
-                counter += 1
-                time.sleep(1)
-                ret = os.waitpid(pid, os.WNOHANG)
-
-            fd = open(pipe, "a")
-            if ret != (pid, 0):
-                fd.write("-")
-                if ret[0] != pid:
-                    os.kill(int(pid), signal.SIGKILL)
-                    os.waitpid(pid, 0)
-            else:
-                fd.write("+")
-            fd.close()
+                result['data'] = self._get_scratch()
+            except Exception as e:
+                result['error'] = e
 
-    def _get_test_result(self):
-        if not os.path.exists(pipe):
-            return
+        # only one test runs at a time, the other requests wait for its result
+        with stream_test_lock:
+            if stream_test_result is not None:
+                return None
 
-        fd = open(pipe, "r")
-        data = fd.read()
-        fd.close()
+            thread = threading.Thread(target=get_scratch)
+            thread.setDaemon(True)
+            thread.start()
+            thread.join(self.STREAM_TEST_TIMEOUT)
 
-        if len(data) >= self.MAX_STREAM_ATTEMPTS or bool('+' in data):
-            global stream_test_result
-            stream_test_result = bool('+' in data)
-            os.remove(pipe)
+            if thread.isAlive():
+                kimchi_log.error("screenshot_creation: Timeout creating "
+                                 "screenshot image, disabling libvirt "
+                                 "stream.")
+                stream_test_result = False
+            elif 'error' in result:
+                stream_test_failures += 1
+                if stream_test_failures >= self.MAX_STREAM_ATTEMPTS:
+                    stream_test_result = False
+            else:
+                stream_test_result = True
+            return result.get('data')
 
     def _generate_thumbnail(self):
         thumbnail = os.path.join(config.get_screenshot_path(), '%s-%s.png' %
                                  (self.vm_uuid, str(uuid.uuid4())))
 
-        self._get_test_result()
+        data = None
         if stream_test_result is None:
-            self._watch_stream_creation(thumbnail)
-        elif stream_test_result:
+            data = self._test_stream()
+        if data is None and stream_test_result:
             try:
-                self._generate_scratch(thumbnail)
+                data = self._get_scratch()
             except:
                 kimchi_log.error("screenshot_creation: Unable to create "
                                  "screenshot image %s." % thumbnail)
-        else:
-            self._create_black_image(thumbnail)
 
-        if os.path.getsize(thumbnail) == 0:
-            self._create_black_image(thumbnail)
+        image = None
+        if data:
+            try:
+                image = Image.open(StringIO(data))
+                # decode the image at a reduced size when the format allows
+                image.draft('RGB', self.THUMBNAIL_SIZE)
+            except Exception as e:
+                kimchi_log.error("Unable to decode screenshot image: %s." % e)
+                image = None
+
+        taken = image is not None
+        if image is None:
+            image = self._create_black_image()
         else:
-            im = Image.open(thumbnail)
             try:
                 # Prevent Image lib from lazy load,
                 # work around pic truncate validation in thumbnail generation
-                im.thumbnail(self.THUMBNAIL_SIZE)
+                image.thumbnail(self.THUMBNAIL_SIZE)
             except Exception as e:
                 kimchi_log.warning("Image load with warning: %s." % e)
-            im.save(thumbnail, "PNG")
 
+        self._save_thumbnail(image, thumbnail)
         self.info['thumbnail'] = thumbnail
+        return taken
+
+
+class ScreenshotRefresher(object):
+    """
+    Refresh the VMs thumbnails in a bounded pool of background threads, so
+    the requests do not wait for the screenshots to be taken.
+
+    There is at most one refresh queued or running for each VM. After a
+    failed refresh, including one which only saved a black image, the VM is
+    not refreshed again for a backoff delay which
+    doubles on each successive failure, up to MAX_FAILURE_BACKOFF seconds.
+    """
+    WORKERS = 4
+    FAILURE_BACKOFF = 5
+    MAX_FAILURE_BACKOFF = 300
+
+    def __init__(self, workers=WORKERS):
+        self._workers = workers
+        self._threads = []
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        # number of successive failures and time of the last one of each VM
+        self._failures = {}
+
+    def refresh(self, screenshot, callback=None):
+        """
+        Queue a refresh of "screenshot" unless one is already pending for the
+        same VM and return an Event which is set when it is done.
+        "callback" is called with the refreshed screenshot.
+        If the VM is in its failure backoff delay, nothing is queued and the
+        returned Event is already set.
+        """
+        with self._lock:
+            event = self._pending.get(screenshot.vm_uuid)
+            if event is None and self._backing_off(screenshot.vm_uuid):
+                event = threading.Event()
+                event.set()
+            elif event is None:
+                event = threading.Event()
+                self._pending[screenshot.vm_uuid] = event
+                self._queue.put((screenshot, callback, event))
+                self._start_workers()
+        return event
+
+    def _backing_off(self, vm_uuid):
+        # must be called with _lock held
+        failures, last_failure = self._failures.get(vm_uuid, (0, 0))
+        if failures == 0:
+            return False
+        delay = min(self.FAILURE_BACKOFF * 2 ** (failures - 1),
+                    self.MAX_FAILURE_BACKOFF)
+        return time.time() - last_failure < delay
+
+    def _start_workers(self):
+        # the threads are only started when the first refresh is queued
+        while len(self._threads) < self._workers:
+            thread = threading.Thread(target=self._run)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            screenshot, callback, event = self._queue.get()
+            failed = False
+            try:
+                # the black image is still stored
+                failed = not screenshot.refresh()
+                if callback is not None:
+                    callback(screenshot)
+            except Exception as e:
+                failed = True
+                kimchi_log.error("screenshot_refresh: Unable to refresh "
+                                 "screenshot of %s: %s" %
+                                 (screenshot.vm_uuid, e))
+            finally:
+                with self._lock:
+                    del self._pending[screenshot.vm_uuid]
+                    if failed:
+                        failures = self._failures.get(screenshot.vm_uuid,
+                                                      (0, 0))[0]
+                        self._failures[screenshot.vm_uuid] = (failures + 1,
+                                                              time.time())
+                    else:
+                        self._failures.pop(screenshot.vm_uuid, None)
+                event.set()
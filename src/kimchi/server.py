@@ -87,6 +87,10 @@ class Server(object):
         # directly. You must go through the proxy.
         cherrypy.server.socket_host = '127.0.0.1'
         cherrypy.server.socket_port = options.cherrypy_port
+        # the long-polling requests (see the '_wait' parameter) hold a thread
+        # while they wait for a change
+        thread_pool = config.config.getint('server', 'thread_pool')
+        cherrypy.server.thread_pool = thread_pool
 
         max_body_size_in_bytes = eval(options.max_body_size) * 1024
         cherrypy.server.max_request_body_size = max_body_size_in_bytes
@@ -0,0 +1,121 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2015
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+
+import array
+
+
+class RingBuffer(object):
+    """
+    Fixed-size buffer keeping the latest numbers appended to it in an array,
+    so each value only takes the size of its C type (4 bytes for 'f').
+    """
+    def __init__(self, size, typecode='f'):
+        self._data = array.array(typecode, [0]) * size
+        self._size = size
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        end = (self._start + self._count) % self._size
+        self._data[end] = value
+        if self._count < self._size:
+            self._count += 1
+        else:
+            self._start = (self._start + 1) % self._size
+
+    def get(self):
+        """
+        Return the values in the order they were appended.
+        """
+        end = self._start + self._count
+        if end <= self._size:
+            return self._data[self._start:end].tolist()
+        return (self._data[self._start:].tolist() +
+                self._data[:end - self._size].tolist())
+
+
+class _Tier(object):
+    def __init__(self, nmetrics, size, interval):
+        self.interval = interval
+        self.timestamps = RingBuffer(size, 'd')
+        self.values = [RingBuffer(size) for i in xrange(nmetrics)]
+        # sums of the samples not yet averaged into the next tier
+        self.sums = array.array('d', [0]) * nmetrics
+        self.count = 0
+
+    def append(self, timestamp, values):
+        self.timestamps.append(timestamp)
+        for buf, value in zip(self.values, values):
+            buf.append(value)
+
+
+class StatsHistory(object):
+    """
+    History of the samples of a set of metrics, taken every "interval"
+    seconds.
+
+    The latest "size" samples are kept and, if "tiers" is not 0, as many
+    downsampled tiers: each one keeps the latest "size" averages of "factor"
+    samples of the previous tier.
+    """
+    def __init__(self, metrics, interval, size, tiers=0, factor=1):
+        self.metrics = metrics
+        self._factor = factor
+        self._tiers = [_Tier(len(metrics), size, interval * factor ** i)
+                       for i in xrange(tiers + 1)]
+
+    def append(self, timestamp, sample):
+        """
+        Append the values of the metrics in the dict "sample", taken at
+        "timestamp".
+        """
+        values = [sample[metric] for metric in self.metrics]
+        for tier, next_tier in zip(self._tiers, self._tiers[1:]):
+            tier.append(timestamp, values)
+            tier.count += 1
+            for i, value in enumerate(values):
+                tier.sums[i] += value
+            if tier.count < self._factor:
+                return
+
+            values = [value / self._factor for value in tier.sums]
+            tier.sums = array.array('d', [0]) * len(self.metrics)
+            tier.count = 0
+        self._tiers[-1].append(timestamp, values)
+
+    def get(self):
+        """
+        Return the history of the metrics: a dict with the list of the values
+        of each metric, their timestamps and interval, and the same for each
+        downsampled tier in 'tiers'.
+        """
+        history = [self._get_tier(tier) for tier in self._tiers]
+        history[0]['tiers'] = history[1:]
+        return history[0]
+
+    def _get_tier(self, tier):
+        res = {'interval': tier.interval,
+               'timestamp': tier.timestamps.get()}
+        for metric, buf in zip(self.metrics, tier.values):
+            res[metric] = buf.get()
+        return res
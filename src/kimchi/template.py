@@ -19,9 +19,11 @@
 
 import cherrypy
 import errno
+import hashlib
 import json
 
 
+from cherrypy.lib import cptools
 from kimchi.config import paths
 from Cheetah.Template import Template
 from glob import iglob
@@ -100,11 +102,36 @@ def render_cheetah_file(resource, data):
             raise
 
 
+def set_etag(tag):
+    """
+    Tag the response of a GET request with "tag" and answer "304 Not
+    Modified" when the client already holds it (If-None-Match).
+    """
+    if cherrypy.request.method != 'GET':
+        return
+
+    cherrypy.response.headers['ETag'] = '"%s"' % tag
+    cptools.validate_etags()
+
+
+def validate_etag(body):
+    """
+    Tag the response of a GET request with a hash of its body, unless it was
+    already tagged before being computed (see control.base.validate_change).
+    As the whole response is computed anyway, it only saves the bandwidth.
+    """
+    if hasattr(cherrypy.serving.response, 'ETag'):
+        return
+    set_etag(hashlib.md5(body).hexdigest())
+
+
 def render(resource, data):
     if can_accept('application/json'):
         cherrypy.response.headers['Content-Type'] = \
             'application/json;charset=utf-8'
-        return json.dumps(data, indent=2, separators=(',', ':'))
+        body = json.dumps(data, indent=2, separators=(',', ':'))
+        validate_etag(body)
+        return body
     elif can_accept_html():
         return render_cheetah_file(resource, data)
     else:
@@ -66,12 +66,52 @@ def get_next_task_id():
     return task_id
 
 
-def add_task(target_uri, fn, objstore, opaque=None):
+def add_task(target_uri, fn, objstore, opaque=None, category=None):
     id = get_next_task_id()
-    AsyncTask(id, target_uri, fn, objstore, opaque)
+    AsyncTask(id, target_uri, fn, objstore, opaque, category)
     return id
 
 
+def compile_filter(val):
+    """Return a function telling whether a property value matches the filter
+    value "val" of a GET request on a collection: the value is either equal
+    to or contained in "val", or it matches "val" as a regular expression.
+    When "val" is not a valid regular expression, only the first two are
+    checked.
+    """
+    try:
+        regex = re.compile(str(val))
+    except re.error:
+        regex = None
+
+    def match(value):
+        if value == val or value in val:
+            return True
+        return regex is not None and regex.match(value) is not None
+
+    return match
+
+
+def compile_filter_flags(val, flags, values):
+    """Return the flags to list, with a libvirt listAll*() call, only the
+    objects whose property matches the filter value "val" as compile_filter()
+    does.  "values" lists all the values the property may take and "flags"
+    maps them to their listing flag.  Return 0, to list all the objects, when
+    "val" is not a single value or when a matching value has no flag.
+    """
+    if not isinstance(val, basestring):
+        return 0
+
+    match = compile_filter(val)
+    result = 0
+    for value in values:
+        if match(value):
+            if value not in flags:
+                return 0
+            result |= flags[value]
+    return result
+
+
 def is_digit(value):
     if isinstance(value, int):
         return True
@@ -30,7 +30,7 @@ from kimchi import imageinfo
 from kimchi import osinfo
 from kimchi.exception import InvalidParameter, IsoFormatError, MissingParameter
 from kimchi.exception import ImageFormatError, OperationFailed
-from kimchi.isoinfo import IsoImage
+from kimchi.isoinfo import probe_iso_cached
 from kimchi.utils import check_url_path, pool_name_from_uri
 from kimchi.xmlutils.disk import get_disk_xml
 from kimchi.xmlutils.graphics import get_graphics_xml
@@ -39,16 +39,18 @@ from kimchi.xmlutils.qemucmdline import get_qemucmdline_xml
 
 
 class VMTemplate(object):
-    def __init__(self, args, scan=False):
+    def __init__(self, args, scan=False, objstore=None):
         """
         Construct a VM Template from a widely variable amount of information.
         The only required parameter is a name for the VMTemplate.  If present,
         the os_distro and os_version fields are used to lookup recommended
         settings.  Any parameters provided by the caller will override the
         defaults.  If scan is True and a cdrom or a base img is present, the
-        operating system will be detected by probing the installation media.
+        operating system will be detected by probing the installation media,
+        reusing the ISO probe results stored in objstore if given.
         """
         self.info = {}
+        self.objstore = objstore
         self.fc_host_support = args.get('fc_host_support')
 
         # Fetch defaults based on the os distro and version
@@ -117,8 +119,7 @@ class VMTemplate(object):
         if len(filter(iso.startswith, iso_prefixes)) == 0:
             raise InvalidParameter("KCHTMPL0006E", {'param': iso})
         try:
-            iso_img = IsoImage(iso)
-            return iso_img.probe()
+            return probe_iso_cached(self.objstore, iso)
         except IsoFormatError:
             raise InvalidParameter("KCHISO0001E", {'filename': iso})
 
@@ -382,18 +383,24 @@ class VMTemplate(object):
     def _get_all_storagepools_name(self):
         return []
 
-    def validate_integrity(self):
+    def validate_integrity(self, networks=None, storagepools=None):
+        # the names of all networks and storage pools may be given by the
+        # caller when validating several templates at once
+        if networks is None:
+            networks = self._get_all_networks_name()
+        if storagepools is None:
+            storagepools = self._get_all_storagepools_name()
+
         invalid = {}
         # validate networks integrity
-        invalid_networks = list(set(self.info['networks']) -
-                                set(self._get_all_networks_name()))
+        invalid_networks = list(set(self.info['networks']) - set(networks))
         if invalid_networks:
             invalid['networks'] = invalid_networks
 
         # validate storagepools integrity
         pool_uri = self.info['storagepool']
         pool_name = pool_name_from_uri(pool_uri)
-        if pool_name not in self._get_all_storagepools_name():
+        if pool_name not in storagepools:
             invalid['storagepools'] = [pool_name]
 
         # validate iso integrity
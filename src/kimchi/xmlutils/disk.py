@@ -124,26 +124,29 @@ def get_device_node(dom, dev_name):
     return disk[0]
 
 
+def get_disk_path(disk):
+    """Return the path of the source of an objectified <disk> element, or
+    "" if it has none."""
+    try:
+        source = disk.source
+        src_type = disk.attrib['type']
+        if src_type == 'network':
+            host = source.host
+            return (source.attrib['protocol'] + '://' +
+                    host.attrib['name'] + ':' +
+                    host.attrib['port'] + source.attrib['name'])
+        return source.attrib[DEV_TYPE_SRC_ATTR_MAP[src_type]]
+    except:
+        return ""
+
+
 def get_vm_disk_info(dom, dev_name):
     # Retrieve disk xml and format return dict
     disk = get_device_node(dom, dev_name)
     if disk is None:
         return None
 
-    try:
-        source = disk.source
-        if source is not None:
-            src_type = disk.attrib['type']
-            if src_type == 'network':
-                host = source.host
-                path = (source.attrib['protocol'] + '://' +
-                        host.attrib['name'] + ':' +
-                        host.attrib['port'] + source.attrib['name'])
-            else:
-                path = source.attrib[DEV_TYPE_SRC_ATTR_MAP[src_type]]
-    except:
-        path = ""
-
+    path = get_disk_path(disk)
     return {'dev': dev_name,
             'path': path,
             'type': disk.attrib['device'],
@@ -22,7 +22,9 @@ from lxml import objectify
 
 
 def xpath_get_text(xml, expr):
-    doc = ET.fromstring(xml)
+    # callers that run several queries against the same descriptor may pass
+    # an already parsed element instead of the XML string
+    doc = xml if ET.iselement(xml) else ET.fromstring(xml)
 
     res = []
     for x in doc.xpath(expr):
@@ -45,7 +47,7 @@ def xml_item_update(xml, xpath, value, attr=None):
 
 
 def dictize(xmlstr):
-    root = objectify.fromstring(xmlstr)
+    root = xmlstr if ET.iselement(xmlstr) else objectify.fromstring(xmlstr)
     return {root.tag: _dictize(root)}
 
 
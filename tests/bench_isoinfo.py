@@ -0,0 +1,75 @@
+#!/usr/bin/python
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2015
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+# Compare the time taken to identify ISO volume ids by the precompiled
+# iso_matcher and by the search of every raw regex of iso_dir.  It is not run
+# with the unit tests:
+#   PYTHONPATH=../src python bench_isoinfo.py [<number of volume ids>]
+
+import re
+import sys
+import time
+import uuid
+
+from kimchi.isoinfo import iso_dir, iso_matcher
+
+
+def baseline_match(volume_id):
+    for distro, version, regex in iso_dir:
+        m = re.search(regex, volume_id)
+        if m:
+            if hasattr(version, '__call__'):
+                version = version(m)
+            return (distro, version)
+    return None
+
+
+def volume_ids(count):
+    ids = []
+    for i in xrange(count / 4):
+        ids.extend(['Ubuntu-Server %d.04 LTS amd64' % i,
+                    'Fedora-Live-Workstation-x86_64-%d-1' % i,
+                    'KIMCHI_%d_NOT_AN_OS %s' % (i, uuid.uuid4()),
+                    'GSP1RMCPRXFRER_%d_DVD' % i])
+    return ids
+
+
+def timed(match, ids):
+    start = time.time()
+    result = [match(volume_id) for volume_id in ids]
+    return time.time() - start, result
+
+
+def main(args):
+    ids = volume_ids(int(args[0]) if args else 4000)
+    baseline_time, expected = timed(baseline_match, ids)
+    matcher_time, found = timed(iso_matcher.match, ids)
+    if found != expected:
+        print "iso_matcher and the baseline loop disagree"
+        return 1
+
+    print "%d volume ids" % len(ids)
+    print "baseline loop: %.3fs" % baseline_time
+    print "iso_matcher:   %.3fs" % matcher_time
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -139,3 +139,30 @@ class MockStoragepoolTests(unittest.TestCase):
 
         for pool in poolDefs:
             _do_test(pool)
+
+    def test_storagepools_type_filter(self):
+        fc_devs = json.loads(self.request('/host/devices?_cap=fc_host').read())
+        poolDefs = [
+            {'type': 'scsi', 'name': u'kīмсhīUnitTestSCSIFCPool',
+             'source': {'adapter_name': fc_devs[0]['name']}},
+            {'type': 'iscsi', 'name': u'kīмсhīUnitTestISCSIPool',
+             'source': {'host': '127.0.0.1',
+                        'target': 'iqn.2015-01.localhost.kimchiUnitTest'}}]
+        for params in poolDefs:
+            resp = self.request('/storagepools', json.dumps(params), 'POST')
+            self.assertEquals(201, resp.status)
+
+        # the pool type also matches when it is part of the filter value
+        resp = self.request('/storagepools?_fields=name,type&type=iscsi')
+        pools = json.loads(resp.read())
+        self.assertEquals(['iscsi', 'scsi'],
+                          sorted(pool['type'] for pool in pools))
+
+        resp = self.request('/storagepools?_fields=name,type&type=scsi')
+        pools = json.loads(resp.read())
+        self.assertEquals(['scsi'], [pool['type'] for pool in pools])
+
+        resp = self.request('/storagepools?_fields=type&type=dir&type=scsi')
+        pools = json.loads(resp.read())
+        self.assertEquals(set(['dir', 'scsi']),
+                          set(pool['type'] for pool in pools))
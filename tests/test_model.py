@@ -19,6 +19,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 import grp
+import libvirt
 import os
 import platform
 import psutil
@@ -35,15 +36,26 @@ import uuid
 
 import iso_gen
 import kimchi.objectstore
+import kimchi.screenshot
 import utils
 from kimchi import netinfo
+from kimchi.asynctask import scheduler, TaskScheduler
 from kimchi.config import config
-from kimchi.exception import InvalidOperation
+from kimchi.exception import InvalidOperation, IsoFormatError
 from kimchi.exception import InvalidParameter, NotFoundError, OperationFailed
+from kimchi.exception import TimeoutExpired
+from kimchi.isoinfo import iso_dir, iso_matcher, Matcher, probe_iso_cached
 from kimchi.model.featuretests import FeatureTests
 from kimchi.model import model
+from kimchi.model.inventory import DomainInventory
 from kimchi.model.libvirtconnection import LibvirtConnection
+from kimchi.model.storagepools import PoolRefresher
+from kimchi.model.storagevolumes import StorageVolumeModel
+from kimchi.model.tasks import tasks_sweepers, TasksModel
+from kimchi.model.vms import guests_stats_threads, VMsModel
+from kimchi.notifier import notifier
 from kimchi.rollbackcontext import RollbackContext
+from kimchi.screenshot import ScreenshotRefresher, VMScreenshot
 from kimchi.utils import add_task
 
 
@@ -96,6 +108,188 @@ class ModelTests(unittest.TestCase):
         self.assertEquals([], info['groups'])
         self.assertTrue(info['persistent'])
 
+        # a single thread collects the statistics of the guests
+        vms = VMsModel(conn=inst.conn, objstore=inst.objstore)
+        self.assertEquals(guests_stats_threads['test:///default'],
+                          vms.guests_stats_thread)
+
+    def test_vm_access_running(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        self.assertEquals('running', inst.vm_lookup('test')['state'])
+
+        # the feature tests do not run without the server, so the access
+        # metadata is only written to the persistent configuration
+        inst.vm_update('test', {'users': ['root'], 'groups': ['root']})
+        info = inst.vm_lookup('test')
+        self.assertEquals((['root'], ['root']),
+                          (info['users'], info['groups']))
+        info = dict(inst.vms_get_list_detailed())['test']
+        self.assertEquals((['root'], ['root']),
+                          (info['users'], info['groups']))
+
+    def test_guests_samples(self):
+        class FakeDomain(object):
+            def name(self):
+                return 'vm1'
+
+            def UUIDString(self):
+                return 'vm1-uuid'
+
+            def info(self):
+                return [1, 1048576, 1048576, 2, 3000]
+
+            def XMLDesc(self, flags):
+                return ("<domain><name>vm1</name><devices>"
+                        "<interface type='network'><target dev='vnet0'/>"
+                        "</interface>"
+                        "<disk type='file' device='disk'><target dev='vda'/>"
+                        "</disk></devices></domain>")
+
+            def interfaceStats(self, dev):
+                return [10, 0, 0, 0, 20, 0, 0, 0]
+
+            def blockStats(self, dev):
+                return [0, 30, 0, 40, 0]
+
+        class FakeVirConn(object):
+            def lookupByName(self, name):
+                return FakeDomain()
+
+        class FakeBulkVirConn(FakeVirConn):
+            def getAllDomainStats(self, flags):
+                return [(FakeDomain(), {'state.state': 1, 'cpu.time': 3000,
+                                        'vcpu.current': 2, 'net.count': 2,
+                                        'net.0.rx.bytes': 10,
+                                        'net.0.tx.bytes': 20,
+                                        'net.1.rx.bytes': 1,
+                                        'net.1.tx.bytes': 2,
+                                        'block.count': 1,
+                                        'block.0.rd.bytes': 30,
+                                        'block.0.wr.bytes': 40})]
+
+        class FakeConn(object):
+            uri = 'fake:///samples'
+
+            def __init__(self, vir_conn):
+                self.vir_conn = vir_conn
+
+            def get(self):
+                return self.vir_conn
+
+        # the model is not initialized to not start the statistics thread
+        vms = VMsModel.__new__(VMsModel)
+        vms.get_list = lambda: ['vm1']
+
+        # all the counters from a single getAllDomainStats() call
+        vms.conn = FakeConn(FakeBulkVirConn())
+        sample = {'state': 1, 'cputime': 3000, 'cpus': 2, 'net_rx': 11,
+                  'net_tx': 22, 'disk_rd': 30, 'disk_wr': 40}
+        self.assertEquals({'vm1-uuid': sample}, vms._get_guests_samples())
+
+        # guest by guest when libvirt does not have the bulk stats API
+        vms.conn = FakeConn(FakeVirConn())
+        sample = {'state': 1, 'cputime': 3000, 'cpus': 2, 'net_rx': 10,
+                  'net_tx': 20, 'disk_rd': 30, 'disk_wr': 40}
+        self.assertEquals({'vm1-uuid': sample}, vms._get_guests_samples())
+
+    def test_get_list_detailed(self):
+        inst = model.Model('test:///default', self.tmp_store)
+
+        with RollbackContext() as rollback:
+            params = {'name': 'test', 'disks': [], 'cdrom': self.kimchi_iso}
+            inst.templates_create(params)
+            rollback.prependDefer(inst.template_delete, 'test')
+
+            collections = [('vms', 'vm', []),
+                           ('storagepools', 'storagepool', []),
+                           ('storagevolumes', 'storagevolume',
+                            ['default-pool']),
+                           ('networks', 'network', []),
+                           ('templates', 'template', [])]
+            for collection, resource, args in collections:
+                get_list = getattr(inst, '%s_get_list' % collection)
+                get_list_detailed = getattr(inst, '%s_get_list_detailed' %
+                                            collection)
+                lookup = getattr(inst, '%s_lookup' % resource)
+
+                detailed = list(get_list_detailed(*args))
+                self.assertEquals(get_list(*args),
+                                  [ident for ident, info in detailed])
+                for ident, info in detailed:
+                    expected = lookup(*(args + [ident]))
+                    # the guest statistics are updated in background
+                    expected.pop('stats', None)
+                    info.pop('stats', None)
+                    self.assertEquals(expected, info)
+
+    def test_vms_get_list_detailed_deleted_vm(self):
+        inst = model.Model('test:///default', self.tmp_store)
+
+        with RollbackContext() as rollback:
+            params = {'name': 'test-tmpl', 'disks': [],
+                      'cdrom': self.kimchi_iso}
+            inst.templates_create(params)
+            rollback.prependDefer(inst.template_delete, 'test-tmpl')
+
+            def delete_vm(name):
+                if name in inst.vms_get_list():
+                    inst.vm_delete(name)
+
+            params = {'name': u'test-deleted',
+                      'template': '/templates/test-tmpl'}
+            inst.vms_create(params)
+            rollback.prependDefer(delete_vm, u'test-deleted')
+
+            # the VM is deleted while the listing is consumed
+            detailed = inst.vms_get_list_detailed()
+            self.assertEquals(u'test', detailed.next()[0])
+            inst.conn.get().lookupByName('test-deleted').undefine()
+            DomainInventory.domain_removed(inst.conn, u'test-deleted')
+            self.assertEquals([], list(detailed))
+
+    def test_storagevolumes_get_list_detailed(self):
+        inst = model.Model('test:///default', self.tmp_store)
+        pool = inst.conn.get().storagePoolLookupByName('default-pool')
+        xml = """
+        <volume>
+          <name>test-vol.img</name>
+          <capacity>1048576</capacity>
+          <allocation>4096</allocation>
+          <target><format type='qcow2'/></target>
+        </volume>
+        """
+        vol = pool.createXML(xml, 0)
+        try:
+            detailed = dict(inst.storagevolumes_get_list_detailed(
+                'default-pool'))
+            info = detailed['test-vol.img']
+            self.assertEquals(1048576, info['capacity'])
+            self.assertEquals(4096, info['allocation'])
+            self.assertEquals(0, info['ref_cnt'])
+
+            for name, info in detailed.iteritems():
+                expected = inst.storagevolume_lookup('default-pool', name)
+                for key in ('type', 'capacity', 'allocation', 'format',
+                            'ref_cnt'):
+                    self.assertEquals(expected[key], info[key])
+        finally:
+            vol.delete(0)
+
+        # the volume type comes from info() when the XML does not tell it
+        class FakeVolume(object):
+            def XMLDesc(self, flags):
+                return ("<volume><name>vol</name><capacity>2048</capacity>"
+                        "<allocation>1024</allocation><target>"
+                        "<path>/tmp/vol</path></target></volume>")
+
+            def info(self):
+                return [1, 2048, 1024]
+
+        self.assertEquals({'type': 'block', 'capacity': 2048,
+                           'allocation': 1024, 'path': '/tmp/vol',
+                           'format': 'raw'},
+                          StorageVolumeModel._parse_volume(FakeVolume()))
+
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_vm_lifecycle(self):
         inst = model.Model(objstore_loc=self.tmp_store)
@@ -185,6 +379,12 @@ class ModelTests(unittest.TestCase):
             result = inst.vmsnapshot_revert(u'kimchi-vm-new', params['name'])
             self.assertEquals(result, [u'kimchi-vm', snap['name']])
 
+            # the VM is listed under the name of the snapshot only
+            vms = inst.vms_get_list()
+            self.assertIn(u'kimchi-vm', vms)
+            self.assertNotIn(u'kimchi-vm-new', vms)
+            self.assertRaises(NotFoundError, inst.vm_lookup, u'kimchi-vm-new')
+
             vm = inst.vm_lookup(u'kimchi-vm')
             self.assertEquals(vm['state'], snap['state'])
 
@@ -963,6 +1163,170 @@ class ModelTests(unittest.TestCase):
             item = session.get('fǒǒ', 'těst1')
             self.assertEquals(2, item[u'α'])
 
+            # Test find, on indexed and not indexed attributes
+            session.store('task', '1', {'status': 'running', 'message': 'a'})
+            session.store('task', '2', {'status': 'finished', 'message': 'b'})
+            session.store('task', '3', {'status': 'running', 'message': 'b'})
+            self.assertEquals(['1', '3'],
+                              sorted(session.find('task', status='running')))
+            self.assertEquals(['3'], session.find('task', status='running',
+                                                  message='b'))
+            self.assertEquals(['2', '3'],
+                              sorted(session.find('task', message='b')))
+
+            session.store('template', 't1', {'networks': ['a', 'b']})
+            session.store('template', 't2', {'networks': ['b']})
+            self.assertEquals(['t1'], session.find('template', networks='a'))
+            self.assertEquals(2, len(session.find('template', networks='b')))
+
+            # the index follows the updates
+            session.store('template', 't1', {'networks': ['c']})
+            self.assertEquals([], session.find('template', networks='a'))
+            session.delete('template', 't2')
+            self.assertEquals([], session.find('template', networks='b'))
+
+            # Test list sorted by an indexed attribute
+            tasks = session.get_list('task', sort_key='status')
+            self.assertEquals(3, len(tasks))
+            self.assertEquals('2', tasks[0])
+
+    def test_object_store_batch(self):
+        store = kimchi.objectstore.ObjectStore(self.tmp_store)
+
+        with store as session:
+            session.store_many('foo', [(str(i), {'i': i}) for i in xrange(5)])
+            items = session.get_many('foo', ['1', '3', 'missing'])
+            self.assertEquals({'1': {'i': 1}, '3': {'i': 3}}, items)
+
+            session.delete_many('foo', ['0', '1', 'missing'])
+            self.assertEquals(['2', '3', '4'], sorted(session.get_list('foo')))
+
+            # the transaction is rolled back if an error occurs
+            try:
+                with session.transaction():
+                    session.store('foo', '5', {'i': 5})
+                    session.delete('foo', '2')
+                    session.delete('foo', 'missing')
+            except NotFoundError:
+                pass
+            self.assertEquals(['2', '3', '4'], sorted(session.get_list('foo')))
+
+            with session.transaction():
+                session.store('foo', '5', {'i': 5})
+                session.delete('foo', '2')
+            self.assertEquals(['3', '4', '5'], sorted(session.get_list('foo')))
+
+    def test_object_store_cache(self):
+        store = kimchi.objectstore.ObjectStore(self.tmp_store,
+                                               cache_capacity={'foo': 2})
+
+        with store as session:
+            session.store_many('foo', [(str(i), {'i': i}) for i in xrange(3)])
+            # the writes are cached, up to the capacity of the type
+            self.assertEquals({'i': 2}, session.get('foo', '2'))
+            self.assertEquals({'i': 1}, session.get('foo', '1'))
+            self.assertEquals({'i': 0}, session.get('foo', '0'))
+            stats = store.get_cache_stats()['foo']
+            self.assertEquals({'capacity': 2, 'size': 2, 'hits': 2,
+                               'misses': 1}, stats)
+
+            # the cached objects are copies
+            session.get('foo', '0')['i'] = 10
+            self.assertEquals({'i': 0}, session.get('foo', '0'))
+
+            # the missing objects are cached too
+            self.assertRaises(NotFoundError, session.get, 'foo', 'missing')
+            self.assertEquals({'0': {'i': 0}},
+                              session.get_many('foo', ['0', 'missing']))
+            self.assertEquals(2, store.get_cache_stats()['foo']['misses'])
+
+            # the writes of a rolled back transaction are not cached
+            try:
+                with session.transaction():
+                    session.store('foo', '1', {'i': 11})
+                    self.assertEquals({'i': 11}, session.get('foo', '1'))
+                    session.delete('foo', 'missing')
+            except NotFoundError:
+                pass
+            self.assertEquals({'i': 1}, session.get('foo', '1'))
+
+            session.delete('foo', '1')
+            self.assertRaises(NotFoundError, session.get, 'foo', '1')
+
+    def test_iso_probe_cache(self):
+        store = kimchi.objectstore.ObjectStore(self.tmp_store)
+        self.assertEquals(('ubuntu', '12.04'),
+                          probe_iso_cached(store, self.kimchi_iso))
+        with store as session:
+            info = session.get('isoinfo', self.kimchi_iso)
+            self.assertTrue(info['bootable'])
+
+            # the stored result is used while the file is unchanged
+            info['distro'] = 'fake'
+            session.store('isoinfo', self.kimchi_iso, info)
+        self.assertEquals(('fake', '12.04'),
+                          probe_iso_cached(store, self.kimchi_iso))
+
+        os.utime(self.kimchi_iso, (info['mtime'] + 1, info['mtime'] + 1))
+        self.assertEquals(('ubuntu', '12.04'),
+                          probe_iso_cached(store, self.kimchi_iso))
+
+        # the probe errors are stored too
+        iso = self.iso_path + 'not-bootable.iso'
+        iso_gen.construct_fake_iso(iso, False, '12.04', 'ubuntu')
+        self.assertRaises(IsoFormatError, probe_iso_cached, store, iso)
+        with store as session:
+            self.assertEquals('KCHISO0002E',
+                              session.get('isoinfo', iso)['error'])
+        self.assertRaises(IsoFormatError, probe_iso_cached, store, iso)
+
+        # the result is deleted with the file
+        os.unlink(iso)
+        self.assertRaises(IsoFormatError, probe_iso_cached, store, iso)
+        with store as session:
+            self.assertRaises(NotFoundError, session.get, 'isoinfo', iso)
+
+    def test_iso_matcher(self):
+        for distro, version, volume_id in [
+                ('ubuntu', '12.04', 'Ubuntu 12.04\x00\x00'),
+                ('fedora', '20', 'Fedora-Live-Desktop-x86_64-20-1'),
+                ('windows', '7', 'GRMCULFRER_EN_DVD'),
+                ('openbsd', '5.5', 'OpenBSD/amd64    5.5 Install CD'),
+                ('rhel', '4.8', 'RHEL/4-U8 RHEL-4.8')]:
+            self.assertEquals((distro, version),
+                              iso_matcher.match(volume_id))
+        self.assertEquals(None, iso_matcher.match('unknown ISO'))
+
+        # the first matching entry wins, wherever it matches
+        matcher = Matcher([('first', lambda m: m.group(1), 'B(\d)'),
+                           ('second', lambda m: m.group(2), '(A)(\d)')])
+        self.assertEquals(('first', '2'), matcher.match('A1 B2'))
+        self.assertEquals(('second', '1'), matcher.match('A1 C2'))
+
+    def test_iso_matcher_baseline(self):
+        def baseline_match(volume_id):
+            # the search of every raw regex, as done before Matcher
+            for distro, version, regex in iso_dir:
+                m = re.search(regex, volume_id)
+                if m:
+                    if hasattr(version, '__call__'):
+                        version = version(m)
+                    return (distro, version)
+            return None
+
+        volume_ids = []
+        for i in xrange(1000):
+            volume_ids.extend(['Ubuntu-Server %d.04 LTS amd64' % i,
+                               'Fedora-Live-Workstation-x86_64-%d-1' % i,
+                               'KIMCHI_%d_NOT_AN_OS %s' % (i, uuid.uuid4()),
+                               'GSP1RMCPRXFRER_%d_DVD' % i])
+
+        # see bench_isoinfo.py for the time comparison
+        self.assertEquals([baseline_match(volume_id)
+                           for volume_id in volume_ids],
+                          [iso_matcher.match(volume_id)
+                           for volume_id in volume_ids])
+
     def test_object_store_threaded(self):
         def worker(ident):
             with store as session:
@@ -980,7 +1344,39 @@ class ModelTests(unittest.TestCase):
             t.join()
         with store as session:
             self.assertEquals(50, len(session.get_list('foo')))
-            self.assertEquals(10, len(store._connections.keys()))
+            self.assertTrue(store._nconns <= store.pool_size)
+
+            # there is a connection for each HTTP request thread
+            self.assertTrue(store.pool_size >=
+                            config.getint('server', 'thread_pool'))
+
+            # the nested sessions share the connection of the thread
+            with store as nested:
+                self.assertEquals(session.conn, nested.conn)
+
+    def test_object_store_pool_timeout(self):
+        def worker():
+            try:
+                with store:
+                    pass
+            except OperationFailed:
+                errors.append(True)
+
+        store = kimchi.objectstore.ObjectStore(self.tmp_store, pool_size=1)
+        store.POOL_TIMEOUT = 0.1
+        errors = []
+        with store:
+            # the only connection is in use
+            t = threading.Thread(target=worker)
+            t.start()
+            t.join()
+        self.assertEquals([True], errors)
+
+        # the connection is available again
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+        self.assertEquals([True], errors)
 
     def test_get_interfaces(self):
         inst = model.Model('test:///default',
@@ -1081,6 +1477,226 @@ class ModelTests(unittest.TestCase):
         inst.task_wait(taskid, timeout=10)
         self.assertEquals('finished', inst.task_lookup(taskid)['status'])
 
+    def test_async_tasks_progress(self):
+        def progress_op(cb, event):
+            cb('step 1')
+            cb('step 2')
+            event.wait()
+            cb('done', True)
+
+        inst = model.Model('test:///default',
+                           objstore_loc=self.tmp_store)
+        event = threading.Event()
+        taskid = add_task('', progress_op, inst.objstore, event)
+        try:
+            for i in xrange(50):
+                if inst.task_lookup(taskid)['message'] == 'step 2':
+                    break
+                time.sleep(0.1)
+            self.assertEquals('step 2', inst.task_lookup(taskid)['message'])
+
+            # the progress messages are not written to the object store at
+            # once, but the state transitions are
+            with inst.objstore as session:
+                task = session.get('task', str(taskid))
+            self.assertEquals('running', task['status'])
+            self.assertEquals('OK', task['message'])
+
+            # but the last one is written and notified at the end of the
+            # interval
+            first = generation = notifier.get_generation('tasks')
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                generation = notifier.wait(generation,
+                                           deadline - time.time(), 'tasks')
+                with inst.objstore as session:
+                    task = session.get('task', str(taskid))
+                if task['message'] == 'step 2':
+                    break
+            self.assertEquals('step 2', task['message'])
+            self.assertTrue(generation > first)
+        finally:
+            event.set()
+
+        inst.task_wait(taskid)
+        with inst.objstore as session:
+            task = session.get('task', str(taskid))
+        self.assertEquals('finished', task['status'])
+        self.assertEquals('done', task['message'])
+
+    def test_async_tasks_retention(self):
+        def quick_op(cb, message):
+            cb(message, True)
+
+        inst = model.Model('test:///default',
+                           objstore_loc=self.tmp_store)
+        taskids = []
+        for i in xrange(3):
+            taskids.append(str(add_task('', quick_op, inst.objstore, 'OK')))
+            inst.task_wait(taskids[-1])
+
+        # a single thread sweeps the tasks of an object store
+        tasks = TasksModel(objstore=inst.objstore)
+        self.assertEquals(tasks_sweepers[inst.objstore], tasks.sweeper)
+
+        tasks.max_finished = 1
+        tasks._sweep_tasks()
+        self.assertEquals(set(taskids[-1:]),
+                          set(taskids) & set(inst.tasks_get_list()))
+
+        tasks.finished_ttl = 0
+        tasks._sweep_tasks()
+        self.assertEquals(set(), set(taskids) & set(inst.tasks_get_list()))
+
+    def test_async_tasks_scheduler(self):
+        def wait_op(cb, event):
+            event.wait()
+            cb('OK', True)
+
+        inst = model.Model('test:///default',
+                           objstore_loc=self.tmp_store)
+        event = threading.Event()
+        scheduler.limits['test'] = 1
+        try:
+            first = add_task('', wait_op, inst.objstore, event, 'test')
+            second = add_task('', wait_op, inst.objstore, event, 'test')
+            third = add_task('', wait_op, inst.objstore, event, 'test')
+            self.assertEquals('running', inst.task_lookup(first)['status'])
+            self.assertEquals('queued', inst.task_lookup(second)['status'])
+
+            # only the queued tasks can be cancelled
+            inst.task_cancel(third)
+            self.assertEquals('failed', inst.task_lookup(third)['status'])
+            self.assertEquals('Cancelled', inst.task_lookup(third)['message'])
+            self.assertRaises(InvalidOperation, inst.task_cancel, first)
+            self.assertRaises(TimeoutExpired, inst.task_wait, first, 0.1)
+        finally:
+            event.set()
+            del scheduler.limits['test']
+
+        inst.task_wait(second)
+        self.assertEquals('finished', inst.task_lookup(second)['status'])
+
+    def test_async_tasks_scheduler_save_error(self):
+        class FakeTask(object):
+            category = 'test'
+            opaque = None
+
+            def __init__(self, id, fail):
+                self.id = id
+                self.fail = fail
+                self.results = []
+                self.done = threading.Event()
+
+            def _save_helper(self):
+                if self.fail:
+                    raise OperationFailed('KCHASYNC0002E', {'err': 'full'})
+
+            def _status_cb(self, message, success=None):
+                self.results.append(success)
+                self.done.set()
+
+            def _run_helper(self, opaque, cb):
+                cb('OK', True)
+
+        sched = TaskScheduler(1)
+        failed = FakeTask('1', True)
+        sched.submit(failed)
+        self.assertEquals([False], failed.results)
+        self.assertEquals(0, sched._running)
+        self.assertEquals(0, sched._running_by_category['test'])
+
+        # the failed task does not hold the only worker
+        task = FakeTask('2', False)
+        sched.submit(task)
+        self.assertTrue(task.done.wait(5))
+        self.assertEquals([True], task.results)
+
+    def test_pool_refresher(self):
+        class FakePool(object):
+            refreshes = 0
+
+            def name(self):
+                return 'pool'
+
+            def refresh(self, flags):
+                self.refreshes += 1
+
+        refresher = PoolRefresher(60)
+        pool = FakePool()
+        refresher.refresh(pool)
+        refresher.refresh(pool)
+        self.assertEquals(1, pool.refreshes)
+
+        # a change made through kimchi or force makes it refresh again
+        refresher.mark_dirty('pool')
+        refresher.refresh(pool)
+        self.assertEquals(2, pool.refreshes)
+        refresher.refresh(pool, force=True)
+        self.assertEquals(3, pool.refreshes)
+
+    def test_screenshot_refresher_backoff(self):
+        class FakeScreenshot(object):
+            vm_uuid = 'vm'
+            refreshes = 0
+            fail = True
+
+            def refresh(self):
+                self.refreshes += 1
+                if self.fail:
+                    raise OSError('no screenshot')
+                return True
+
+        refresher = ScreenshotRefresher(1)
+        screenshot = FakeScreenshot()
+        self.assertTrue(refresher.refresh(screenshot).wait(5))
+        self.assertEquals(1, screenshot.refreshes)
+
+        # the failed VM is not refreshed again during the backoff delay
+        self.assertTrue(refresher.refresh(screenshot).wait(5))
+        self.assertEquals(1, screenshot.refreshes)
+
+        # after the delay it is refreshed, and a success clears the backoff
+        refresher._failures['vm'] = (1, time.time() - 60)
+        screenshot.fail = False
+        self.assertTrue(refresher.refresh(screenshot).wait(5))
+        self.assertEquals(2, screenshot.refreshes)
+        self.assertTrue(refresher.refresh(screenshot).wait(5))
+        self.assertEquals(3, screenshot.refreshes)
+
+    def test_screenshot_refresher_black_image(self):
+        class FailingScreenshot(VMScreenshot):
+            scratches = 0
+            saved = None
+
+            def _get_scratch(self):
+                self.scratches += 1
+                raise OSError('no screenshot')
+
+            def _save_thumbnail(self, image, thumbnail):
+                self.saved = thumbnail
+
+            def _clean_extra(self, window=-1):
+                pass
+
+        stream_test_result = kimchi.screenshot.stream_test_result
+        kimchi.screenshot.stream_test_result = True
+        try:
+            refresher = ScreenshotRefresher(1)
+            screenshot = FailingScreenshot({'uuid': 'vm'})
+            stored = []
+            event = refresher.refresh(screenshot, stored.append)
+            self.assertTrue(event.wait(5))
+
+            # the black image is stored, but the VM is backed off
+            self.assertEquals([screenshot], stored)
+            self.assertEquals(screenshot.saved, screenshot.info['thumbnail'])
+            self.assertEquals(1, refresher._failures['vm'][0])
+            self.assertTrue(refresher.refresh(screenshot).wait(5))
+            self.assertEquals(1, screenshot.scratches)
+        finally:
+            kimchi.screenshot.stream_test_result = stream_test_result
+
     @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
     def test_delete_running_vm(self):
         inst = model.Model(objstore_loc=self.tmp_store)
@@ -1121,6 +1737,124 @@ class ModelTests(unittest.TestCase):
 
             self.assertEquals(vms, sorted(vms, key=unicode.lower))
 
+    @unittest.skipUnless(utils.running_as_root(), 'Must be run as root')
+    def test_vm_inventory(self):
+        inst = model.Model(objstore_loc=self.tmp_store)
+
+        def libvirt_vms():
+            conn = inst.conn.get()
+            return sorted([dom.name().decode('utf-8')
+                           for dom in conn.listAllDomains(0)],
+                          key=unicode.lower)
+
+        with RollbackContext() as rollback:
+            params = {'name': 'test', 'disks': [], 'cdrom': self.kimchi_iso}
+            inst.templates_create(params)
+            rollback.prependDefer(inst.template_delete, 'test')
+
+            params = {'name': u'kīмсhī-∨м', 'template': '/templates/test'}
+            inst.vms_create(params)
+            rollback.prependDefer(inst.vm_delete, u'kīмсhī-∨м')
+
+            self.assertEquals(libvirt_vms(), inst.vms_get_list())
+            self.assertEquals('shutoff', inst.vm_lookup(u'kīмсhī-∨м')['state'])
+
+            # the disks are indexed by path
+            inventory = DomainInventory.get_inventory(inst.conn)
+            self.assertEquals([u'kīмсhī-∨м'],
+                              inventory.get_disk_users(self.kimchi_iso))
+
+            # the access metadata is read from the inventory descriptor
+            access = {'users': ['root'], 'groups': ['root']}
+            inst.vm_update(u'kīмсhī-∨м', access)
+            info = inst.vm_lookup(u'kīмсhī-∨м')
+            self.assertEquals((['root'], ['root']),
+                              (info['users'], info['groups']))
+            info = dict(inst.vms_get_list_detailed())[u'kīмсhī-∨м']
+            self.assertEquals((['root'], ['root']),
+                              (info['users'], info['groups']))
+            inst.vm_update(u'kīмсhī-∨м', {'users': [], 'groups': []})
+
+            inst.vm_update(u'kīмсhī-∨м', {'name': u'kīмсhī-∨м-new'})
+            self.assertEquals(libvirt_vms(), inst.vms_get_list())
+            self.assertIn(u'kīмсhī-∨м-new', inst.vms_get_list())
+            self.assertRaises(NotFoundError, inst.vm_lookup, u'kīмсhī-∨м')
+            inst.vm_update(u'kīмсhī-∨м-new', {'name': u'kīмсhī-∨м'})
+
+            inst.vm_start(u'kīмсhī-∨м')
+            self.assertEquals('running', inst.vm_lookup(u'kīмсhī-∨м')['state'])
+            inst.vm_poweroff(u'kīмсhī-∨м')
+            self.assertEquals('shutoff', inst.vm_lookup(u'kīмсhī-∨м')['state'])
+
+        self.assertEquals(libvirt_vms(), inst.vms_get_list())
+        self.assertNotIn(u'kīмсhī-∨м', inst.vms_get_list())
+
+    def test_inventory_disk_users(self):
+        class FakeDomain(object):
+            def __init__(self, name, path):
+                self._name = name
+                self.path = path
+                self.parsed = 0
+
+            def name(self):
+                return self._name
+
+            def UUIDString(self):
+                return self._name
+
+            def XMLDesc(self, flags):
+                self.parsed += 1
+                return ("<domain><devices><disk type='file' device='disk'>"
+                        "<source file='%s'/></disk></devices></domain>" %
+                        self.path)
+
+        class FakeConnection(object):
+            uri = 'fake:///inventory'
+
+            def __init__(self, doms):
+                self.doms = doms
+
+            def get(self):
+                return self
+
+            def listAllDomains(self, flags):
+                return self.doms
+
+            def domainEventRegisterAny(self, dom, event_id, cb, opaque):
+                pass
+
+        dom_a = FakeDomain('a', '/a.img')
+        dom_b = FakeDomain('b', '/b.img')
+        conn = FakeConnection([dom_a, dom_b])
+        inventory = DomainInventory(conn)
+        try:
+            self.assertEquals(['a'], inventory.get_disk_users('/a.img'))
+            self.assertEquals(['b'], inventory.get_disk_users('/b.img'))
+            self.assertEquals((1, 1), (dom_a.parsed, dom_b.parsed))
+
+            # a lifecycle event only indexes its domain again
+            inventory._lifecycle_cb(conn, dom_b,
+                                    libvirt.VIR_DOMAIN_EVENT_STARTED, 0, None)
+            self.assertEquals(['a'], inventory.get_disk_users('/a.img'))
+            self.assertEquals((1, 2), (dom_a.parsed, dom_b.parsed))
+
+            dom_a.path = '/c.img'
+            inventory.invalidate('a')
+            self.assertEquals([], inventory.get_disk_users('/a.img'))
+            self.assertEquals(['a'], inventory.get_disk_users('/c.img'))
+            self.assertEquals((2, 2), (dom_a.parsed, dom_b.parsed))
+
+            dom_b.path = '/c.img'
+            inventory.update_domain(dom_b)
+            self.assertEquals(['a', 'b'],
+                              sorted(inventory.get_disk_users('/c.img')))
+
+            inventory.remove_domain('a')
+            self.assertEquals(['b'], inventory.get_disk_users('/c.img'))
+            self.assertEquals((2, 3), (dom_a.parsed, dom_b.parsed))
+        finally:
+            DomainInventory._inventories.pop(conn.uri)
+
     def test_vm_clone(self):
         inst = model.Model('test:///default', objstore_loc=self.tmp_store)
 
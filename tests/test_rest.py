@@ -34,6 +34,8 @@ from functools import partial
 import iso_gen
 import kimchi.mockmodel
 import kimchi.server
+from kimchi.model.vms import VMModel
+from kimchi.notifier import notifier
 from kimchi.rollbackcontext import RollbackContext
 from kimchi.utils import add_task
 from utils import fake_auth_header, get_free_port, patch_auth, request
@@ -164,6 +166,14 @@ class RestTests(unittest.TestCase):
         # Mockmodel brings 3 preconfigured scsi fc_host
         self.assertEquals(3, len(nodedevs))
 
+        # the collection parameters are accepted by every collection
+        resp = self.request('/host/devices?_cap=scsi_host&_fields=name&'
+                            '_sort=-name&_offset=1&_limit=1')
+        self.assertEquals(200, resp.status)
+        nodedevs = json.loads(resp.read())
+        self.assertEquals(1, len(nodedevs))
+        self.assertEquals(['name'], nodedevs[0].keys())
+
         nodedev = json.loads(self.request('/host/devices/scsi_host2').read())
         # Mockmodel generates random wwpn and wwnn
         self.assertEquals('scsi_host2', nodedev['name'])
@@ -201,6 +211,136 @@ class RestTests(unittest.TestCase):
         self.assertEquals([], vm['users'])
         self.assertEquals([], vm['groups'])
 
+        # Sparse fieldsets
+        vms = json.loads(self.request('/vms?_fields=name,state').read())
+        self.assertEquals(11, len(vms))
+        for vm in vms:
+            self.assertEquals(set(['name', 'state']), set(vm.keys()))
+
+        # an admin is authorized without the access metadata, so the domain
+        # descriptors are not parsed when the users and groups are not listed
+        access_calls = []
+
+        def get_access_info(dom, caps, root=None):
+            access_calls.append(dom.name())
+            return get_access_info_orig(dom, caps, root)
+
+        get_access_info_orig = VMModel._get_access_info
+        VMModel._get_access_info = staticmethod(get_access_info)
+        try:
+            resp = self.request('/vms?_fields=name,state')
+            self.assertEquals(11, len(json.loads(resp.read())))
+            self.assertEquals([], access_calls)
+
+            resp = self.request('/vms?_fields=name,users')
+            self.assertEquals(11, len(json.loads(resp.read())))
+            self.assertEquals(11, len(access_calls))
+        finally:
+            VMModel._get_access_info = staticmethod(get_access_info_orig)
+
+        resp = self.request('/vms?_fields=name&state=shutoff')
+        vms = json.loads(resp.read())
+        self.assertEquals(10, len(vms))
+        self.assertEquals([{'name': 'vm-0'}], vms[:1])
+
+        vm = json.loads(self.request('/vms/vm-1?_fields=name,stats').read())
+        self.assertEquals(set(['name', 'stats']), set(vm.keys()))
+
+        resp = self.request('/networks/default?_fields=name,state')
+        network = json.loads(resp.read())
+        self.assertEquals({'name': 'default', 'state': 'active'}, network)
+
+        # Paging and sorting
+        resp = self.request('/vms?_fields=name&_offset=2&_limit=3')
+        vms = json.loads(resp.read())
+        self.assertEquals(['vm-1', 'vm-2', 'vm-3'],
+                          [item['name'] for item in vms])
+
+        resp = self.request('/vms?_fields=name&_sort=-name&_limit=2')
+        vms = json.loads(resp.read())
+        self.assertEquals(['vm-9', 'vm-8'], [item['name'] for item in vms])
+
+        resp = self.request('/vms?_fields=name&state=running')
+        vms = json.loads(resp.read())
+        self.assertEquals(['test'], [item['name'] for item in vms])
+
+        resp = self.request('/vms?_fields=name&state=running&state=paused')
+        self.assertEquals(200, resp.status)
+        vms = json.loads(resp.read())
+        self.assertEquals(['test'], [item['name'] for item in vms])
+
+        resp = self.request('/vms?_limit=-1')
+        self.assertEquals(400, resp.status)
+
+        # Statistics history
+        resp = self.request('/vms/test/statshistory')
+        self.assertEquals(200, resp.status)
+        history = json.loads(resp.read())
+        self.assertEquals(5, history['interval'])
+        self.assertEquals(2, len(history['tiers']))
+        for key in ['timestamp', 'cpu_utilization', 'net_throughput',
+                    'io_throughput']:
+            self.assertEquals(len(history['timestamp']), len(history[key]))
+
+    def test_etag(self):
+        resp = self.request('/vms')
+        self.assertEquals(200, resp.status)
+        etag = resp.getheader('etag')
+        self.assertTrue(etag)
+        vms = resp.read()
+
+        headers = {'Accept': 'application/json', 'If-None-Match': etag}
+        resp = self.request('/vms', headers=headers)
+        self.assertEquals(304, resp.status)
+        self.assertEquals('', resp.read())
+
+        # the tag changes with the representation
+        req = json.dumps({'name': 'test', 'cdrom': fake_iso})
+        resp = self.request('/templates', req, 'POST')
+        self.assertEquals(201, resp.status)
+        req = json.dumps({'name': 'vm-1', 'template': '/templates/test'})
+        resp = self.request('/vms', req, 'POST')
+        self.assertEquals(201, resp.status)
+
+        resp = self.request('/vms', headers=headers)
+        self.assertEquals(200, resp.status)
+        self.assertNotEquals(etag, resp.getheader('etag'))
+        self.assertNotEquals(vms, resp.read())
+
+        resp = self.request('/vms/vm-1', headers=headers)
+        self.assertEquals(200, resp.status)
+        headers['If-None-Match'] = resp.getheader('etag')
+        resp = self.request('/vms/vm-1', headers=headers)
+        self.assertEquals(304, resp.status)
+
+    def test_etag_generation(self):
+        # the responses of a tracked topic are tagged with its generation
+        notifier.track('storagepools')
+        try:
+            resp = self.request('/storagepools')
+            self.assertEquals(200, resp.status)
+            etag = resp.getheader('etag')
+            self.assertTrue(etag)
+
+            headers = {'Accept': 'application/json', 'If-None-Match': etag}
+            resp = self.request('/storagepools', headers=headers)
+            self.assertEquals(304, resp.status)
+
+            resp = self.request('/storagepools?_fields=name', headers=headers)
+            self.assertEquals(200, resp.status)
+
+            notifier.notify('storagepools')
+            resp = self.request('/storagepools', headers=headers)
+            self.assertEquals(200, resp.status)
+            self.assertNotEquals(etag, resp.getheader('etag'))
+
+            resp = self.request('/storagepools/default-pool')
+            headers['If-None-Match'] = resp.getheader('etag')
+            resp = self.request('/storagepools/default-pool', headers=headers)
+            self.assertEquals(304, resp.status)
+        finally:
+            notifier.track('storagepools', False)
+
     def test_edit_vm(self):
         req = json.dumps({'name': 'test', 'cdrom': fake_iso})
         resp = self.request('/templates', req, 'POST')
@@ -1392,6 +1532,25 @@ class RestTests(unittest.TestCase):
         self.assertEquals('in progress', foo3['message'])
         self.assertEquals('running', foo3['status'])
 
+    def test_tasks_wait(self):
+        taskid = add_task('/tasks/1', self._async_op, model.objstore)
+        resp = self.request('/tasks/%s' % taskid)
+        self.assertEquals('running', json.loads(resp.read())['status'])
+
+        # the request returns as soon as the task changes
+        headers = {'Accept': 'application/json',
+                   'If-None-Match': resp.getheader('etag')}
+        resp = self.request('/tasks/%s?_wait=10' % taskid, headers=headers)
+        self.assertEquals(200, resp.status)
+        self.assertEquals('finished', json.loads(resp.read())['status'])
+
+        # or answers "304 Not Modified" when the time is over
+        headers['If-None-Match'] = resp.getheader('etag')
+        resp = self.request('/tasks/%s?_wait=1' % taskid, headers=headers)
+        self.assertEquals(304, resp.status)
+
+        self.assertHTTPStatus(400, '/tasks/%s?_wait=-1' % taskid)
+
     def test_config(self):
         resp = self.request('/config').read()
         conf = json.loads(resp)
@@ -1665,6 +1824,13 @@ class RestTests(unittest.TestCase):
         self.assertEquals(2, len(res))
         self.assertIn('test-vm1', [r['name'] for r in res])
 
+        # a filter which is not a valid regular expression is matched as is
+        resp = request(host, ssl_port, '/vms?name=test-vm1(')
+        self.assertEquals(200, resp.status)
+        res = json.loads(resp.read())
+        self.assertEquals(set(['test', 'test-vm1']),
+                          set([r['name'] for r in res]))
+
     def test_repositories(self):
         def verify_repo(t, res):
             for field in ('repo_id', 'enabled', 'baseurl', 'config'):
@@ -0,0 +1,66 @@
+#
+# Project Kimchi
+#
+# Copyright IBM, Corp. 2015
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+import unittest
+
+from kimchi.statshistory import RingBuffer, StatsHistory
+
+
+class StatsHistoryTests(unittest.TestCase):
+    def test_ring_buffer(self):
+        buf = RingBuffer(3)
+        self.assertEquals([], buf.get())
+
+        buf.append(1)
+        buf.append(2)
+        self.assertEquals([1, 2], buf.get())
+
+        for i in xrange(3, 6):
+            buf.append(i)
+        self.assertEquals(3, len(buf))
+        self.assertEquals([3, 4, 5], buf.get())
+
+    def test_stats_history(self):
+        history = StatsHistory(['cpu', 'io'], 5, 3, tiers=2, factor=2)
+        for i in xrange(10):
+            history.append(i, {'cpu': i, 'io': 2 * i})
+
+        data = history.get()
+        self.assertEquals(5, data['interval'])
+        self.assertEquals([7, 8, 9], data['timestamp'])
+        self.assertEquals([7, 8, 9], data['cpu'])
+        self.assertEquals([14, 16, 18], data['io'])
+
+        tier = data['tiers'][0]
+        self.assertEquals(10, tier['interval'])
+        self.assertEquals([5, 7, 9], tier['timestamp'])
+        self.assertEquals([4.5, 6.5, 8.5], tier['cpu'])
+        self.assertEquals([9, 13, 17], tier['io'])
+
+        tier = data['tiers'][1]
+        self.assertEquals(20, tier['interval'])
+        self.assertEquals([3, 7], tier['timestamp'])
+        self.assertEquals([1.5, 5.5], tier['cpu'])
+        self.assertEquals([3, 11], tier['io'])
+
+    def test_no_tiers(self):
+        history = StatsHistory(['cpu'], 5, 2)
+        history.append(1, {'cpu': 10})
+        self.assertEquals({'interval': 5, 'timestamp': [1], 'cpu': [10],
+                           'tiers': []}, history.get())
@@ -38,14 +38,54 @@ var kimchi = {
      *     After login, the Ajax request for /vms will be resent without
      *     user clicking the tab again.
      *       Default to false.
+     *
+     *   etag: for GET requests handled by a success callback, keep the
+     *     response and its ETag, so the server only sends the response
+     *     again when it has changed. It's useful for the requests which are
+     *     repeated periodically (guests list, host stats, tasks, etc.).
+     *       Default to false.
      */
     requestJSON : function(settings) {
         settings['originalError'] = settings['error'];
         settings['error'] = null;
         settings['kimchi'] = true;
+        if (settings['etag'] && settings['success']) {
+            kimchi.revalidate(settings);
+        }
         return $.ajax(settings);
     },
 
+    /**
+     * Responses kept by the requests with the etag setting, by URL. The
+     * response of a task is dropped once the task is over (see getTask).
+     */
+    etagCache: {},
+
+    revalidate : function(settings) {
+        var url = settings['url'];
+        var cached = kimchi.etagCache[url];
+        var success = settings['success'];
+        if (cached) {
+            settings['headers'] = $.extend({}, settings['headers'], {
+                'If-None-Match': cached['etag']
+            });
+        }
+        settings['success'] = function(data, textStatus, xhr) {
+            if (xhr.status === 304 && cached) {
+                data = JSON.parse(cached['text']);
+            } else {
+                var etag = xhr.getResponseHeader('ETag');
+                if (etag) {
+                    kimchi.etagCache[url] = {
+                        etag: etag,
+                        text: xhr.responseText
+                    };
+                }
+            }
+            success(data, textStatus, xhr);
+        };
+    },
+
     /**
      *
      * Get host capabilities
@@ -104,6 +144,7 @@ var kimchi = {
             contentType : 'application/json',
             headers: {'Kimchi-Robot': 'kimchi-robot'},
             dataType : 'json',
+            etag: true,
             success : suc,
             error: err
         });
@@ -404,14 +445,19 @@ var kimchi = {
         });
     },
 
-    listVMs : function(suc, err) {
-        kimchi.requestJSON({
-            url : kimchi.url + 'vms',
+    /**
+     * List the guests. If wait is given, the server waits at most wait
+     * seconds for the list to change from the last one received.
+     */
+    listVMs : function(suc, err, wait) {
+        return kimchi.requestJSON({
+            url : kimchi.url + 'vms' + (wait ? '?_wait=' + wait : ''),
             type : 'GET',
             contentType : 'application/json',
             headers: {'Kimchi-Robot': 'kimchi-robot'},
             dataType : 'json',
             resend: true,
+            etag: true,
             success : suc,
             error : err
         });
@@ -501,7 +547,7 @@ var kimchi = {
                             }
                             suc(isos, true);
                         }, err);
-                    } else if (status === "running") {
+                    } else if (status === "queued" || status === "running") {
                         if (deepScanHandler.stop) {
                             return;
                         }
@@ -525,13 +571,28 @@ var kimchi = {
         return deepScanHandler;
     },
 
-    getTask : function(taskId, suc, err) {
+    /**
+     * Get a task. If wait is given, the server waits at most wait seconds
+     * for the task to change from the last state received.
+     */
+    getTask : function(taskId, suc, err, wait) {
+        var url = kimchi.url + 'tasks/' + encodeURIComponent(taskId) +
+            (wait ? '?_wait=' + wait : '');
         kimchi.requestJSON({
-            url : kimchi.url + 'tasks/' + encodeURIComponent(taskId),
+            url : url,
             type : 'GET',
             contentType : 'application/json',
             dataType : 'json',
-            success : suc,
+            etag: true,
+            success : function(result, textStatus, xhr) {
+                // a task does not change once it is over, so its last
+                // response is not kept
+                var status = result['status'];
+                if (status !== 'queued' && status !== 'running') {
+                    delete kimchi.etagCache[url];
+                }
+                suc && suc(result, textStatus, xhr);
+            },
             error : err
         });
     },
@@ -542,6 +603,7 @@ var kimchi = {
             type : 'GET',
             contentType : 'application/json',
             dataType : 'json',
+            etag: true,
             async : !sync,
             success : suc,
             error : err
@@ -688,11 +750,11 @@ var kimchi = {
         var onTaskResponse = function(result) {
             var taskStatus = result['status'];
             switch(taskStatus) {
+            case 'queued':
             case 'running':
                 progress && progress(result);
-                setTimeout(function() {
-                    kimchi.trackTask(taskID, suc, err, progress);
-                }, 2000);
+                // the next request returns as soon as the task changes
+                kimchi.trackTask(taskID, suc, err, progress);
                 break;
             case 'finished':
                 suc && suc(result);
@@ -705,7 +767,7 @@ var kimchi = {
             }
         };
 
-        kimchi.getTask(taskID, onTaskResponse, err);
+        kimchi.getTask(taskID, onTaskResponse, err, 30);
         if(kimchi.trackingTasks.indexOf(taskID) < 0)
             kimchi.trackingTasks.push(taskID);
     },
@@ -919,6 +981,7 @@ var kimchi = {
         var onTaskResponse = function(result) {
             var taskStatus = result['status'];
             switch(taskStatus) {
+            case 'queued':
             case 'running':
                 progress && progress(result);
                 setTimeout(function() {
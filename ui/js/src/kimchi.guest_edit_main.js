@@ -592,7 +592,7 @@ kimchi.guest_edit_main = function() {
                 });
         };
         var listGeneratingSnapshots = function(){
-            kimchi.getTasksByFilter('status=running&target_uri='+encodeURIComponent('^/snapshots/*'), function(tasks) {
+            kimchi.getTasksByFilter('status=queued|running&target_uri='+encodeURIComponent('^/snapshots/*'), function(tasks) {
                 $(".task", "#form-guest-edit-snapshot").empty();
                 for(var i=0;i<tasks.length;i++){
                     addOngoingItem(tasks[i]);
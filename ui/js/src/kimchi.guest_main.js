@@ -203,7 +203,7 @@ kimchi.listVmsAuto = function() {
     }
     var getCloningGuests = function(){
         var guests = [];
-        kimchi.getTasksByFilter('status=running&target_uri='+encodeURIComponent('^/vms/*'), function(tasks) {
+        kimchi.getTasksByFilter('status=queued|running&target_uri='+encodeURIComponent('^/vms/*'), function(tasks) {
             for(var i=0;i<tasks.length;i++){
                 var guestUri = tasks[i].target_uri;
                 var guestName = guestUri.substring(guestUri.lastIndexOf('/')+1, guestUri.length);
@@ -216,7 +216,12 @@ kimchi.listVmsAuto = function() {
         }, null, true);
         return guests;
     };
-    kimchi.listVMs(function(result, textStatus, jqXHR) {
+    if (kimchi.vmRequest) {
+        kimchi.vmRequest.abort();
+    }
+    // the request returns as soon as the list changes, or after 30 seconds
+    kimchi.vmRequest = kimchi.listVMs(function(result, textStatus, jqXHR) {
+        kimchi.vmRequest = null;
         if (result && textStatus=="success") {
             result = getCloningGuests().concat(result);
             if(result.length) {
@@ -238,13 +243,17 @@ kimchi.listVmsAuto = function() {
             }
         }
 
-        kimchi.vmTimeout = window.setTimeout("kimchi.listVmsAuto();", 5000);
+        kimchi.vmTimeout = window.setTimeout("kimchi.listVmsAuto();", 1000);
     }, function(errorResponse, textStatus, errorThrown) {
+        kimchi.vmRequest = null;
+        if (textStatus == "abort") {
+            return;
+        }
         if(errorResponse.responseJSON && errorResponse.responseJSON.reason) {
             kimchi.message.error(errorResponse.responseJSON.reason);
         }
         kimchi.vmTimeout = window.setTimeout("kimchi.listVmsAuto();", 5000);
-    });
+    }, 30);
 };
 
 kimchi.createGuestLi = function(vmObject, prevScreenImage, openMenu) {
@@ -393,6 +402,7 @@ kimchi.guest_main = function() {
     kimchi.guestElem=$('<div/>').html(kimchi.guestTemplate).find('li');
     $('#guests-root-container').on('remove', function() {
         kimchi.vmTimeout && clearTimeout(kimchi.vmTimeout);
+        kimchi.vmRequest && kimchi.vmRequest.abort();
     });
     kimchi.listVmsAuto()
 };
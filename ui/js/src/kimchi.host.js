@@ -389,7 +389,7 @@ kimchi.host_main = function() {
 
     var getPendingReports = function() {
         var reports = []
-        var filter = 'status=running&target_uri=' + encodeURIComponent('^/debugreports/*')
+        var filter = 'status=queued|running&target_uri=' + encodeURIComponent('^/debugreports/*')
 
         kimchi.getTasksByFilter(filter, function(tasks) {
             for(var i = 0; i < tasks.length; i++) {
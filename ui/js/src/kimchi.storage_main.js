@@ -202,7 +202,7 @@ kimchi.doListVolumes = function(poolObj) {
 
     var getOngoingVolumes = function() {
         var result = {}
-        var filter = 'status=running&target_uri=' + encodeURIComponent('^/storagepools/' + poolName + '/*')
+        var filter = 'status=queued|running&target_uri=' + encodeURIComponent('^/storagepools/' + poolName + '/*')
         kimchi.getTasksByFilter(filter, function(tasks) {
             for(var i = 0; i < tasks.length; i++) {
                 var volumeName = tasks[i].target_uri.split('/').pop();